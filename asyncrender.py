@@ -0,0 +1,96 @@
+import asyncio
+
+
+class AsyncRenderer(object):
+    """
+    Renders pages without blocking the event loop.
+
+    Layout, rasterization and file output run on the executor (default
+    executor of the loop if it is None). At most max_concurrency renders
+    are in flight at once, the others wait for a free slot. A render that
+    is cancelled or timed out while waiting, or while it is still queued in
+    the executor, is abandoned without being started. A render that has
+    started keeps its slot until it finishes, even if it was timed out.
+    """
+
+    def __init__(self, executor=None, max_concurrency=4):
+        """
+        :type executor: concurrent.futures.Executor
+        :type max_concurrency: int
+        """
+        assert max_concurrency >= 1
+
+        self.__executor = executor
+        self.__limiter = asyncio.Semaphore(max_concurrency)
+        self.__pending = 0
+
+    @property
+    def pending(self):
+        """
+        Number of renders that are waiting for a slot or being rendered
+        """
+        return self.__pending
+
+    async def render(self, page, texts, imagefile=None, timeout=None):
+        """
+        Renders texts on page and saves result to imagefile
+
+        :type page: text.Page
+        :type texts: list[text.Text]
+        :param imagefile: file to save image to, image isn't saved if None
+        :param timeout: seconds the render may take including waiting for a slot
+        :return: keywords bounding boxes
+        :rtype: dict
+        :raises asyncio.TimeoutError: render didn't finish in time
+        """
+        self.__pending += 1
+        try:
+            return await asyncio.wait_for(self.__render(page, texts, imagefile), timeout)
+        finally:
+            self.__pending -= 1
+
+    async def __render(self, page, texts, imagefile):
+        loop = asyncio.get_running_loop()
+        abandoned = []
+
+        def render():
+            if abandoned:
+                return None
+            result = page.render(texts)
+            if imagefile is not None:
+                result.save(imagefile)
+            return result
+
+        # the slot is released when the executor job finishes, not when the
+        # awaiting task is cancelled, the job keeps running after a timeout
+        await self.__limiter.acquire()
+        try:
+            future = loop.run_in_executor(self.__executor, render)
+        except BaseException:
+            self.__limiter.release()
+            raise
+        future.add_done_callback(self.__release)
+
+        try:
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            abandoned.append(True)
+            raise
+        return result.bbox
+
+    def __release(self, future):
+        self.__limiter.release()
+        if not future.cancelled():
+            # retrieved so that errors of abandoned renders aren't reported as unhandled
+            future.exception()
+
+
+async def render_async(page, texts, imagefile=None, timeout=None, executor=None):
+    """
+    Renders texts on page on the executor, see AsyncRenderer.render.
+    Concurrency isn't bounded across calls, every call gets its own slot;
+    use one AsyncRenderer for a bound.
+
+    :rtype: dict
+    """
+    return await AsyncRenderer(executor, max_concurrency=1).render(page, texts, imagefile, timeout)
@@ -0,0 +1,290 @@
+import glob
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy
+from numpy.lib.format import open_memmap
+
+from costmodel import StealingQueues, page_features, shared_cost_model
+
+BOX_COLUMNS = ("page", "keyword", "x0", "y0", "x1", "y1")
+
+
+def boxes_filename(filename):
+    return os.path.splitext(filename)[0] + ".boxes.npz"
+
+
+def cost_report_filename(filename):
+    return os.path.splitext(filename)[0] + ".cost.json"
+
+
+def _part_pattern(filename):
+    return os.path.splitext(filename)[0] + ".boxes.*.part.npz"
+
+
+class BatchSink(object):
+    """
+    Rendered pages written straight into a numpy.memmap file of shape
+    (count, height, width, 4) (.npy format), keywords bounding boxes
+    collected into a companion columnar file with columns page, keyword,
+    x0, y0, x1, y1 and the list of keywords the keyword ids refer to.
+
+    Every process opens the file by name and writes its own pages, so
+    pixels aren't passed between processes. Boxes of every sink are saved
+    to a part file, collect merges parts into the boxes file.
+    """
+
+    def __init__(self, filename, part=None):
+        """
+        Opens existing batch file for writing, see BatchSink.create
+
+        :type filename: str
+        :param part: name of part file boxes of this sink are saved to, process id if None
+        """
+        self.__filename = filename
+        self.__images = open_memmap(filename, mode="r+")
+        self.__part = str(os.getpid()) if part is None else str(part)
+        self.__keywords = {}
+        self.__columns = dict((c, []) for c in BOX_COLUMNS)
+
+    @classmethod
+    def create(cls, filename, count, size):
+        """
+        Creates batch file of count pages of size, overwrites existing one
+
+        :type filename: str
+        :type count: int
+        :param size: page width and height
+        :rtype: BatchSink
+        """
+        open_memmap(filename, mode="w+", dtype=numpy.uint8, shape=(count, size[1], size[0], 4)).flush()
+        for part in glob.glob(_part_pattern(filename)) + glob.glob(boxes_filename(filename)):
+            os.remove(part)
+        return cls(filename)
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    @property
+    def images(self):
+        """
+        :rtype: numpy.memmap
+        """
+        return self.__images
+
+    def __len__(self):
+        return self.__images.shape[0]
+
+    def write(self, index, page, texts):
+        """
+        Renders texts on page into the slot of the page with index
+
+        :type index: int
+        :type page: text.Page
+        :type texts: list[text.Text]
+        :rtype: text.RenderResult
+        """
+        result = page.render(texts, out=self.__images[index], highlight=False)
+        self.add_boxes(index, result.bbox)
+        return result
+
+    def add_boxes(self, index, bbox):
+        """
+        :param index: index of the page
+        :param bbox: keywords bounding boxes
+        :type bbox: dict
+        """
+        columns = self.__columns
+        for kw, boxes in bbox.items():
+            keyword = self.__keywords.setdefault(kw, len(self.__keywords))
+            for b in boxes:
+                columns["page"].append(index)
+                columns["keyword"].append(keyword)
+                for column, value in zip(BOX_COLUMNS[2:], b.box):
+                    columns[column].append(value)
+
+    def flush(self):
+        """
+        Flushes pages to the file and saves boxes to the part file of the sink
+        """
+        self.__images.flush()
+
+        keywords = sorted(self.__keywords, key=self.__keywords.get)
+        numpy.savez(_part_pattern(self.__filename).replace("*", self.__part), keywords=numpy.array(keywords, str),
+                    **self.__arrays(self.__columns))
+
+    def close(self):
+        self.flush()
+        self.__images = None
+
+    @staticmethod
+    def __arrays(columns):
+        arrays = {
+            "page": numpy.array(columns["page"], numpy.int64),
+            "keyword": numpy.array(columns["keyword"], numpy.int32),
+        }
+        for column in BOX_COLUMNS[2:]:
+            arrays[column] = numpy.array(columns[column], numpy.float32)
+        return arrays
+
+    @staticmethod
+    def collect(filename):
+        """
+        Merges box part files of all sinks into the boxes file, ordered by page
+
+        :type filename: str
+        :return: boxes columns and "keywords"
+        :rtype: dict
+        """
+        keywords = {}
+        columns = dict((c, []) for c in BOX_COLUMNS)
+
+        parts = sorted(glob.glob(_part_pattern(filename)))
+        for part in parts:
+            with numpy.load(part) as data:
+                ids = numpy.array([keywords.setdefault(kw, len(keywords)) for kw in data["keywords"]], numpy.int32)
+                for column in BOX_COLUMNS:
+                    values = data[column]
+                    columns[column].append(ids[values] if column == "keyword" and len(values) else values)
+
+        result = {}
+        for column in BOX_COLUMNS:
+            result[column] = numpy.concatenate(columns[column]) if columns[column] else numpy.zeros(0)
+        order = numpy.argsort(result["page"], kind="stable")
+        for column in BOX_COLUMNS:
+            result[column] = result[column][order]
+        result = dict(BatchSink.__arrays(result), keywords=numpy.array(sorted(keywords, key=keywords.get), str))
+
+        numpy.savez(boxes_filename(filename), **result)
+        for part in parts:
+            os.remove(part)
+        return result
+
+
+def load_boxes(filename):
+    """
+    Boxes collected for the batch file, see BatchSink.collect
+
+    :rtype: dict
+    """
+    with numpy.load(boxes_filename(filename)) as data:
+        return dict((name, data[name]) for name in data.files)
+
+
+def _write_pages(filename, make_page, indices, pages, part):
+    """
+    :return: seconds every page took to render
+    :rtype: list[float]
+    """
+    sink = BatchSink(filename, part)
+    page = make_page()
+    seconds = []
+    for index, texts in zip(indices, pages):
+        started = time.time()
+        sink.write(index, page, texts)
+        seconds.append(time.time() - started)
+    sink.flush()
+    return seconds
+
+
+def cost_tasks(costs, workers, chunk):
+    """
+    Splits pages into tasks of at most chunk pages, the most expensive
+    pages first. Tasks are cut when they reach an eighth of the cost a
+    worker gets, so there are tasks left to steal at the end.
+
+    :param costs: predicted cost of every page
+    :return: page indices of every task
+    :rtype: list[list[int]]
+    """
+    limit = sum(costs) / (workers * 8.)
+    tasks = []
+    task = []
+    cost = 0.
+    for i in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        task.append(i)
+        cost += costs[i]
+        if len(task) >= chunk or cost >= limit:
+            tasks.append(task)
+            task = []
+            cost = 0.
+    if task:
+        tasks.append(task)
+    return tasks
+
+
+def render_batch(filename, make_page, pages, workers=1, chunk=64, cost_model=None):
+    """
+    Renders pages into a new batch file on a process pool, every worker
+    writes disjoint slices of the file.
+
+    Pages are split into tasks by cost predicted by cost_model, tasks are
+    balanced between workers, workers that run out of tasks steal tasks of
+    others, see costmodel.StealingQueues. Actual cost of every page is
+    recorded in cost_model. Weights, prediction errors and costs of pages of
+    the batch are saved next to the file (.cost.json). The shared model is
+    refitted to its observations after every batch, so later batches are
+    ordered by costs measured by earlier ones.
+
+    :type filename: str
+    :param make_page: picklable function creating text.Page, e.g. functools.partial(Page, 0, width, height)
+    :param pages: text items of every page
+    :type pages: list[list[text.Text]]
+    :type workers: int
+    :param chunk: maximum number of pages written by a worker task
+    :param cost_model: costmodel.CostModel, the model shared by batches of the process if None
+    :return: boxes columns, see BatchSink.collect
+    :rtype: dict
+    """
+    assert workers >= 1 and chunk >= 1
+
+    size = make_page().size
+    BatchSink.create(filename, len(pages), size)
+
+    model = cost_model or shared_cost_model()
+    weights = model.weights
+    features = [page_features(size, texts) for texts in pages]
+    costs = [model.predict(f) for f in features]
+    tasks = cost_tasks(costs, workers, chunk)
+    queues = StealingQueues([sum(costs[i] for i in task) for task in tasks], workers)
+
+    def arguments(t):
+        indices = tasks[t]
+        return filename, make_page, indices, [pages[i] for i in indices], t
+
+    def observe(t, seconds):
+        for i, actual in zip(tasks[t], seconds):
+            model.observe(features[i], actual, i)
+
+    if workers == 1:
+        t = queues.take(0)
+        while t is not None:
+            observe(t, _write_pages(*arguments(t)))
+            t = queues.take(0)
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            running = {}
+
+            def submit(worker):
+                t = queues.take(worker)
+                if t is not None:
+                    running[executor.submit(_write_pages, *arguments(t))] = (worker, t)
+
+            for worker in range(workers):
+                submit(worker)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    worker, t = running.pop(future)
+                    observe(t, future.result())
+                    submit(worker)
+
+    with open(cost_report_filename(filename), "w") as f:
+        json.dump({"weights": weights, "errors": model.errors(len(pages)), "pages": model.records(len(pages))}, f)
+    if cost_model is None:
+        model.update()
+
+    return BatchSink.collect(filename)
@@ -0,0 +1,84 @@
+import time
+import tracemalloc
+
+from text import Page, Style, Text, TextBatch, Type, XLocation, YLocation
+
+LOCATIONS = [(Type.east, XLocation.left, YLocation.top), (Type.west, XLocation.right, YLocation.bottom),
+             (Type.default, XLocation.center, YLocation.center)]
+
+
+def text_args(i):
+    """
+    Arguments of i-th text item of the benchmark
+    """
+    type, xloc, yloc = LOCATIONS[i % len(LOCATIONS)]
+    return (i, "text item", ["item"], type, Style.normal, xloc, yloc, None,
+            (255, 255, 255), (0, 0, 0), None, 2, 0.3)
+
+
+def measure(build):
+    """
+    Memory taken by the result of build and time it takes (measured
+    without tracing memory)
+
+    :return: bytes, seconds and the result
+    :rtype: tuple(int, float, object)
+    """
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    started = time.time()
+    result = build()
+    return size, time.time() - started, result
+
+
+def group_batch(batch):
+    """
+    Groups batch for layout as Page does: by positions of items, Text
+    objects are made one group at a time
+    """
+    for _, positions in batch.position_groups():
+        batch.texts(positions)
+
+
+def benchmark_texts(count=1000000):
+    """
+    Memory and construction time of count text items as Text objects
+    and as TextBatch, and time of sorting and grouping them for layout
+    the way Page does (for a batch including making Text objects)
+
+    :return: results per million texts
+    :rtype: dict
+    """
+    def texts():
+        return [Text(*text_args(i)) for i in range(count)]
+
+    def batch():
+        b = TextBatch()
+        for i in range(count):
+            b.append(*text_args(i))
+        return b
+
+    scale = 1000000. / count
+    result = {}
+    for name, build, group in (("Text", texts, Page.group_texts),
+                               ("TextBatch", batch, group_batch)):
+        size, seconds, items = measure(build)
+        started = time.time()
+        group(items)
+        result[name] = {
+            "bytes_per_million": size * scale,
+            "construction_sec_per_million": seconds * scale,
+            "grouping_sec_per_million": (time.time() - started) * scale,
+        }
+    return result
+
+
+if __name__ == '__main__':
+    for name, stats in benchmark_texts(200000).items():
+        print(str.format("{0:>10}: {1:8.1f} MB, construction {2:6.2f} s, grouping {3:6.2f} s per million texts",
+                         name, stats["bytes_per_million"] / 1024 / 1024, stats["construction_sec_per_million"],
+                         stats["grouping_sec_per_million"]))
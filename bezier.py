@@ -24,7 +24,8 @@ def get_angle(p1, p2, p3):
         return math.acos(0)
 
     result = (p12 ** 2 + p13 ** 2 - p23 ** 2) / (2 * p12 * p13)
-    return math.acos(result)
+    # rounding errors of collinear points
+    return math.acos(max(-1., min(1., result)))
 
 
 def convert_to_degree(radian):
@@ -174,7 +175,7 @@ def line(p0, p1):
     return points
 
 
-def smooth_points(coords, alpha, min_angle=45):
+def smooth_points(coords, alpha, min_angle=45, segments=10):
     """
     Converts a list of points to polygon based on bezier curves
 
@@ -182,6 +183,7 @@ def smooth_points(coords, alpha, min_angle=45):
 
     :param coords: list of coordinates
     :param alpha: smooth factor
+    :param segments: number of points of every curve
     :return: point list of smoothed polygon
     :rtype : list
     """
@@ -210,7 +212,7 @@ def smooth_points(coords, alpha, min_angle=45):
         else:
             segment = cubic_bezier(p_current, p_next,
                                    cpoints[i][1], cpoints[i_next][0],
-                                   10)
+                                   segments)
         points.extend(segment)
         i += 1
 
@@ -0,0 +1,78 @@
+import threading
+import time
+
+COARSE_BEZIER = "coarse_bezier"
+POLYGON_PROBES = "polygon_probes"
+NO_HIGHLIGHT = "no_highlight"
+FAST_ENCODE = "fast_encode"
+
+# PNG compression of FAST_ENCODE, default level is 6
+FAST_ENCODE_PARAMS = {"compress_level": 1}
+
+
+class TimeBudget(object):
+    """
+    Time a page is rendered in. Stages of rendering switch to cheaper
+    strategies when the budget is at risk, i.e. when more than risk part of
+    it is spent, or when the predicted cost of the page is over the budget
+    (e.g. by costmodel.CostModel):
+
+    - COARSE_BEZIER: callouts are smoothed with bezier_segments points per curve
+    - POLYGON_PROBES: after max_probes font sizes tried for a polygon text,
+      the size is decreased by a quarter instead of by 1
+    - NO_HIGHLIGHT: the image with keywords bounding boxes isn't made
+    - FAST_ENCODE: the image is saved with FAST_ENCODE_PARAMS
+
+    Applied degradations are listed in applied in order they were applied.
+    """
+
+    def __init__(self, seconds, risk=0.5, predicted=None, bezier_segments=4, max_probes=3):
+        """
+        :param seconds: budget of the page
+        :param risk: part of the budget after which stages degrade
+        :param predicted: predicted cost of the page in seconds, stages degrade from the start if it's over budget
+        :param bezier_segments: points of a bezier curve of degraded smoothing, see bezier.smooth_points
+        :param max_probes: font sizes tried one by one before probes are degraded
+        """
+        self.seconds = seconds
+        self.risk = risk
+        self.predicted = predicted
+        self.bezier_segments = bezier_segments
+        self.max_probes = max_probes
+        self.started = time.time()
+        self.applied = []
+        self.__lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+    def at_risk(self):
+        """
+        :rtype: bool
+        """
+        return ((self.predicted is not None and self.predicted > self.seconds) or
+                self.elapsed >= self.seconds * self.risk)
+
+    def degrade(self, name):
+        """
+        Called by a stage before doing the work, records the degradation
+        if the budget is at risk
+
+        :param name: degradation of the stage, e.g. COARSE_BEZIER
+        :return: whether the stage should use the cheaper strategy
+        :rtype: bool
+        """
+        if not self.at_risk():
+            return False
+        with self.__lock:
+            if name not in self.applied:
+                self.applied.append(name)
+        return True
+
+    def report(self):
+        """
+        :return: budget, elapsed seconds and applied degradations
+        :rtype: dict
+        """
+        return {"seconds": self.seconds, "elapsed": self.elapsed, "degradations": list(self.applied)}
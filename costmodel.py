@@ -0,0 +1,223 @@
+import json
+import threading
+from collections import deque
+
+from stats import latency_stats
+from text import Page, Type
+
+FEATURES = ("chars", "polygon_chars", "groups", "vertices", "megapixels")
+
+# seconds per unit of every feature and a constant, fitted on synthetic pages of
+# synth.LayoutDistribution. Only relative costs matter for balancing
+DEFAULT_WEIGHTS = (0.0004, 0.0001, 0.005, 0.00004, 0.002, 0.001)
+
+
+def page_features(size, texts):
+    """
+    Features render cost of the page is predicted from: length of all texts,
+    length of polygon and callout texts (their font size is searched by
+    splitting them again), number of text groups, number of polygon
+    vertices and area of the canvas
+
+    :param size: page width and height
+    :type texts: list[text.Text]
+    :rtype: tuple
+    """
+    chars = polygon_chars = vertices = 0
+    for t in texts:
+        chars += len(t.value)
+        if t.type in (Type.polygon, Type.callout):
+            polygon_chars += len(t.value)
+            vertices += len(t.points or ())
+    return chars, polygon_chars, len(Page.group_texts(texts)), vertices, size[0] * size[1] / 1e6
+
+
+class CostModel(object):
+    """
+    Linear model of render cost of a page in seconds, see page_features.
+    Predicted and actual costs of rendered pages are recorded for tuning
+    the model, see CostModel.fit.
+    """
+
+    def __init__(self, weights=DEFAULT_WEIGHTS, window=100000):
+        """
+        :param weights: weight of every feature and the constant
+        :param window: number of recent observations kept
+        """
+        assert len(weights) == len(FEATURES) + 1
+        self.weights = tuple(weights)
+        self.observations = deque(maxlen=window)
+
+    def predict(self, features):
+        """
+        :param features: see page_features
+        :return: predicted seconds
+        :rtype: float
+        """
+        return self.weights[-1] + sum(w * x for w, x in zip(self.weights, features))
+
+    def observe(self, features, actual, page=None):
+        """
+        Records actual cost of a page
+
+        :param actual: seconds
+        :param page: index of the page, for the log
+        """
+        self.observations.append((page, tuple(features), self.predict(features), actual))
+
+    def __last(self, last):
+        observations = list(self.observations)
+        return observations[len(observations) - last:] if last is not None else observations
+
+    def errors(self, last=None):
+        """
+        Error of predictions of observed pages: mean absolute error in
+        seconds and percentiles of actual to predicted cost ratio
+
+        :param last: number of the most recent observations, all if None
+        :rtype: dict
+        """
+        observations = self.__last(last)
+        if not observations:
+            return {"count": 0}
+        errors = [abs(predicted - actual) for _, _, predicted, actual in observations]
+        ratios = [actual / predicted for _, _, predicted, actual in observations if predicted > 0]
+        return {
+            "count": len(errors),
+            "mean_absolute_error": sum(errors) / len(errors),
+            "ratio": latency_stats(ratios),
+        }
+
+    def records(self, last=None):
+        """
+        Observations as dicts: page, features, predicted and actual seconds
+
+        :param last: number of the most recent observations, all if None
+        :rtype: list[dict]
+        """
+        records = []
+        for page, features, predicted, actual in self.__last(last):
+            record = {"page": page, "predicted": predicted, "actual": actual}
+            record.update(zip(FEATURES, features))
+            records.append(record)
+        return records
+
+    def write_log(self, f):
+        """
+        Writes observations as JSON Lines, see CostModel.records
+
+        :param f: text file
+        """
+        for record in self.records():
+            f.write(json.dumps(record) + "\n")
+
+    def fit(self):
+        """
+        Fits weights to observations by least squares, negative weights
+        are dropped. Requires numpy.
+
+        :return: fitted model
+        :rtype: CostModel
+        """
+        import numpy
+
+        x = numpy.array([features + (1.,) for _, features, _, _ in self.observations], numpy.float64)
+        y = numpy.array([actual for _, _, _, actual in self.observations], numpy.float64)
+        columns = list(range(x.shape[1]))
+        while True:
+            weights = numpy.linalg.lstsq(x[:, columns], y, rcond=None)[0]
+            negative = [c for c, w in zip(columns, weights) if w < 0]
+            if not negative:
+                break
+            columns.remove(negative[0])
+
+        fitted = [0.] * x.shape[1]
+        for c, w in zip(columns, weights):
+            fitted[c] = float(w)
+        return CostModel(fitted, self.observations.maxlen)
+
+    def update(self, min_observations=100):
+        """
+        Refits weights to observations in place when there are enough of
+        them, observations are kept. Requires numpy.
+
+        :return: whether weights were updated
+        :rtype: bool
+        """
+        if len(self.observations) < min_observations:
+            return False
+        self.weights = self.fit().weights
+        return True
+
+
+_shared_cost_model = None
+_shared_lock = threading.Lock()
+
+
+def shared_cost_model():
+    """
+    Cost model shared by batches of the process, see batch.render_batch
+
+    :rtype: CostModel
+    """
+    global _shared_cost_model
+
+    with _shared_lock:
+        if _shared_cost_model is None:
+            _shared_cost_model = CostModel()
+        return _shared_cost_model
+
+
+def balance(costs, workers):
+    """
+    Assigns items to workers greedily, the most expensive item to the
+    least loaded worker, so every worker gets about the same cost
+
+    :param costs: predicted cost of every item
+    :return: indices of items of every worker, most expensive first
+    :rtype: list[list[int]]
+    """
+    queues = [[] for _ in range(workers)]
+    loads = [0.] * workers
+    for i in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        worker = loads.index(min(loads))
+        queues[worker].append(i)
+        loads[worker] += costs[i]
+    return queues
+
+
+class StealingQueues(object):
+    """
+    Queues of tasks of every worker. A worker takes the most expensive task
+    of its own queue, when it's empty it steals the cheapest task of the
+    queue with the most predicted cost left.
+    """
+
+    def __init__(self, costs, workers):
+        """
+        :param costs: predicted cost of every task
+        """
+        self.__costs = costs
+        self.__queues = [deque(queue) for queue in balance(costs, workers)]
+        self.__left = [sum(costs[i] for i in queue) for queue in self.__queues]
+        self.stolen = 0
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.__queues)
+
+    def take(self, worker):
+        """
+        :return: index of the next task of the worker, None if there are no tasks left
+        :rtype: int
+        """
+        if self.__queues[worker]:
+            task = self.__queues[worker].popleft()
+        else:
+            victim = max(range(len(self.__queues)), key=lambda w: (len(self.__queues[w]) > 0, self.__left[w]))
+            if not self.__queues[victim]:
+                return None
+            task = self.__queues[victim].pop()
+            worker = victim
+            self.stolen += 1
+        self.__left[worker] -= self.__costs[task]
+        return task
@@ -0,0 +1,338 @@
+import math
+import threading
+from collections import OrderedDict
+
+
+def font_key(font):
+    """
+    Identity of FreeType font, equal for fonts loaded from the same file with the same size
+
+    :type font: ImageFont.FreeTypeFont
+    :rtype: tuple
+    """
+    return getattr(font, "path", None) or id(font), font.size, getattr(font, "index", 0)
+
+
+class Glyph(object):
+    def __init__(self, mask, offset, advance):
+        """
+        :param mask: rendered glyph, None for glyphs without pixels (spaces)
+        :param offset: position of mask relative to the pen position
+        :param advance: pen movement after the glyph in pixels
+        """
+        self.mask = mask
+        self.offset = offset
+        self.advance = advance
+
+    @property
+    def bytes(self):
+        if self.mask is None:
+            return 0
+        return self.mask.size[0] * self.mask.size[1]
+
+
+class MaskCache(object):
+    """
+    LRU cache of rendered masks bounded by memory they take. Safe to share
+    between threads and pages.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :type max_bytes: int
+        """
+        assert max_bytes > 0
+
+        self.__max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        return self.__max_bytes
+
+    @property
+    def bytes(self):
+        """
+        Memory taken by cached masks
+        """
+        return self.__bytes
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def stats(self):
+        """
+        :rtype: dict
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "bytes": self.bytes,
+        }
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def get(self, key, create):
+        """
+        Returns cached entry, creates it with create() if it isn't cached
+
+        :param create: function returning new entry, entry must have bytes attribute
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.__entries.move_to_end(key)
+                return entry
+            self.misses += 1
+
+        entry = create()
+
+        with self.__lock:
+            if key not in self.__entries:
+                self.__entries[key] = entry
+                self.__bytes += entry.bytes
+
+            while self.__bytes > self.__max_bytes and len(self.__entries) > 1:
+                _, dropped = self.__entries.popitem(last=False)
+                self.__bytes -= dropped.bytes
+                self.evictions += 1
+
+        return entry
+
+
+# memory taken by an entry of the kerning table: key tuple with font key, two
+# characters and the float value, measured with tracemalloc
+KERNING_ENTRY_BYTES = 200
+
+
+class GlyphAtlas(MaskCache):
+    """
+    Cache of rendered glyph masks. Lines are composed by drawing cached
+    masks at the pen positions (advances plus kerning), the color is
+    applied when a mask is drawn, so one mask serves all colors.
+
+    Glyphs are rendered at horizontal subpixel positions rounded to
+    1 / subpixels of a pixel. The vertical position is the same for the
+    whole line, so it's used exactly as FreeType uses it. An eighth of max_bytes is kept for the kerning table, which is
+    cleared when it's full. Least recently used glyphs are dropped when
+    masks take more than the rest.
+
+    Requires Pillow 9.2+ (FreeTypeFont.getmask2 with start).
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, subpixels=4):
+        """
+        :type max_bytes: int
+        :type subpixels: int
+        """
+        assert subpixels >= 1
+        kerning_bytes = max_bytes // 8
+        super(GlyphAtlas, self).__init__(max_bytes - kerning_bytes)
+
+        self.__max_bytes = max_bytes
+        self.__max_kernings = max(1, kerning_bytes // KERNING_ENTRY_BYTES)
+        self.__subpixels = subpixels
+        self.__kernings = {}
+
+    @property
+    def max_bytes(self):
+        return self.__max_bytes
+
+    @property
+    def render_key(self):
+        """
+        Glyphs are placed at rounded positions, so pixels differ from FreeType ones
+        """
+        return "glyph_atlas", self.__subpixels
+
+    @property
+    def bytes(self):
+        """
+        Memory taken by cached masks and the kerning table
+        """
+        return super(GlyphAtlas, self).bytes + len(self.__kernings) * KERNING_ENTRY_BYTES
+
+    def clear(self):
+        super(GlyphAtlas, self).clear()
+        self.__kernings.clear()
+
+    def glyph(self, font, char, start=(0, 0)):
+        """
+        Returns cached glyph rendered at fractional start position
+
+        :type font: ImageFont.FreeTypeFont
+        :type char: str
+        :param start: fractional part of the pen position, x is rounded to subpixels
+        :rtype: Glyph
+        """
+        steps = self.__subpixels
+        step_x = int(start[0] * steps)
+
+        def create():
+            mask, offset = font.getmask2(char, "L", start=(step_x / float(steps), start[1]))
+            if not min(mask.size):
+                mask = None
+            return Glyph(mask, offset, font.getlength(char))
+
+        return self.get((font_key(font), char, step_x, start[1]), create)
+
+    def kerning(self, font, left, right):
+        """
+        Pen adjustment between two characters in pixels
+
+        :type font: ImageFont.FreeTypeFont
+        :rtype: float
+        """
+        key = (font_key(font), left, right)
+        kerning = self.__kernings.get(key)
+        if kerning is None:
+            if len(self.__kernings) >= self.__max_kernings:
+                self.__kernings.clear()
+            kerning = font.getlength(left + right) - font.getlength(left) - font.getlength(right)
+            self.__kernings[key] = kerning
+        return kerning
+
+    def __split_position(self, position):
+        """
+        Rounds position to subpixels and splits it to fractional and integer parts
+
+        :rtype: tuple(float, int)
+        """
+        steps = self.__subpixels
+        position = round(position * steps) / float(steps)
+        fraction, integer = math.modf(position)
+        if fraction < 0:
+            fraction, integer = fraction + 1, integer - 1
+        return fraction, int(integer)
+
+    def draw_text(self, draw, xy, text, fill, font):
+        """
+        Draws single line text composed from cached glyphs
+
+        :type draw: ImageDraw.ImageDraw
+        :type xy: tuple
+        :type text: str
+        :type font: ImageFont.FreeTypeFont
+        """
+        ink, fill = draw._getink(fill)
+        if ink is None:
+            ink = fill
+        if ink is None:
+            return
+
+        pen_x = xy[0]
+        # split as ImageDraw.text splits it
+        start_y, y = math.modf(xy[1])
+        y = int(y)
+        previous = None
+
+        for char in text:
+            if previous is not None:
+                pen_x += self.kerning(font, previous, char)
+
+            start_x, x = self.__split_position(pen_x)
+            glyph = self.glyph(font, char, (start_x, start_y))
+            if glyph.mask is not None:
+                draw.draw.draw_bitmap((x + glyph.offset[0], y + glyph.offset[1]), glyph.mask, ink)
+
+            pen_x += glyph.advance
+            previous = char
+
+
+class SpriteCache(MaskCache):
+    """
+    Cache of masks of whole lines of text, e.g. labels repeating on many
+    pages. A mask is rendered by FreeType exactly as ImageDraw.text renders
+    it, so drawing from the cache gives the same pixels. The color is applied
+    when a mask is drawn, so one mask serves all colors of the same text.
+
+    One cache may be shared by many pages (Page.set_text_cache), see
+    shared_sprite_cache.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        :type max_bytes: int
+        """
+        super(SpriteCache, self).__init__(max_bytes)
+
+    @property
+    def render_key(self):
+        """
+        None, pixels are the same as FreeType ones
+        """
+        return None
+
+    def sprite(self, font, text, start=(0, 0), mode="L"):
+        """
+        Returns cached mask of text rendered at fractional start position
+
+        :type font: ImageFont.FreeTypeFont
+        :type text: str
+        :rtype: Glyph
+        """
+        def create():
+            mask, offset = font.getmask2(text, mode, start=start)
+            if not min(mask.size):
+                mask = None
+            return Glyph(mask, offset, None)
+
+        return self.get((font_key(font), text, tuple(start), mode), create)
+
+    def draw_text(self, draw, xy, text, fill, font):
+        """
+        Draws single line text from cached mask
+
+        :type draw: ImageDraw.ImageDraw
+        :type xy: tuple
+        :type text: str
+        :type font: ImageFont.FreeTypeFont
+        """
+        ink, fill = draw._getink(fill)
+        if ink is None:
+            ink = fill
+        if ink is None:
+            return
+
+        start_x, x = math.modf(xy[0])
+        start_y, y = math.modf(xy[1])
+
+        sprite = self.sprite(font, text, (start_x, start_y), draw.fontmode)
+        if sprite.mask is not None:
+            draw.draw.draw_bitmap((int(x) + sprite.offset[0], int(y) + sprite.offset[1]), sprite.mask, ink)
+
+
+_shared_sprite_cache = None
+_shared_lock = threading.Lock()
+
+
+def shared_sprite_cache(max_bytes=64 * 1024 * 1024):
+    """
+    Sprite cache shared by all pages of the process. max_bytes is used
+    only when the cache is created by the first call.
+
+    :rtype: SpriteCache
+    """
+    global _shared_sprite_cache
+
+    with _shared_lock:
+        if _shared_sprite_cache is None:
+            _shared_sprite_cache = SpriteCache(max_bytes)
+        return _shared_sprite_cache
@@ -0,0 +1,319 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from text import Page, Style, Text, Type, XLocation, YLocation
+
+
+def parse_color(color):
+    """
+    Color of a job: name or hex string, or list of components
+
+    :rtype: str|tuple
+    """
+    if isinstance(color, list):
+        return tuple(color)
+    return color
+
+
+def parse_text(item, position=0):
+    """
+    Text item of a job
+
+    :param item: text description, see parse_job
+    :type item: dict
+    :param position: index used when the item doesn't have one
+    :rtype: Text
+    """
+    points = item.get("points")
+    return Text(item.get("index", position), item["value"], item.get("keywords", []),
+                Type(item.get("type", "default")), Style(item.get("style", "normal")),
+                XLocation(item.get("xloc", "center")), YLocation(item.get("yloc", "center")),
+                [tuple(p) for p in points] if points is not None else None,
+                fgcolor=parse_color(item.get("fgcolor")),
+                bgcolor=parse_color(item.get("bgcolor")),
+                bocolor=parse_color(item.get("bocolor")),
+                bowidth=item.get("bowidth", 2),
+                bgopacity=item.get("bgopacity", 0.3))
+
+
+def page_settings(job):
+    """
+    Settings of the page of a job, jobs with equal settings share a page
+
+    :rtype: tuple
+    """
+    styles = tuple(sorted((name, tuple(value)) for name, value in job.get("styles", {}).items()))
+    return job.get("width", 1024), job.get("height", 576), job.get("callout_pointer_angle", 45), styles
+
+
+def parse_job(job):
+    """
+    Texts of a render job. A job is a dict:
+
+        {"id": "job-1", "width": 1024, "height": 576,
+         "styles": {"h1": [26, 28]}, "callout_pointer_angle": 45,
+         "texts": [{"value": "...", "keywords": ["..."], "type": "east", "style": "normal",
+                    "xloc": "left", "yloc": "top", "points": [[x, y], ...],
+                    "fgcolor": "#ffffff", "bgcolor": [0, 0, 0], "bocolor": null,
+                    "bowidth": 2, "bgopacity": 0.3}],
+         "output": "page.png", "base": "scan.jpg"}
+
+    Everything except texts and their values is optional. The image is
+    saved to output ("_hi" image next to it), it isn't saved without output.
+
+    :type job: dict
+    :rtype: list[Text]
+    """
+    return [parse_text(item, i) for i, item in enumerate(job["texts"])]
+
+
+PATH_FIELDS = ("output", "base")
+
+
+def resolve_paths(job, root):
+    """
+    Job with output and base paths resolved under root directory, for jobs
+    coming from untrusted sources
+
+    :type job: dict
+    :param root: directory paths are resolved in, jobs with paths are refused if None
+    :return: copy of the job with absolute paths, the job itself if it has no paths
+    :rtype: dict
+    :raises ValueError: if the job has paths and root is None, or a path is outside of root
+    """
+    fields = [field for field in PATH_FIELDS if job.get(field) is not None]
+    if not fields:
+        return job
+    if root is None:
+        raise ValueError(str.format("{0} paths are not allowed", ", ".join(fields)))
+
+    root = os.path.realpath(root)
+    job = dict(job)
+    for field in fields:
+        if not isinstance(job[field], str):
+            raise ValueError(str.format("{0} is not a path", field))
+        path = os.path.realpath(os.path.join(root, job[field]))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(str.format("{0} is outside of the root directory", field))
+        job[field] = path
+    return job
+
+
+def serialize_boxes(bbox):
+    """
+    :param bbox: keywords bounding boxes
+    :return: keywords to lists of boxes
+    :rtype: dict
+    """
+    return dict((kw, [list(b.box) for b in boxes]) for kw, boxes in bbox.items())
+
+
+class JobRunner(object):
+    """
+    Renders jobs in a warm process: pages are made once for every distinct
+    page settings and reused by the following jobs.
+    """
+
+    def __init__(self, max_pages=64, fonts=None, text_cache=None, layout_cache=None):
+        """
+        :param max_pages: number of pages kept for reuse
+        :param fonts: fonts shared by pages, see Page.set_font_cache
+        :param text_cache: see Page.set_text_cache
+        :param layout_cache: see Page.set_layout_cache
+        """
+        self.__max_pages = max_pages
+        self.__pages = {}
+        self.__fonts = fonts
+        self.__text_cache = text_cache
+        self.__layout_cache = layout_cache
+        self.jobs = 0
+
+    def stats(self):
+        """
+        Rendered jobs and sizes of warm caches
+
+        :rtype: dict
+        """
+        stats = {"jobs": self.jobs, "pages": len(self.__pages)}
+        if self.__fonts is not None:
+            stats["fonts"] = len(self.__fonts)
+        if self.__text_cache is not None:
+            stats["text_cache"] = self.__text_cache.stats()
+        if self.__layout_cache is not None:
+            stats["layout_cache"] = {"hit_rate": self.__layout_cache.hit_rate}
+        return stats
+
+    def page(self, job):
+        """
+        Page of the job settings
+
+        :type job: dict
+        :rtype: Page
+        """
+        settings = page_settings(job)
+        page = self.__pages.get(settings)
+        if page is None:
+            if len(self.__pages) >= self.__max_pages:
+                self.__pages.clear()
+
+            width, height, angle, styles = settings
+            page = Page(0, width, height)
+            page.setCalloutPointerAngle(angle)
+            for name, (font_size, line_height) in styles:
+                page.set_font_style(Style(name), font_size, line_height)
+            page.set_font_cache(self.__fonts)
+            page.set_text_cache(self.__text_cache)
+            page.set_layout_cache(self.__layout_cache)
+            self.__pages[settings] = page
+        return page
+
+    def render(self, job, encode=None):
+        """
+        Renders the job
+
+        :type job: dict
+        :param encode: format the image is encoded to in memory (e.g. "PNG"),
+            encoded bytes are returned in "image" of the result
+        :return: job id, bounding boxes, output and timings, or error
+        :rtype: dict
+        """
+        started = time.time()
+        result = {"id": job.get("id"), "pid": os.getpid()}
+        try:
+            page = self.page(job)
+            texts = parse_job(job)
+            parsed = time.time()
+
+            output = job.get("output")
+            rendered = page.render(texts, base=job.get("base"), highlight=output is not None)
+            drawn = time.time()
+            if output is not None:
+                rendered.save(output)
+            if encode is not None:
+                buffer = io.BytesIO()
+                rendered.image.save(buffer, encode)
+                result["image"] = buffer.getvalue()
+            saved = time.time()
+        except Exception as e:
+            result.update(ok=False, error=str.format("{0}: {1}", type(e).__name__, e),
+                          seconds={"total": time.time() - started})
+            return result
+        finally:
+            self.jobs += 1
+
+        result.update(ok=True, output=output, bbox=serialize_boxes(rendered.bbox), seconds={
+            "parse": parsed - started,
+            "render": drawn - parsed,
+            "save": saved - drawn,
+            "total": saved - started,
+        })
+        return result
+
+
+def read_jobs(lines):
+    """
+    Jobs of JSON Lines, blank lines are skipped. Lines that aren't valid
+    jobs are yielded as error results
+
+    :type lines: iterable[str]
+    :return: job dicts or error results
+    :rtype: generator[dict]
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError("job is not an object")
+        except ValueError as e:
+            yield {"id": None, "line": number, "ok": False, "error": str.format("ValueError: {0}", e)}
+            continue
+        job.setdefault("id", number)
+        yield job
+
+
+_runner = None
+
+
+def _render_job(job):
+    global _runner
+    if _runner is None:
+        _runner = JobRunner(fonts={})
+    return _runner.render(job)
+
+
+def run_jobs(jobs, workers=1, window=None):
+    """
+    Renders jobs one after another in this process or on a pool of worker
+    processes, each keeping its own pages. Results are yielded in the
+    order of jobs as soon as they are ready, at most window jobs are
+    submitted to the pool ahead of the result being waited for.
+
+    :param jobs: job dicts, see parse_job, or error results of read_jobs
+    :type jobs: iterable[dict]
+    :param workers: number of worker processes, jobs are rendered in this process if 1
+    :param window: jobs in flight, 2 * workers if None
+    :rtype: generator[dict]
+    """
+    assert workers >= 1
+
+    def is_job(job):
+        return "ok" not in job
+
+    if workers == 1:
+        for job in jobs:
+            yield _render_job(job) if is_job(job) else job
+        return
+
+    window = window or 2 * workers
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for job in jobs:
+            pending.append(executor.submit(_render_job, job) if is_job(job) else job)
+            if len(pending) >= window:
+                yield _result(pending.popleft())
+        while pending:
+            yield _result(pending.popleft())
+
+
+def _result(item):
+    return item if isinstance(item, dict) else item.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Renders JSON Lines jobs, see jobs.parse_job, "
+                                                 "and writes a JSON line of result of every job")
+    parser.add_argument("jobs", nargs="?", default="-", help="jobs file, stdin if - or omitted")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--window", type=int, default=None, help="jobs in flight, 2 * workers by default")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.jobs == "-" else open(args.jobs)
+    started = time.time()
+    count = failed = 0
+    try:
+        for result in run_jobs(read_jobs(source), args.workers, args.window):
+            count += 1
+            failed += not result["ok"]
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    seconds = time.time() - started
+    sys.stderr.write(str.format("{0} jobs, {1} failed, {2:.2f} s, {3:.1f} jobs/s\n",
+                                count, failed, seconds, count / seconds if seconds else 0.))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import ImageFont
+
+
+def font_hash(font_face):
+    """
+    Hash of the content of the font file
+
+    :type font_face: str
+    :rtype: str
+    """
+    path = ImageFont.truetype(font_face).path
+    stat = os.stat(path)
+    return _font_hash(path, stat.st_size, stat.st_mtime)
+
+
+_font_hashes = {}
+
+
+def _font_hash(path, size, mtime):
+    key = (path, size, mtime)
+    digest = _font_hashes.get(key)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = _font_hashes[key] = hashlib.sha1(f.read()).hexdigest()
+    return digest
+
+
+class PersistentLayoutCache(object):
+    """
+    Layouts of texts (wrapped lines, their widths and font size chosen to
+    fit polygon) stored in a SQLite file, shared between runs and worker
+    processes. Entries are dropped when they are older than ttl seconds,
+    least recently used entries are dropped when there are more than
+    max_entries of them.
+    """
+
+    # used time of entries is updated not more often than this, in seconds
+    touch_interval = 60
+
+    def __init__(self, filename, max_entries=1000000, ttl=None, timeout=30):
+        """
+        :type filename: str
+        :type max_entries: int
+        :param ttl: seconds entries live, None for no limit
+        :param timeout: seconds to wait for a lock held by another process
+        """
+        self.__filename = filename
+        self.__max_entries = max_entries
+        self.__ttl = ttl
+        self.__timeout = timeout
+        self.__local = threading.local()
+        self.__connections = []
+        self.__lock = threading.Lock()
+        self.__fonts = {}
+        self.__puts = 0
+        self.hits = 0
+        self.misses = 0
+
+        connection = self.__connection()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS layouts ("
+                               "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                               "created REAL NOT NULL, used REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS layouts_used ON layouts (used)")
+
+    def __connection(self):
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            # used only by the thread it's made for, PersistentLayoutCache.close closes it from any thread
+            connection = sqlite3.connect(self.__filename, timeout=self.__timeout, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.__local.connection = connection
+            with self.__lock:
+                self.__connections.append(connection)
+        return connection
+
+    def close(self):
+        """
+        Closes connections of all threads, threads must not use the cache anymore
+        """
+        with self.__lock:
+            connections = self.__connections
+            self.__connections = []
+        for connection in connections:
+            connection.close()
+        self.__local = threading.local()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def __len__(self):
+        return self.__connection().execute("SELECT COUNT(*) FROM layouts").fetchone()[0]
+
+    def key(self, kind, text, font_face, *params, measure="freetype"):
+        """
+        Key of text laid out with font_face, font file is identified by hash of its content
+
+        :param kind: layout kind, e.g. "split" or "polygon"
+        :type text: str
+        :type font_face: str
+        :param params: sizes, widths or geometry the layout depends on
+        :param measure: how text was measured, "freetype" or "metrics" (see metrics.SharedFontMetrics),
+                        widths may differ between them
+        :rtype: str
+        """
+        face_hash = self.__fonts.get(font_face)
+        if face_hash is None:
+            face_hash = self.__fonts[font_face] = font_hash(font_face)
+
+        canonical = repr((kind, text, face_hash, measure) + params)
+        return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        :type key: str
+        :return: stored value, None if there is no fresh value
+        """
+        now = time.time()
+        row = self.__connection().execute("SELECT value, created, used FROM layouts WHERE key = ?",
+                                          (key,)).fetchone()
+
+        if row is None or (self.__ttl is not None and row[1] < now - self.__ttl):
+            self.misses += 1
+            return None
+
+        if row[2] < now - self.touch_interval:
+            connection = self.__connection()
+            with connection:
+                connection.execute("UPDATE layouts SET used = ? WHERE key = ?", (now, key))
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """
+        :type key: str
+        :param value: JSON serializable value
+        """
+        now = time.time()
+        connection = self.__connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO layouts (key, value, created, used) VALUES (?, ?, ?, ?)",
+                               (key, json.dumps(value), now, now))
+
+        self.__puts += 1
+        if self.__puts % 1000 == 1:
+            self.evict()
+
+    def evict(self):
+        """
+        Drops expired and least recently used entries
+        """
+        connection = self.__connection()
+        with connection:
+            if self.__ttl is not None:
+                connection.execute("DELETE FROM layouts WHERE created < ?", (time.time() - self.__ttl,))
+
+            count = connection.execute("SELECT COUNT(*) FROM layouts").fetchone()[0]
+            if count > self.__max_entries:
+                connection.execute("DELETE FROM layouts WHERE key IN "
+                                   "(SELECT key FROM layouts ORDER BY used LIMIT ?)",
+                                   (count - self.__max_entries,))
@@ -0,0 +1,312 @@
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+
+from PIL import ImageFont
+
+# characters measured by tables, texts with other characters are measured by FreeType
+DEFAULT_CHARS = "".join(chr(c) for c in range(0x20, 0x7f))
+
+# size the font is probed at for pairs of characters that have kerning
+KERNING_PROBE_SIZE = 256
+
+FIELDS = 4  # advance, ink left, ink right, ink bottom
+
+
+def page_fonts(page, shrink=8):
+    """
+    Fonts used by styles of the page, polygon texts are shrunk by up to
+    shrink points to fit their polygon
+
+    :type page: text.Page
+    :type shrink: int
+    :return: font faces and sizes
+    :rtype: list[tuple(str, int)]
+    """
+    fonts = set()
+    for _, font_face, font_size, _ in page.settings_key[-1]:
+        for size in range(max(1, font_size - shrink), font_size + 1):
+            fonts.add((font_face, size))
+    return sorted(fonts)
+
+
+def kerning_pairs(font_face, chars=DEFAULT_CHARS):
+    """
+    Pairs of characters which have kerning in the font
+
+    :type font_face: str
+    :type chars: str
+    :rtype: list[tuple(int, int)]
+    """
+    font = ImageFont.truetype(font_face, KERNING_PROBE_SIZE)
+    advances = [font.getlength(c) for c in chars]
+    return [(i, j) for i, left in enumerate(chars) for j, right in enumerate(chars)
+            if font.getlength(left + right) != advances[i] + advances[j]]
+
+
+def measure(font, chars=DEFAULT_CHARS, pairs=None):
+    """
+    Metrics table of the font: advances and ink extents of characters,
+    followed by n x n kerning matrix
+
+    :type font: ImageFont.FreeTypeFont
+    :type chars: str
+    :param pairs: pairs of character indexes with kerning, see kerning_pairs
+    :rtype: array
+    """
+    n = len(chars)
+    values = array("f", bytes(4 * (FIELDS * n + n * n)))
+
+    for i, c in enumerate(chars):
+        left, _, right, bottom = font.getbbox(c)
+        values[i] = font.getlength(c)
+        values[n + i] = left
+        values[2 * n + i] = right
+        values[3 * n + i] = bottom
+
+    for i, j in pairs or ():
+        values[FIELDS * n + i * n + j] = font.getlength(chars[i] + chars[j]) - values[i] - values[j]
+
+    return values
+
+
+class FontTable(object):
+    """
+    Metrics of one font, views into the memory of the tables
+    """
+
+    def __init__(self, index, values):
+        """
+        :param index: characters to their positions in the table
+        :type index: dict
+        :param values: float view of the table
+        :type values: memoryview
+        """
+        n = len(index)
+        self.__index = index
+        self.__n = n
+        self.__advances = values[:n]
+        self.__lefts = values[n:2 * n]
+        self.__rights = values[2 * n:3 * n]
+        self.__bottoms = values[3 * n:4 * n]
+        self.__kerning = values[FIELDS * n:]
+
+    def release(self):
+        for view in (self.__advances, self.__lefts, self.__rights, self.__bottoms, self.__kerning):
+            view.release()
+
+    def __positions(self, text):
+        index = self.__index
+        positions = []
+        for c in text:
+            i = index.get(c)
+            if i is None:
+                return None
+            positions.append(i)
+        return positions
+
+    def length(self, text):
+        """
+        Advance of text in pixels, None if text has characters missing in the table
+
+        :type text: str
+        :rtype: float
+        """
+        positions = self.__positions(text)
+        if positions is None:
+            return None
+
+        advances, kerning, n = self.__advances, self.__kerning, self.__n
+        length = 0.
+        previous = None
+        for i in positions:
+            if previous is not None:
+                length += kerning[previous * n + i]
+            length += advances[i]
+            previous = i
+        return length
+
+    def size(self, text):
+        """
+        Same as FreeTypeFont.getsize with basic layout, None if text has
+        characters missing in the table. The pen advances in FreeType 26.6
+        units and every glyph is placed at the pixel the pen is rounded up to.
+
+        :type text: str
+        :rtype: tuple(int, int)
+        """
+        positions = self.__positions(text)
+        if positions is None:
+            return None
+
+        advances, kerning, n = self.__advances, self.__kerning, self.__n
+        lefts, rights, bottoms = self.__lefts, self.__rights, self.__bottoms
+        pen = 0
+        left = right = bottom = 0
+        previous = None
+        for i in positions:
+            if previous is not None:
+                pen += int(round(kerning[previous * n + i] * 64))
+            x = -(-pen // 64)
+            left = min(left, x + lefts[i])
+            right = max(right, x + rights[i])
+            bottom = max(bottom, bottoms[i])
+            pen += int(round(advances[i] * 64))
+            previous = i
+        return int(max(-(-pen // 64), right) - left), int(bottom)
+
+
+class MeasuredFont(object):
+    """
+    FreeType font measuring texts with a metrics table. Everything except
+    measuring, e.g. rendering, is done by the font.
+    """
+
+    def __init__(self, font, table):
+        """
+        :type font: ImageFont.FreeTypeFont
+        :type table: FontTable
+        """
+        self.font = font
+        self.table = table
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["font"], name)
+
+    def getsize(self, text, direction=None, features=None, language=None, stroke_width=0):
+        size = None
+        if direction is None and features is None and language is None and not stroke_width:
+            size = self.table.size(text)
+        if size is None:
+            size = self.font.getsize(text, direction, features, language, stroke_width)
+        return size
+
+    def getlength(self, text, mode="", direction=None, features=None, language=None):
+        length = None
+        if direction is None and features is None and language is None:
+            length = self.table.length(text)
+        if length is None:
+            length = self.font.getlength(text, mode, direction, features, language)
+        return length
+
+
+class SharedFontMetrics(object):
+    """
+    Glyph advances, ink extents and kerning of fonts in shared memory.
+    Tables are built once by the parent process (publish), worker processes
+    attach to them by descriptor and read them without copying, see
+    Page.set_font_metrics.
+
+    Sizes and lengths taken from tables are the same as FreeType ones with
+    basic layout, fonts with raqm layout are measured by FreeType.
+    """
+
+    def __init__(self, memory, descriptor, owner):
+        self.__memory = memory
+        self.__descriptor = descriptor
+        self.__owner = owner
+        self.__index = dict((c, i) for i, c in enumerate(descriptor["chars"]))
+        self.__values = memory.buf.cast("f")
+
+        stride = FIELDS * len(self.__index) + len(self.__index) ** 2
+        self.__tables = {}
+        for number, (font_face, font_size) in enumerate(descriptor["fonts"]):
+            values = self.__values[number * stride:(number + 1) * stride]
+            self.__tables[(font_face, font_size)] = FontTable(self.__index, values)
+            values.release()
+
+    @classmethod
+    def publish(cls, fonts, chars=DEFAULT_CHARS):
+        """
+        Measures fonts and puts their tables into a new shared memory block
+
+        :param fonts: font faces and sizes, see page_fonts
+        :type fonts: list[tuple(str, int)]
+        :type chars: str
+        :rtype: SharedFontMetrics
+        """
+        fonts = sorted(set(fonts))
+        pairs = {}
+        tables = []
+        for font_face, font_size in fonts:
+            if font_face not in pairs:
+                pairs[font_face] = kerning_pairs(font_face, chars)
+            tables.append(measure(ImageFont.truetype(font_face, font_size), chars, pairs[font_face]))
+
+        size = sum(len(t) for t in tables) * 4
+        memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        offset = 0
+        for table in tables:
+            data = table.tobytes()
+            memory.buf[offset:offset + len(data)] = data
+            offset += len(data)
+
+        descriptor = {"name": memory.name, "chars": chars, "fonts": fonts}
+        return cls(memory, descriptor, True)
+
+    @classmethod
+    def attach(cls, descriptor):
+        """
+        Attaches to tables published by another process
+
+        :param descriptor: SharedFontMetrics.descriptor of published tables
+        :rtype: SharedFontMetrics
+        """
+        memory = shared_memory.SharedMemory(name=descriptor["name"])
+        # the block is unlinked by its owner, not when the worker exits
+        try:
+            resource_tracker.unregister(memory._name, "shared_memory")
+        except (AttributeError, KeyError):
+            pass
+        return cls(memory, descriptor, False)
+
+    @property
+    def descriptor(self):
+        """
+        Picklable description passed to worker processes
+        """
+        return self.__descriptor
+
+    @property
+    def fonts(self):
+        return list(self.__tables.keys())
+
+    def table(self, font_face, font_size):
+        """
+        :rtype: FontTable
+        """
+        return self.__tables.get((font_face, font_size))
+
+    def measured(self, font_face, font):
+        """
+        Font measuring with its table, the font itself if there is no table for it
+
+        :type font_face: str
+        :type font: ImageFont.FreeTypeFont
+        """
+        table = self.table(font_face, font.size)
+        if table is None or font.layout_engine != ImageFont.Layout.BASIC:
+            return font
+        return MeasuredFont(font, table)
+
+    def close(self):
+        """
+        Detaches from tables, tables are unlinked when they are closed by the owner.
+        Fonts measuring with the tables must not be used after that.
+        """
+        if self.__memory is None:
+            return
+
+        for table in self.__tables.values():
+            table.release()
+        self.__tables.clear()
+        self.__values.release()
+        self.__memory.close()
+        if self.__owner:
+            self.__memory.unlink()
+        self.__memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
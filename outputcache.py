@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from PIL import ImageFont
+
+from spatial import BoxIndex
+from text import BoundingBox
+
+IMAGE = "image.png"
+HIGHLIGHTED = "image_hi.png"
+BBOX = "bbox.json"
+VERSION = 2
+
+
+def highlighted_filename(imagefile):
+    return os.path.splitext(imagefile)[0] + "_hi.png"
+
+
+def serialize_bbox(bbox):
+    """
+    :type bbox: dict
+    :rtype: str
+    """
+    return json.dumps(dict((kw, [[list(b.box), b.outline] for b in boxes]) for kw, boxes in bbox.items()))
+
+
+def deserialize_bbox(data):
+    """
+    :type data: str
+    :rtype: dict
+    """
+    bbox = {}
+    for kw, boxes in json.loads(data).items():
+        bbox[kw] = [BoundingBox(box, tuple(outline) if isinstance(outline, list) else outline)
+                    for box, outline in boxes]
+    return bbox
+
+
+class OutputCache(object):
+    """
+    On-disk cache of rendered pages addressed by hash of everything that
+    affects the output: page size and settings, styles, identity of font
+    files and all fields of text items. On a hit the image, the highlighted
+    image and the bounding boxes are taken from the cache instead of
+    rendering. Least recently used entries are removed when the cache
+    takes more than max_bytes.
+
+    Images are copied out of the cache, or hard linked when link is True
+    (falls back to copy). Linked outputs must be replaced rather than
+    modified in place, as RenderResult.save does.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, link=False):
+        """
+        :type directory: str
+        :type max_bytes: int
+        :type link: bool
+        """
+        self.__directory = directory
+        self.__max_bytes = max_bytes
+        self.__link = link
+        self.__fonts = {}
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.__load_entries()
+
+    def __load_entries(self):
+        for prefix in os.listdir(self.__directory):
+            prefix_dir = os.path.join(self.__directory, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry = os.path.join(prefix_dir, key)
+                if os.path.exists(os.path.join(entry, BBOX)):
+                    self.__entries[key] = (os.path.getmtime(entry), self.__entry_size(entry))
+
+    @staticmethod
+    def __entry_size(entry):
+        return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+
+    def __entry_dir(self, key):
+        return os.path.join(self.__directory, key[:2], key)
+
+    @property
+    def bytes(self):
+        return sum(size for _, size in self.__entries.values())
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def report(self):
+        """
+        :rtype: dict
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "bytes": self.bytes,
+        }
+
+    def font_identity(self, font_face):
+        """
+        Path, size and modification time of the font file
+
+        :type font_face: str
+        :rtype: tuple
+        """
+        identity = self.__fonts.get(font_face)
+        if identity is None:
+            path = ImageFont.truetype(font_face).path
+            stat = os.stat(path)
+            identity = self.__fonts[font_face] = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        return identity
+
+    def key(self, page, texts):
+        """
+        Content address of texts rendered on page
+
+        :type page: text.Page
+        :type texts: list[text.Text]
+        :rtype: str
+        """
+        settings = page.settings_key
+        fonts = sorted(set(self.font_identity(style[1]) for style in settings[-1]))
+        texts = [t.fingerprint for t in sorted(texts, key=lambda x: x.index)]
+        canonical = repr((VERSION, settings, page.render_key, fonts, texts))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def __materialize(self, source, target):
+        if os.path.lexists(target):
+            os.remove(target)
+
+        if self.__link:
+            try:
+                os.link(source, target)
+                return
+            except OSError:
+                pass
+
+        shutil.copyfile(source, target)
+
+    def get(self, key, imagefile):
+        """
+        Materializes cached images to imagefile
+
+        :return: keywords bounding boxes, None if key isn't cached
+        :rtype: dict
+        """
+        entry = self.__entry_dir(key)
+        try:
+            with open(os.path.join(entry, BBOX)) as f:
+                bbox = deserialize_bbox(f.read())
+
+            self.__materialize(os.path.join(entry, IMAGE), imagefile)
+            if os.path.exists(os.path.join(entry, HIGHLIGHTED)):
+                self.__materialize(os.path.join(entry, HIGHLIGHTED), highlighted_filename(imagefile))
+            elif os.path.lexists(highlighted_filename(imagefile)):
+                os.remove(highlighted_filename(imagefile))
+
+            os.utime(entry, None)
+        except (IOError, OSError):
+            with self.__lock:
+                self.misses += 1
+            return None
+
+        with self.__lock:
+            self.hits += 1
+            if key in self.__entries:
+                self.__entries[key] = (os.path.getmtime(entry), self.__entries[key][1])
+        return bbox
+
+    def put(self, key, imagefile, bbox):
+        """
+        Stores saved images of imagefile in the cache
+
+        :type key: str
+        :type imagefile: str
+        :type bbox: dict
+        """
+        entry = self.__entry_dir(key)
+        tmp = entry + ".%d.%d.tmp" % (os.getpid(), threading.current_thread().ident)
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        shutil.copyfile(imagefile, os.path.join(tmp, IMAGE))
+        if len(bbox):
+            shutil.copyfile(highlighted_filename(imagefile), os.path.join(tmp, HIGHLIGHTED))
+        with open(os.path.join(tmp, BBOX), "w") as f:
+            f.write(serialize_bbox(bbox))
+
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # stored by another worker
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        with self.__lock:
+            self.__entries[key] = (os.path.getmtime(entry), self.__entry_size(entry))
+            self.__evict()
+
+    def __evict(self):
+        total = self.bytes
+        for key, (_, size) in sorted(self.__entries.items(), key=lambda x: x[1][0]):
+            if total <= self.__max_bytes:
+                break
+            shutil.rmtree(self.__entry_dir(key), ignore_errors=True)
+            del self.__entries[key]
+            total -= size
+            self.evictions += 1
+
+    def generate(self, page, texts, imagefile):
+        """
+        Same as Page.generateTextImage, but takes the result from the cache when
+        the same texts were rendered before
+
+        :type page: text.Page
+        :type texts: list[text.Text]
+        :type imagefile: str
+        :rtype: dict
+        """
+        key = self.key(page, texts)
+        bbox = self.get(key, imagefile)
+        if bbox is not None:
+            return BoxIndex(bbox)
+
+        for target in (imagefile, highlighted_filename(imagefile)):
+            if os.path.lexists(target):
+                os.remove(target)
+
+        result = page.render(texts)
+        result.save(imagefile)
+        self.put(key, imagefile, result.bbox)
+        return result.bbox
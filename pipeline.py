@@ -0,0 +1,101 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from text import PageLayout, open_base
+
+
+class OverlayPipeline(object):
+    """
+    Draws the same texts on every image of a collection of any size.
+
+    Texts are laid out and drawn into layers once, every image only gets
+    the layers blended onto it. Images are decoded ahead on a thread pool,
+    at most prefetch of them are decoded and not yet consumed, so memory
+    doesn't depend on the size of the collection.
+    """
+
+    def __init__(self, page, texts, prefetch=4, decoders=2, highlight=False):
+        """
+        :type page: text.Page
+        :param texts: text items, their layout made by Page.layout, or function
+            of image index and decoded image returning text items for that image
+        :type texts: list[text.Text]|text.PageLayout|callable
+        :param prefetch: number of images decoded ahead
+        :param decoders: threads decoding images
+        :param highlight: makes images with keywords bounding boxes as well
+        """
+        assert prefetch >= 1 and decoders >= 1
+
+        self.__page = page
+        self.__prefetch = prefetch
+        self.__decoders = decoders
+        self.__highlight = highlight
+        self.__texts = None
+        self.__rendered = None
+        self.count = 0
+
+        if callable(texts):
+            self.__texts = texts
+        else:
+            if not isinstance(texts, PageLayout):
+                texts = page.layout(texts)
+            self.__rendered = page.draw_groups(texts.groups)
+
+    def __decode(self, base):
+        return open_base(base, self.__page.size)
+
+    def __render(self, index, image):
+        if self.__rendered is None:
+            return self.__page.render(self.__texts(index, image), base=image, highlight=self.__highlight)
+        return self.__page.compose(self.__rendered, base=image, highlight=self.__highlight)
+
+    def results(self, bases):
+        """
+        Renders texts on every image in order
+
+        :param bases: images, numpy arrays or paths of image files, see text.open_base
+        :rtype: generator[text.RenderResult]
+        """
+        executor = ThreadPoolExecutor(self.__decoders)
+        pending = deque()
+        bases = iter(bases)
+
+        try:
+            for base in bases:
+                pending.append(executor.submit(self.__decode, base))
+                if len(pending) >= self.__prefetch:
+                    break
+
+            index = 0
+            while pending:
+                image = pending.popleft().result()
+                for base in bases:
+                    pending.append(executor.submit(self.__decode, base))
+                    break
+
+                result = self.__render(index, image)
+                self.count += 1
+                index += 1
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def run(self, bases):
+        """
+        Same as results, but yields only images and keywords bounding boxes
+
+        :rtype: generator[tuple(Image, dict)]
+        """
+        for result in self.results(bases):
+            yield result.image, result.bbox
+
+
+def overlay(page, texts, bases, prefetch=4):
+    """
+    Draws texts on every image, see OverlayPipeline
+
+    :rtype: generator[tuple(Image, dict)]
+    """
+    return OverlayPipeline(page, texts, prefetch).run(bases)
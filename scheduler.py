@@ -0,0 +1,278 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from stats import latency_stats
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+class PriorityClass(object):
+    """
+    Class of scheduled work
+    """
+
+    def __init__(self, name, priority, max_concurrency=None, deadline=None):
+        """
+        :type name: str
+        :param priority: classes with lower priority value are run first
+        :param max_concurrency: number of workers the class may take at a time, all if None
+        :param deadline: seconds from submission work of the class is due by default, None for no deadline
+        """
+        self.name = name
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+        self.deadline = deadline
+
+
+def default_classes(workers):
+    """
+    Interactive work first, bulk work leaves a worker for it
+
+    :rtype: list[PriorityClass]
+    """
+    return [PriorityClass(INTERACTIVE, 0, deadline=1.),
+            PriorityClass(BULK, 1, max(1, workers - 1))]
+
+
+class ClassStats(object):
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.waits = deque(maxlen=window)
+        self.completed = 0
+        self.failed = 0
+        self.missed = 0
+        self.preempted = 0
+
+    def report(self, queued, running):
+        return {
+            "queued": queued,
+            "running": running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "missed_deadlines": self.missed,
+            "preempted": self.preempted,
+            "latency": latency_stats(list(self.latencies)),
+            "wait": latency_stats(list(self.waits)),
+        }
+
+
+class ScheduledTask(object):
+    __slots__ = ("cls", "deadline", "submitted", "fn", "args", "kwargs", "future")
+
+    def __init__(self, cls, deadline, fn, args, kwargs):
+        self.cls = cls
+        self.deadline = deadline
+        self.submitted = time.time()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+class RenderScheduler(object):
+    """
+    Runs work of priority classes on a pool of worker threads. A free worker
+    takes the most urgent task of the class with the lowest priority value
+    among classes running less tasks than their max_concurrency; tasks of
+    a class are ordered by deadline, tasks without one run after them in
+    order of submission. Running tasks are never interrupted, queued tasks
+    of a class may be preempted (cancelled) to make room for more urgent work
+    and resubmitted later, see RenderScheduler.preempt.
+
+    Latency (submission to completion) and wait (submission to start)
+    percentiles are reported per class, see RenderScheduler.report.
+    """
+
+    def __init__(self, workers=4, classes=None, window=10000):
+        """
+        :param workers: number of worker threads
+        :param classes: priority classes, see default_classes if None
+        :type classes: list[PriorityClass]
+        :param window: number of recent tasks percentiles are reported for
+        """
+        assert workers >= 1
+
+        self.__classes = dict((c.name, c) for c in (classes or default_classes(workers)))
+        self.__queues = dict((name, []) for name in self.__classes)
+        self.__running = dict((name, 0) for name in self.__classes)
+        self.__stats = dict((name, ClassStats(window)) for name in self.__classes)
+        self.__order = itertools.count()
+        self.__condition = threading.Condition()
+        self.__closed = False
+
+        self.__threads = [threading.Thread(target=self.__work, daemon=True) for _ in range(workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    def submit(self, cls, fn, *args, **kwargs):
+        """
+        Queues fn(*args, **kwargs)
+
+        :param cls: name of priority class
+        :return: future of the result, cancelled if the task is preempted
+        :rtype: Future
+        """
+        return self.submit_until(cls, None, fn, *args, **kwargs)
+
+    def submit_until(self, cls, deadline, fn, *args, **kwargs):
+        """
+        Queues fn(*args, **kwargs) due in deadline seconds
+
+        :param cls: name of priority class
+        :param deadline: seconds from now, deadline of the class if None
+        :rtype: Future
+        """
+        config = self.__classes[cls]
+        if deadline is None:
+            deadline = config.deadline
+
+        task = ScheduledTask(cls, None, fn, args, kwargs)
+        task.deadline = task.submitted + deadline if deadline is not None else None
+        self.__push(task)
+        return task.future
+
+    def resubmit(self, task):
+        """
+        Queues a preempted task again, it keeps its class and deadline,
+        a task without deadline runs after tasks of its class queued before
+
+        :type task: ScheduledTask
+        :return: future of the result
+        :rtype: Future
+        """
+        resubmitted = ScheduledTask(task.cls, task.deadline, task.fn, task.args, task.kwargs)
+        self.__push(resubmitted)
+        return resubmitted.future
+
+    def __push(self, task):
+        with self.__condition:
+            if self.__closed:
+                raise RuntimeError("scheduler is closed")
+            key = (0, task.deadline) if task.deadline is not None else (1, 0)
+            heapq.heappush(self.__queues[task.cls], (key, next(self.__order), task))
+            self.__condition.notify()
+
+    def render(self, cls, page, texts, deadline=None, **kwargs):
+        """
+        Queues page.render(texts, **kwargs)
+
+        :type page: text.Page
+        :rtype: Future
+        """
+        return self.submit_until(cls, deadline, page.render, texts, **kwargs)
+
+    def preempt(self, cls):
+        """
+        Cancels queued tasks of the class, running tasks are completed.
+        Cancelled tasks are returned in the order they would have run, they
+        can be queued again with RenderScheduler.resubmit.
+
+        :return: cancelled tasks
+        :rtype: list[ScheduledTask]
+        """
+        with self.__condition:
+            queue = self.__queues[cls]
+            tasks = [task for _, _, task in sorted(queue)]
+            del queue[:]
+            self.__stats[cls].preempted += len(tasks)
+
+        for task in tasks:
+            task.future.cancel()
+        return tasks
+
+    def __next(self):
+        """
+        Takes the next task to run, called with the lock held
+
+        :rtype: ScheduledTask
+        """
+        best = None
+        for name, queue in self.__queues.items():
+            config = self.__classes[name]
+            if not queue or (config.max_concurrency is not None and
+                             self.__running[name] >= config.max_concurrency):
+                continue
+            rank = (config.priority, queue[0][0], queue[0][1])
+            if best is None or rank < best[0]:
+                best = (rank, name)
+
+        if best is None:
+            return None
+        self.__running[best[1]] += 1
+        return heapq.heappop(self.__queues[best[1]])[2]
+
+    def __work(self):
+        while True:
+            with self.__condition:
+                task = self.__next()
+                while task is None:
+                    if self.__closed:
+                        return
+                    self.__condition.wait()
+                    task = self.__next()
+
+            self.__run(task)
+
+            with self.__condition:
+                self.__running[task.cls] -= 1
+                self.__condition.notify_all()
+
+    def __run(self, task):
+        started = time.time()
+        if not task.future.set_running_or_notify_cancel():
+            return
+
+        try:
+            result = task.fn(*task.args, **task.kwargs)
+        except BaseException as e:
+            task.future.set_exception(e)
+            failed = True
+        else:
+            task.future.set_result(result)
+            failed = False
+
+        finished = time.time()
+        with self.__condition:
+            stats = self.__stats[task.cls]
+            stats.completed += 1
+            stats.failed += failed
+            stats.missed += task.deadline is not None and finished > task.deadline
+            stats.latencies.append(finished - task.submitted)
+            stats.waits.append(started - task.submitted)
+
+    def report(self):
+        """
+        Queued, running, completed, failed and preempted tasks, missed
+        deadlines and percentiles of latency and wait of every class
+
+        :rtype: dict
+        """
+        with self.__condition:
+            return dict((name, stats.report(len(self.__queues[name]), self.__running[name]))
+                        for name, stats in self.__stats.items())
+
+    def close(self, cancel=False):
+        """
+        Stops workers after queued tasks are run
+
+        :param cancel: cancels queued tasks instead of running them
+        """
+        if cancel:
+            for name in self.__classes:
+                self.preempt(name)
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+        for thread in self.__threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,452 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from glyphcache import SpriteCache
+from jobs import JobRunner, read_jobs, resolve_paths
+from stats import latency_stats
+from layoutcache import PersistentLayoutCache
+
+
+class ServerMetrics(object):
+    """
+    Counters and latencies of recent jobs of the server
+    """
+
+    def __init__(self, window=10000):
+        """
+        :param window: number of recent jobs latencies are reported for
+        """
+        self.__lock = threading.Lock()
+        self.__latencies = deque(maxlen=window)
+        self.started = time.time()
+        self.requests = 0
+        self.jobs = 0
+        self.failed = 0
+        self.rejected = 0
+        self.in_flight = 0
+
+    def request(self):
+        with self.__lock:
+            self.requests += 1
+
+    def reject(self):
+        with self.__lock:
+            self.rejected += 1
+
+    def begin(self):
+        with self.__lock:
+            self.in_flight += 1
+
+    def end(self, result):
+        with self.__lock:
+            self.in_flight -= 1
+            self.jobs += 1
+            self.failed += not result["ok"]
+            self.__latencies.append(result["seconds"]["total"])
+
+    def report(self):
+        """
+        :rtype: dict
+        """
+        with self.__lock:
+            latencies = list(self.__latencies)
+            return {
+                "uptime": time.time() - self.started,
+                "requests": self.requests,
+                "jobs": self.jobs,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "in_flight": self.in_flight,
+                "latency": latency_stats(latencies),
+            }
+
+
+class RenderServer(object):
+    """
+    Long-running render server keeping fonts, pages of job settings and
+    optionally rendered pieces of text and layouts warm between requests,
+    see jobs.JobRunner. Serves HTTP/1.1 on localhost or on a Unix socket,
+    requests on a connection may be pipelined:
+
+    - POST /render: job (see jobs.parse_job) in the body, returns the job
+      result as JSON, or PNG image with ?return=image (result without
+      bounding boxes in X-Render-Result header)
+    - POST /jobs: JSON Lines of jobs, they are rendered concurrently and
+      results are streamed back as JSON Lines in the order of jobs
+    - GET /health, GET /metrics
+
+    Jobs are rendered on a pool of workers threads. At most workers + queue
+    jobs are accepted at a time, others are rejected with 503.
+
+    Bodies of POST requests must be application/json (or
+    application/x-ndjson for /jobs), so that browsers can't send jobs with
+    simple cross-origin requests. Jobs with output or base paths are
+    refused unless root is given, paths are resolved under root then.
+    """
+
+    def __init__(self, address=("127.0.0.1", 0), workers=4, queue=64, runner=None, root=None):
+        """
+        :param address: (host, port) to serve HTTP on or path of Unix socket
+        :param workers: number of render threads
+        :param queue: number of accepted jobs waiting for a worker
+        :param runner: renders jobs, JobRunner with a font cache if None
+        :type runner: JobRunner
+        :param root: directory output and base paths of jobs are resolved in, see jobs.resolve_paths
+        """
+        assert workers >= 1 and queue >= 0
+
+        self.runner = runner or JobRunner(fonts={})
+        self.root = root
+        self.metrics = ServerMetrics()
+        self.__workers = workers
+        self.__slots = threading.BoundedSemaphore(workers + queue)
+        self.__executor = ThreadPoolExecutor(workers)
+        self.__thread = None
+
+        handler = type("Handler", (RenderRequestHandler,), {"render_server": self})
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self.__server = ThreadingUnixHTTPServer(address, handler)
+        else:
+            self.__server = ThreadingHTTPServer(address, handler)
+        self.__server.daemon_threads = True
+
+    @property
+    def address(self):
+        """
+        (host, port) or path of Unix socket the server listens on
+        """
+        return self.__server.server_address
+
+    def check(self, job):
+        """
+        :return: job with resolved paths, or error result if the job is refused
+        :rtype: dict
+        """
+        try:
+            return resolve_paths(job, self.root)
+        except ValueError as e:
+            return {"id": job.get("id"), "ok": False, "error": str.format("ValueError: {0}", e)}
+
+    def submit(self, job, encode=None, wait=False):
+        """
+        Queues the job for rendering
+
+        :param encode: see JobRunner.render
+        :param wait: waits for a free slot instead of rejecting the job when the queue is full
+        :return: future of the job result, None if the queue is full
+        :rtype: concurrent.futures.Future
+        """
+        if not self.__slots.acquire(blocking=wait):
+            self.metrics.reject()
+            return None
+
+        self.metrics.begin()
+        try:
+            future = self.__executor.submit(self.runner.render, job, encode)
+        except BaseException:
+            self.__slots.release()
+            raise
+        future.add_done_callback(self.__done)
+        return future
+
+    def __done(self, future):
+        self.__slots.release()
+        self.metrics.end(future.result())
+
+    def report(self):
+        """
+        Metrics of the server and its caches
+
+        :rtype: dict
+        """
+        report = self.metrics.report()
+        report["workers"] = self.__workers
+        report["runner"] = self.runner.stats()
+        return report
+
+    def serve_forever(self):
+        self.__server.serve_forever()
+
+    def start(self):
+        """
+        Serves requests on a background thread
+
+        :rtype: RenderServer
+        """
+        self.__thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def close(self):
+        if self.__thread is not None:
+            self.__server.shutdown()
+            self.__thread.join()
+            self.__thread = None
+        self.__server.server_close()
+        self.__executor.shutdown()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    content_types = {"/render": ("application/json",), "/jobs": ("application/json", "application/x-ndjson")}
+
+    # set by RenderServer
+    render_server = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def __send(self, status, body, content_type="application/json", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __send_json(self, status, value):
+        self.__send(status, json.dumps(value).encode("utf-8"))
+
+    def __body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        self.render_server.metrics.request()
+        path = urlparse(self.path).path
+        if path == "/health":
+            self.__send_json(200, {"status": "ok"})
+        elif path == "/metrics":
+            self.__send_json(200, self.render_server.report())
+        else:
+            self.__send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        self.render_server.metrics.request()
+        url = urlparse(self.path)
+        body = self.__body()
+        if url.path in self.content_types and self.headers.get_content_type() not in self.content_types[url.path]:
+            self.__send_json(415, {"ok": False, "error": str.format("content type must be {0}",
+                                                                     " or ".join(self.content_types[url.path]))})
+        elif url.path == "/render":
+            self.__render(body, parse_qs(url.query).get("return", ["result"])[0])
+        elif url.path == "/jobs":
+            self.__jobs(body)
+        else:
+            self.__send_json(404, {"error": "not found"})
+
+    def __render(self, body, returns):
+        jobs = [job if "ok" in job else self.render_server.check(job) for job in read_jobs([body.decode("utf-8")])]
+        if len(jobs) != 1 or "ok" in jobs[0]:
+            self.__send_json(400, jobs[0] if jobs else {"ok": False, "error": "no job"})
+            return
+
+        future = self.render_server.submit(jobs[0], "PNG" if returns == "image" else None)
+        if future is None:
+            self.__send_json(503, {"id": jobs[0].get("id"), "ok": False, "error": "queue is full"})
+            return
+
+        result = future.result()
+        if not result["ok"]:
+            self.__send_json(422, result)
+        elif returns == "image":
+            image = result.pop("image")
+            result.pop("bbox")
+            self.__send(200, image, "image/png", [("X-Render-Result", json.dumps(result))])
+        else:
+            self.__send_json(200, result)
+
+    def __jobs(self, body):
+        """
+        Streams results of JSON Lines jobs in chunks, jobs are submitted as
+        slots of the pool free up, results are written as soon as they and
+        results of preceding jobs are ready
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        pending = deque()
+        for job in read_jobs(body.decode("utf-8").splitlines()):
+            if "ok" not in job:
+                job = self.render_server.check(job)
+            while pending and (isinstance(pending[0], dict) or pending[0].done()):
+                self.__write_result(pending.popleft())
+            pending.append(self.render_server.submit(job, wait=True) if "ok" not in job else job)
+        while pending:
+            self.__write_result(pending.popleft())
+
+        self.wfile.write(b"0\r\n\r\n")
+
+    def __write_result(self, item):
+        result = item if isinstance(item, dict) else item.result()
+        line = (json.dumps(result) + "\n").encode("utf-8")
+        self.wfile.write(str.format("{0:x}\r\n", len(line)).encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over Unix socket
+    """
+
+    def __init__(self, path, timeout=60):
+        super(UnixHTTPConnection, self).__init__("localhost", timeout=timeout)
+        self.__path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.__path)
+
+
+def connect(address, timeout=60):
+    """
+    Connection to the server
+
+    :param address: (host, port) or path of Unix socket
+    :rtype: http.client.HTTPConnection
+    """
+    if isinstance(address, str):
+        return UnixHTTPConnection(address, timeout)
+    return http.client.HTTPConnection(address[0], address[1], timeout=timeout)
+
+
+def request(connection, method, path, value=None):
+    """
+    Sends the request and reads JSON response
+
+    :return: status and response value
+    :rtype: tuple(int, object)
+    """
+    body = json.dumps(value).encode("utf-8") if value is not None else None
+    connection.request(method, path, body, {"Content-Type": "application/json"} if body else {})
+    response = connection.getresponse()
+    data = response.read()
+    return response.status, json.loads(data.decode("utf-8"))
+
+
+def load_test(address, jobs, requests=100, concurrency=4):
+    """
+    Sends jobs to /render of the server in a loop from concurrency
+    connections, requests in total
+
+    :param address: (host, port) or path of Unix socket
+    :type jobs: list[dict]
+    :return: requests, errors, seconds, requests per second and client-side latency
+    :rtype: dict
+    """
+    assert jobs and concurrency >= 1
+
+    counter = iter(range(requests))
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def client():
+        connection = connect(address)
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                started = time.time()
+                status, _ = request(connection, "POST", "/render", jobs[i % len(jobs)])
+                with lock:
+                    latencies.append(time.time() - started)
+                    errors[0] += status != 200
+        finally:
+            connection.close()
+
+    started = time.time()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    seconds = time.time() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "seconds": seconds,
+        "requests_per_sec": len(latencies) / seconds if seconds else 0.,
+        "latency": latency_stats(latencies),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render server and its load generator")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("serve", "load"):
+        command = commands.add_parser(name)
+        command.add_argument("--host", default="127.0.0.1")
+        command.add_argument("--port", type=int, default=8765)
+        command.add_argument("--socket", help="path of Unix socket, used instead of host and port")
+
+    serve = commands.choices["serve"]
+    serve.add_argument("-w", "--workers", type=int, default=4)
+    serve.add_argument("--queue", type=int, default=64, help="accepted jobs waiting for a worker")
+    serve.add_argument("--sprite-cache", type=int, default=0, metavar="MB",
+                       help="memory of cached rendered pieces of text, see glyphcache.SpriteCache")
+    serve.add_argument("--layout-cache", metavar="FILE", help="see layoutcache.PersistentLayoutCache")
+    serve.add_argument("--root", help="directory output and base paths of jobs are resolved in, "
+                                      "jobs with paths are refused without it")
+
+    load = commands.choices["load"]
+    load.add_argument("jobs", help="JSON Lines jobs sent in a loop")
+    load.add_argument("-n", "--requests", type=int, default=100)
+    load.add_argument("-c", "--concurrency", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    address = args.socket or (args.host, args.port)
+    if args.command == "load":
+        with open(args.jobs) as f:
+            jobs = [job for job in read_jobs(f) if "ok" not in job]
+        sys.stdout.write(json.dumps(load_test(address, jobs, args.requests, args.concurrency), indent=2) + "\n")
+        return 0
+
+    runner = JobRunner(fonts={},
+                       text_cache=SpriteCache(args.sprite_cache * 1024 * 1024) if args.sprite_cache else None,
+                       layout_cache=PersistentLayoutCache(args.layout_cache) if args.layout_cache else None)
+    server = RenderServer(address, args.workers, args.queue, runner, args.root)
+    sys.stderr.write(str.format("serving on {0}\n", server.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+from collections import OrderedDict
+
+from PIL import Image
+
+
+class GroupRender(object):
+    def __init__(self, layout, images, bbox):
+        """
+        :type layout: text.GroupLayout
+        :type images: list[Image]
+        :type bbox: dict
+        """
+        self.layout = layout
+        self.images = images
+        self.bbox = bbox
+        self.__extent = False
+
+    @property
+    def extent(self):
+        """
+        Box of the pixels drawn by the group, None if nothing is drawn
+
+        :rtype: tuple
+        """
+        if self.__extent is False:
+            self.__extent = union_boxes(image.getbbox() for image in self.images)
+        return self.__extent
+
+
+class Patch(object):
+    def __init__(self, box, image):
+        """
+        Changed rectangle of a frame
+
+        :type box: tuple
+        :type image: Image
+        """
+        self.box = box
+        self.image = image
+
+    @property
+    def offset(self):
+        return self.box[0], self.box[1]
+
+    def __str__(self):
+        return str.format("{0}", self.box)
+
+
+def union_boxes(boxes):
+    """
+    Box covering all boxes, None values are skipped
+
+    :rtype: tuple
+    """
+    result = None
+    for box in boxes:
+        if box is None:
+            continue
+        if result is None:
+            result = tuple(box)
+        else:
+            result = (min(result[0], box[0]), min(result[1], box[1]),
+                      max(result[2], box[2]), max(result[3], box[3]))
+    return result
+
+
+def merge_boxes(boxes):
+    """
+    Merges overlapping boxes until no boxes overlap
+
+    :rtype: list[tuple]
+    """
+    boxes = [tuple(box) for box in boxes if box is not None]
+    merged = True
+
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for i, other in enumerate(result):
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    result[i] = union_boxes([box, other])
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+
+    return boxes
+
+
+def apply_patches(frame, patches):
+    """
+    Pastes patches over the frame they were made against
+
+    :type frame: Image
+    :type patches: list[Patch]
+    :rtype: Image
+    """
+    for patch in patches:
+        frame.paste(patch.image, patch.offset)
+    return frame
+
+
+class RenderSession(object):
+    """
+    Renders texts on the same page again and again. Layouts and layers of
+    groups are kept between renders, only groups whose texts (or page
+    settings) changed since the previous render are laid out and drawn.
+    """
+
+    def __init__(self, page, max_groups=None):
+        """
+        :type page: text.Page
+        :param max_groups: number of least recently used groups kept in addition
+                           to groups of the last render, None keeps only the last render
+        """
+        self.__page = page
+        self.__groups = OrderedDict()
+        self.__last = []
+        self.__max_groups = max_groups
+        self.__redrawn = 0
+        self.__has_frame = False
+
+    @property
+    def page(self):
+        return self.__page
+
+    @property
+    def redrawn(self):
+        """
+        Number of groups drawn by the last render
+        """
+        return self.__redrawn
+
+    @staticmethod
+    def group_key(key, group):
+        """
+        Content key of the group, see Text.fingerprint
+
+        :type key: text.TextGroup
+        :type group: list[text.Text]
+        :rtype: tuple
+        """
+        return (key.type, key.xloc, key.yloc) + tuple(t.fingerprint for t in group)
+
+    def render_groups(self, texts):
+        """
+        Lays out and draws groups that changed since the previous render
+
+        :type texts: list[text.Text]
+        :return: content key and render of every group in page order
+        :rtype: list[tuple(tuple, GroupRender)]
+        """
+        page = self.__page
+        settings = page.settings_key
+
+        groups = []
+        changed = []
+        for key, group in page.group_texts(texts):
+            content_key = (settings, self.group_key(key, group))
+            groups.append(content_key)
+            if content_key in self.__groups:
+                self.__groups.move_to_end(content_key)
+            else:
+                changed.append((content_key, (key, group)))
+
+        if changed:
+            layouts = page.layout_groups([g for _, g in changed])
+            rendered = page.draw_groups(layouts)
+            for (content_key, _), layout, (images, bbox) in zip(changed, layouts, rendered):
+                self.__groups[content_key] = GroupRender(layout, images, bbox)
+
+        self.__redrawn = len(changed)
+        self.__last = [(k, self.__groups[k]) for k in groups]
+
+        keep = len(groups) + (self.__max_groups or 0)
+        while len(self.__groups) > keep:
+            self.__groups.popitem(last=False)
+
+        return self.__last
+
+    def render(self, texts):
+        """
+        Renders text items reusing groups of the previous render
+
+        :type texts: list[text.Text]
+        :rtype: RenderResult
+        """
+        groups = self.render_groups(texts)
+        return self.__page.compose([(g.images, g.bbox) for _, g in groups])
+
+    def render_patches(self, texts):
+        """
+        Renders text items and returns only rectangles of the page that changed
+        since the previous render. The first render returns the whole page.
+
+        :type texts: list[text.Text]
+        :return: patches to apply to the previous frame and keywords bounding boxes
+        :rtype: tuple(list[Patch], dict)
+        """
+        previous = dict(self.__last)
+        groups = self.render_groups(texts)
+
+        if self.__has_frame:
+            current = set(k for k, _ in groups)
+            changed = [g.extent for k, g in groups if k not in previous]
+            changed += [g.extent for k, g in previous.items() if k not in current]
+            dirty = merge_boxes(changed)
+        else:
+            dirty = [(0, 0) + self.__page.size]
+        self.__has_frame = True
+
+        images = [image for _, g in groups for image in g.images]
+        patches = [Patch(box, self.__compose_region(images, box)) for box in dirty]
+
+        bbox = {}
+        for _, g in groups:
+            for kw, boxes in g.bbox.items():
+                bbox.setdefault(kw, []).extend(boxes)
+
+        return patches, bbox
+
+    @staticmethod
+    def __compose_region(images, box):
+        if not images:
+            return Image.new("RGBA", (box[2] - box[0], box[3] - box[1]), (0, 0, 0, 0))
+
+        result = images[0].crop(box)
+        for image in images[1:]:
+            result = Image.alpha_composite(result, image.crop(box))
+        return result
+
+    # noinspection PyPep8Naming
+    def generateTextImage(self, texts, imagefile):
+        """
+        Same as Page.generateTextImage, but draws only changed groups
+
+        :type texts: list[text.Text]
+        :type imagefile: str
+        :return: keywords bounding boxes
+        :rtype: dict
+        """
+        result = self.render(texts)
+        result.save(imagefile)
+        return result.bbox
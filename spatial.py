@@ -0,0 +1,202 @@
+import json
+import math
+
+
+class BoxIndex(dict):
+    """
+    Keywords bounding boxes (keyword to list of BoundingBox, like the bbox
+    dict of Page.generateTextImage) with a uniform grid index over them for
+    hit testing. The index is built when the object is created, it isn't
+    updated when the dict is changed.
+
+    Queries return (keyword, BoundingBox) pairs in the order of keywords
+    and boxes in the dict.
+    """
+
+    def __init__(self, bbox=None, cell=None):
+        """
+        :param bbox: keywords bounding boxes
+        :type bbox: dict
+        :param cell: size of grid cells in pixels, chosen by the size of boxes if None
+        """
+        super(BoxIndex, self).__init__(bbox or {})
+        self.__entries = [(kw, b) for kw, boxes in self.items() for b in boxes]
+        self.__cell = cell or self.__cell_size(self.__entries)
+        self.__cells = {}
+        self.__grid = None
+
+        for i, (_, b) in enumerate(self.__entries):
+            for key in self.__cell_keys(b.box):
+                self.__cells.setdefault(key, []).append(i)
+
+    @staticmethod
+    def __cell_size(entries):
+        if not entries:
+            return 64
+        sizes = [max(b.box[2] - b.box[0], b.box[3] - b.box[1]) for _, b in entries]
+        return max(16, int(math.ceil(sum(sizes) / len(sizes))))
+
+    @property
+    def cell(self):
+        return self.__cell
+
+    @property
+    def entries(self):
+        """
+        :rtype: list[tuple(str, BoundingBox)]
+        """
+        return list(self.__entries)
+
+    def __cell_keys(self, box):
+        cell = self.__cell
+        for cx in range(int(box[0] // cell), int(box[2] // cell) + 1):
+            for cy in range(int(box[1] // cell), int(box[3] // cell) + 1):
+                yield cx, cy
+
+    def __candidates(self, box):
+        ids = set()
+        for key in self.__cell_keys(box):
+            ids.update(self.__cells.get(key, ()))
+        return sorted(ids)
+
+    def __bounds(self):
+        """
+        Cells range (x0, y0, x1, y1) covered by boxes
+        """
+        if self.__grid is None:
+            keys = list(self.__cells.keys())
+            self.__grid = (min(k[0] for k in keys), min(k[1] for k in keys),
+                           max(k[0] for k in keys), max(k[1] for k in keys))
+        return self.__grid
+
+    def at(self, x, y):
+        """
+        Boxes containing the point
+
+        :rtype: list[tuple(str, BoundingBox)]
+        """
+        return [self.__entries[i] for i in self.__candidates((x, y, x, y))
+                if contains(self.__entries[i][1].box, x, y)]
+
+    def intersecting(self, box):
+        """
+        Boxes intersecting the rectangle
+
+        :param box: rectangle (x0, y0, x1, y1)
+        :rtype: list[tuple(str, BoundingBox)]
+        """
+        return [self.__entries[i] for i in self.__candidates(box)
+                if intersects(self.__entries[i][1].box, box)]
+
+    def nearest(self, x, y, max_distance=None):
+        """
+        Box nearest to the point, searched in rings of cells around it
+
+        :param max_distance: boxes farther than that aren't returned
+        :return: keyword, box and distance to it, None if there are no boxes
+        :rtype: tuple(str, BoundingBox, float)
+        """
+        if not self.__entries:
+            return None
+
+        cell = self.__cell
+        cx, cy = int(x // cell), int(y // cell)
+        x0, y0, x1, y1 = self.__bounds()
+        reach = max(abs(cx - x0), abs(cx - x1), abs(cy - y0), abs(cy - y1))
+
+        best = None
+        checked = set()
+        for ring in range(reach + 1):
+            # boxes in farther rings are at least that far
+            if best is not None and best[2] <= (ring - 1) * cell:
+                break
+            if max_distance is not None and (ring - 1) * cell > max_distance:
+                break
+
+            for key in ring_keys(cx, cy, ring):
+                for i in self.__cells.get(key, ()):
+                    if i in checked:
+                        continue
+                    checked.add(i)
+                    kw, b = self.__entries[i]
+                    d = distance(b.box, x, y)
+                    if best is None or d < best[2] or (d == best[2] and i < best[3]):
+                        best = (kw, b, d, i)
+
+        if best is None or (max_distance is not None and best[2] > max_distance):
+            return None
+        return best[:3]
+
+    def to_json(self):
+        """
+        Boxes with the index
+
+        :rtype: str
+        """
+        return json.dumps({
+            "cell": self.__cell,
+            "boxes": [[kw, list(b.box), b.outline] for kw, b in self.__entries],
+            "cells": [[kx, ky, ids] for (kx, ky), ids in self.__cells.items()],
+        })
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Restores the boxes and the index without building it again
+
+        :type data: str
+        :rtype: BoxIndex
+        """
+        # text imports this module
+        from text import BoundingBox
+
+        data = json.loads(data)
+        index = cls.__new__(cls)
+        dict.__init__(index)
+        index.__entries = []
+        for kw, box, outline in data["boxes"]:
+            b = BoundingBox(box, tuple(outline) if isinstance(outline, list) else outline)
+            index.setdefault(kw, []).append(b)
+            index.__entries.append((kw, b))
+        index.__cell = data["cell"]
+        index.__cells = dict(((kx, ky), ids) for kx, ky, ids in data["cells"])
+        index.__grid = None
+        return index
+
+    def __reduce__(self):
+        return self.__class__.from_json, (self.to_json(),)
+
+
+def contains(box, x, y):
+    return box[0] <= x <= box[2] and box[1] <= y <= box[3]
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def distance(box, x, y):
+    """
+    Distance from the point to the box, 0 inside the box
+
+    :rtype: float
+    """
+    dx = max(box[0] - x, 0, x - box[2])
+    dy = max(box[1] - y, 0, y - box[3])
+    return math.hypot(dx, dy)
+
+
+def ring_keys(cx, cy, ring):
+    """
+    Cells at Chebyshev distance ring from the cell (cx, cy)
+    """
+    if ring == 0:
+        yield cx, cy
+        return
+
+    for kx in range(cx - ring, cx + ring + 1):
+        yield kx, cy - ring
+        yield kx, cy + ring
+    for ky in range(cy - ring + 1, cy + ring):
+        yield cx - ring, ky
+        yield cx + ring, ky
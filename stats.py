@@ -0,0 +1,26 @@
+import math
+
+
+def latency_stats(latencies):
+    """
+    Percentiles of latencies (nearest rank)
+
+    :type latencies: list[float]
+    :return: count, mean, p50, p90, p99 and max
+    :rtype: dict
+    """
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0}
+
+    def rank(p):
+        return values[min(len(values) - 1, max(0, int(math.ceil(p * len(values))) - 1))]
+
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": rank(0.5),
+        "p90": rank(0.9),
+        "p99": rank(0.99),
+        "max": values[-1],
+    }
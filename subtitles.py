@@ -0,0 +1,134 @@
+from session import RenderSession
+
+
+class Cue(object):
+    def __init__(self, start, end, texts):
+        """
+        Texts shown from start till end
+
+        :type start: int|float
+        :type end: int|float
+        :type texts: list[text.Text]
+        """
+        assert start < end
+
+        self.start = start
+        self.end = end
+        self.texts = texts
+
+    def __str__(self):
+        return str.format("{0}-{1} {2}", self.start, self.end, [t.value for t in self.texts])
+
+
+class SequenceFrame(object):
+    def __init__(self, ranges, texts, result):
+        """
+        Distinct visual state of a sequence
+
+        :param ranges: time ranges (start, end) the frame is shown
+        :type texts: list[text.Text]
+        :type result: text.RenderResult
+        """
+        self.ranges = ranges
+        self.texts = texts
+        self.result = result
+
+    @property
+    def image(self):
+        return self.result.image
+
+    @property
+    def bbox(self):
+        return self.result.bbox
+
+    def __str__(self):
+        return str.format("{0} {1}", self.ranges, [t.value for t in self.texts])
+
+
+def state_key(texts):
+    """
+    Content key of texts shown together
+
+    :type texts: list[text.Text]
+    :rtype: tuple
+    """
+    return tuple(t.fingerprint for t in sorted(texts, key=lambda x: x.index))
+
+
+def cue_states(cues):
+    """
+    Splits the timeline into ranges with the same texts shown. Adjacent ranges
+    with the same content are joined, ranges without texts are skipped.
+
+    :type cues: list[Cue]
+    :return: start, end, content key and texts of every range in time order
+    :rtype: list[tuple]
+    """
+    bounds = sorted(set(b for cue in cues for b in (cue.start, cue.end)))
+    states = []
+
+    for start, end in zip(bounds, bounds[1:]):
+        texts = [t for cue in cues if cue.start <= start and end <= cue.end for t in cue.texts]
+        if not texts:
+            continue
+
+        key = state_key(texts)
+        if states and states[-1][1] == start and states[-1][2] == key:
+            states[-1] = (states[-1][0], end, key, states[-1][3])
+        else:
+            states.append((start, end, key, texts))
+
+    return states
+
+
+class SequenceRenderer(object):
+    """
+    Renders timed cues on a page. Every distinct set of shown texts is
+    rendered once, groups shared by overlapping or repeating cues are laid
+    out and drawn once as well.
+    """
+
+    def __init__(self, page, max_groups=64):
+        """
+        :type page: text.Page
+        :param max_groups: number of groups kept for reuse, see RenderSession
+        """
+        self.__session = RenderSession(page, max_groups)
+
+    @property
+    def session(self):
+        return self.__session
+
+    def render(self, cues):
+        """
+        Renders distinct frames of the sequence in order of first appearance
+
+        :type cues: list[Cue]
+        :rtype: generator[SequenceFrame]
+        """
+        states = cue_states(cues)
+        ranges = {}
+
+        for start, end, key, _ in states:
+            ranges.setdefault(key, []).append((start, end))
+
+        for _, _, key, texts in states:
+            if key not in ranges:
+                continue
+
+            result = self.__session.render(texts)
+            yield SequenceFrame(ranges.pop(key), texts, result)
+
+    def timeline(self, cues):
+        """
+        Renders the sequence and returns frames for every time range in time order.
+        Repeating states share the same frame.
+
+        :type cues: list[Cue]
+        :rtype: list[tuple(int|float, int|float, SequenceFrame)]
+        """
+        timeline = []
+        for frame in self.render(cues):
+            for start, end in frame.ranges:
+                timeline.append((start, end, frame))
+        return sorted(timeline, key=lambda x: x[0])
@@ -0,0 +1,257 @@
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from batch import BatchSink
+from bezier import smooth_points
+from text import Page, Style, Text, Type, XLocation, YLocation
+from textboxes import NUMBER_COLUMNS, text_boxes
+
+WORDS = ("the quick brown fox jumps over lazy dog invoice total amount date name address city "
+         "street order number customer account payment due balance item price quantity tax "
+         "shipping phone email reference page note summary report north south east west").split()
+
+
+def text_labels_filename(filename):
+    return os.path.splitext(filename)[0] + ".text.npz"
+
+
+def _text_part(filename, start):
+    return os.path.splitext(filename)[0] + ".text.%d.part.npz" % start
+
+
+class LayoutDistribution(object):
+    """
+    Distribution texts of synthetic pages are sampled from. Ranges are
+    inclusive (min, max) tuples, choices are dicts of values to weights.
+    """
+
+    def __init__(self, words=WORDS, texts=(1, 6), words_per_text=(2, 24), keywords=(0, 2),
+                 types=None, styles=None, xlocs=None, ylocs=None,
+                 polygon_words=(2, 8), polygon_vertices=(5, 9), polygon_radius=(110, 170),
+                 polygon_smooth_factor=0.5, background_probability=0.7):
+        """
+        :param words: vocabulary texts are made of
+        :param texts: number of texts on a page
+        :param words_per_text: number of words of a box text
+        :param keywords: number of keywords of a text
+        :param types: weights of text types
+        :param styles: weights of styles
+        :param xlocs: weights of horizontal locations of box texts
+        :param ylocs: weights of vertical locations of box texts
+        :param polygon_words: number of words of a polygon or callout text
+        :param polygon_vertices: number of random vertices of a polygon before smoothing
+        :param polygon_radius: distance of polygon vertices from its center
+        :param polygon_smooth_factor: smooth factor of polygons, see bezier.smooth_points
+        :param background_probability: probability of a text to have background
+        """
+        self.words = list(words)
+        self.texts = texts
+        self.words_per_text = words_per_text
+        self.keywords = keywords
+        self.types = types or {Type.default: 2, Type.east: 3, Type.west: 3, Type.polygon: 1, Type.callout: 1}
+        self.styles = styles or {Style.normal: 6, Style.h1: 1, Style.h2: 1, Style.h3: 1}
+        self.xlocs = xlocs or {XLocation.left: 1, XLocation.center: 1, XLocation.right: 1}
+        self.ylocs = ylocs or {YLocation.top: 1, YLocation.center: 1, YLocation.bottom: 1}
+        self.polygon_words = polygon_words
+        self.polygon_vertices = polygon_vertices
+        self.polygon_radius = polygon_radius
+        self.polygon_smooth_factor = polygon_smooth_factor
+        self.background_probability = background_probability
+
+    @staticmethod
+    def __choice(rng, weights):
+        values = list(weights.keys())
+        return rng.choices(values, [weights[v] for v in values])[0]
+
+    @staticmethod
+    def __color(rng):
+        return rng.randrange(256), rng.randrange(256), rng.randrange(256)
+
+    def __polygon(self, rng, size, callout):
+        """
+        Random convex polygon inside the page with vertices on an ellipse,
+        callouts get a pointer vertex
+        """
+        rx = rng.uniform(*self.polygon_radius)
+        ry = rng.uniform(*self.polygon_radius)
+        # room for the pointer
+        margin_x = min(rx * 1.5, size[0] / 2.)
+        margin_y = min(ry * 1.5, size[1] / 2.)
+        cx = rng.uniform(margin_x, size[0] - margin_x)
+        cy = rng.uniform(margin_y, size[1] - margin_y)
+
+        count = rng.randint(*self.polygon_vertices)
+        step = 2 * math.pi / count
+        angles = [i * step + rng.uniform(-step / 4, step / 4) for i in range(count)]
+
+        def point(a, scale=1.):
+            x = min(max(cx + scale * rx * math.cos(a), 0), size[0] - 1)
+            y = min(max(cy + scale * ry * math.sin(a), 0), size[1] - 1)
+            return int(x), int(y)
+
+        if callout:
+            # sharp pointer instead of the first vertex, callouts are smoothed by the page.
+            # Polygon widths are measured along listed edges only, so the polygon is closed explicitly
+            a = angles[0]
+            points = [point(a - 0.15), point(a, 1.5), point(a + 0.15)] + [point(a) for a in angles[1:]]
+            return points + points[:1]
+
+        points = []
+        for x, y in smooth_points([point(a) for a in angles], self.polygon_smooth_factor, 0):
+            if not points or points[-1] != (int(x), int(y)):
+                points.append((int(x), int(y)))
+        return points
+
+    def sample(self, rng, size):
+        """
+        Samples texts of one page
+
+        :type rng: random.Random
+        :param size: page width and height
+        :rtype: list[Text]
+        """
+        texts = []
+        for index in range(rng.randint(*self.texts)):
+            text_type = self.__choice(rng, self.types)
+            polygon = text_type in (Type.polygon, Type.callout)
+            words = [rng.choice(self.words)
+                     for _ in range(rng.randint(*(self.polygon_words if polygon else self.words_per_text)))]
+            keywords = sorted(set(rng.sample(words, min(len(words), rng.randint(*self.keywords)))))
+
+            bgcolor = self.__color(rng) if polygon or rng.random() < self.background_probability else None
+            texts.append(Text(index, " ".join(words), keywords, text_type, self.__choice(rng, self.styles),
+                              self.__choice(rng, self.xlocs), self.__choice(rng, self.ylocs),
+                              points=self.__polygon(rng, size, text_type == Type.callout) if polygon else None,
+                              fgcolor=self.__color(rng), bgcolor=bgcolor,
+                              bocolor=self.__color(rng) if polygon else None))
+        return texts
+
+
+def page_random(seed, index):
+    """
+    Random generator of the page, the same for the page no matter which worker renders it
+
+    :rtype: random.Random
+    """
+    return random.Random("%s:%d" % (seed, index))
+
+
+def sample_pages(distribution, size, count, seed=0, start=0):
+    """
+    Texts of pages start..start + count - 1
+
+    :type distribution: LayoutDistribution
+    :rtype: generator[list[Text]]
+    """
+    for index in range(start, start + count):
+        yield distribution.sample(page_random(seed, index), size)
+
+
+def _generate_chunk(filename, distribution, size, seed, start, count):
+    sink = BatchSink(filename, start)
+    page = Page(0, size[0], size[1])
+    labels = None
+
+    for index, texts in enumerate(sample_pages(distribution, size, count, seed, start), start):
+        layout = page.layout(texts)
+        sink.write(index, page, layout)
+        if labels is None:
+            labels = text_boxes(layout, index)
+        else:
+            labels.add_layout(layout, index)
+
+    sink.flush()
+    columns = labels.columns
+    arrays = dict((name, numpy.frombuffer(columns[name], columns[name].typecode)) for name, _ in NUMBER_COLUMNS)
+    numpy.savez(_text_part(filename, start), text=numpy.array(columns["text"], str), **arrays)
+    return count
+
+
+def _collect_text_labels(filename, starts):
+    parts = [_text_part(filename, start) for start in starts]
+    columns = {}
+    for part in parts:
+        with numpy.load(part) as data:
+            for name in data.files:
+                columns.setdefault(name, []).append(data[name])
+
+    labels = dict((name, numpy.concatenate(values)) for name, values in columns.items())
+    numpy.savez(text_labels_filename(filename), **labels)
+    for part in parts:
+        os.remove(part)
+    return labels
+
+
+class DatasetGenerator(object):
+    """
+    Renders seeded synthetic pages into a batch file (see batch.BatchSink)
+    on a process pool. Workers sample the pages they render, so only page
+    ranges are passed to them. Labels are written next to the batch file:
+    keywords boxes (.boxes.npz) and boxes of every line and word with
+    their text (.text.npz, see textboxes.TextBoxes).
+
+    Page i is sampled from a generator seeded by (seed, i), so the dataset
+    is the same for any number of workers.
+    """
+
+    def __init__(self, distribution=None, size=(1024, 576), seed=0):
+        """
+        :type distribution: LayoutDistribution
+        :param size: page width and height
+        :param seed: seed of the dataset
+        """
+        self.distribution = distribution or LayoutDistribution()
+        self.size = size
+        self.seed = seed
+
+    def generate(self, filename, count, workers=1, chunk=64):
+        """
+        Renders count pages to filename
+
+        :type filename: str
+        :type count: int
+        :type workers: int
+        :param chunk: pages rendered by a worker task
+        :return: pages, seconds, pages per second and workers
+        :rtype: dict
+        """
+        assert workers >= 1 and chunk >= 1
+
+        started = time.time()
+        BatchSink.create(filename, count, self.size)
+        starts = list(range(0, count, chunk))
+        tasks = [(filename, self.distribution, self.size, self.seed, start, min(chunk, count - start))
+                 for start in starts]
+
+        if workers == 1:
+            for task in tasks:
+                _generate_chunk(*task)
+        else:
+            with ProcessPoolExecutor(workers) as executor:
+                for future in [executor.submit(_generate_chunk, *task) for task in tasks]:
+                    future.result()
+
+        BatchSink.collect(filename)
+        _collect_text_labels(filename, starts)
+
+        seconds = time.time() - started
+        return {
+            "pages": count,
+            "seconds": seconds,
+            "pages_per_sec": count / seconds if seconds else 0.,
+            "workers": workers,
+        }
+
+    def benchmark(self, filename, count, workers=(1, 2, 4), chunk=16):
+        """
+        Throughput of generating count pages with every number of workers
+
+        :return: statistics of every run, see DatasetGenerator.generate
+        :rtype: list[dict]
+        """
+        return [self.generate(filename, count, w, chunk) for w in workers]
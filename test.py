@@ -1,6 +1,86 @@
-from unittest import TestCase
+import asyncio
+import functools
+import io
+import json
+import math
+import os
+import pickle
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, skipUnless
+from PIL import ImageChops, ImageStat
+try:
+    import numpy
+    from batch import load_boxes, render_batch
+    from synth import DatasetGenerator, LayoutDistribution, sample_pages, text_labels_filename
+except ImportError:
+    numpy = None
 from text import *
-from bezier import line, get_angle, convert_to_degree
+from asyncrender import AsyncRenderer
+from session import RenderSession, apply_patches, merge_boxes
+from subtitles import Cue, SequenceRenderer, cue_states
+from bezier import line, get_angle, convert_to_degree, smooth_points
+import textwrap2
+from glyphcache import GlyphAtlas, SpriteCache
+from outputcache import OutputCache
+from layoutcache import PersistentLayoutCache
+from metrics import SharedFontMetrics, page_fonts
+from pipeline import OverlayPipeline
+from textboxes import LINE, WORD, text_boxes
+from spatial import BoxIndex
+from benchmark import benchmark_texts
+from jobs import JobRunner, read_jobs, resolve_paths, run_jobs
+from stats import latency_stats
+from server import RenderServer, connect, load_test, request
+from scheduler import BULK, INTERACTIVE, PriorityClass, RenderScheduler
+from costmodel import FEATURES, CostModel, StealingQueues, balance, page_features
+from budget import COARSE_BEZIER, FAST_ENCODE, NO_HIGHLIGHT, POLYGON_PROBES, TimeBudget
+
+
+def font_available():
+    try:
+        ImageFont.truetype(StyleInfo(20, 25).font_face, 20)
+        return True
+    except IOError:
+        return False
+
+
+def sample_texts():
+    text = "The quick brown fox jumps over the lazy dog"
+    return [
+        Text(0, text, ['brown'], Type.default, Style.h2, fgcolor=(255, 0, 0), bgcolor=(0, 0, 0)),
+        Text(1, text, ['fox'], Type.east, Style.normal, XLocation.left, YLocation.top, bgcolor=(0, 0, 0)),
+        Text(2, text, ['fox'], Type.east, Style.normal, XLocation.left, YLocation.top, bgcolor=(0, 0, 0)),
+        Text(3, text, ['lazy'], Type.west, Style.h1, XLocation.right, YLocation.bottom, bgcolor="#cccccc"),
+        Text(4, text * 3, ['quick'], Type.callout, Style.normal, fgcolor="#FFFFFF", bgcolor="#FF0FF0",
+             bocolor="#000000",
+             points=[(578, 55), (540, 115), (400, 155), (554, 172), (600, 217), (667, 232), (745, 223),
+                     (794, 197), (823, 146), (817, 87), (774, 44), (714, 22), (635, 23)]),
+    ]
+
+
+def bbox_values(bbox):
+    return {kw: [b.box for b in boxes] for kw, boxes in bbox.items()}
+
+
+class RenderTestCase(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def assertSameImage(self, first, second):
+        with Image.open(first) as a, Image.open(second) as b:
+            self.assertIsNone(ImageChops.difference(a, b).getbbox())
 
 
 class TestColor(TestCase):
@@ -62,6 +142,1315 @@ class TestCreateLine(TestCase):
         self.assertEqual(expected, result2)
 
 
+class TestWidthCache(TestCase):
+    def testSameLinesWithCache(self):
+        font = ImageFont.load_default()
+        text = "The quick brown fox jumps over the lazy dog " * 5
+        cache = {}
+
+        self.assertEqual(textwrap2.wrap(font, 100, text), textwrap2.wrap(font, 100, text, width_cache=cache))
+        self.assertEqual(font.getsize("quick")[0], cache["quick"])
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testSplitTextKeepsLineWidths(self):
+        font = ImageFont.truetype(StyleInfo(20, 25).font_face, 20)
+        helper = ImageDraw2(Image.new("RGBA", (1, 1)), mode="RGBA")
+        split = helper.split_text_to_multiline("The quick brown fox jumps over the lazy dog", font, 60, 2)
+
+        self.assertEqual(split.text, "\n".join(split.lines))
+        self.assertEqual([helper.textsize(l, font)[0] for l in split.lines], split.widths)
+        self.assertEqual(helper.multiline_textsize(split.text, font, 2), split.size)
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestParallelGroups(RenderTestCase):
+    def testSameAsSerial(self):
+        serial = Page(0, 1024, 576)
+        bbox = bbox_values(serial.generateTextImage(sample_texts(), self.path('serial.png')))
+
+        parallel = Page(0, 1024, 576)
+        parallel.set_parallel(4)
+        parallel_bbox = bbox_values(parallel.generateTextImage(sample_texts(), self.path('parallel.png')))
+
+        self.assertEqual(bbox, parallel_bbox)
+        self.assertSameImage(self.path('serial.png'), self.path('parallel.png'))
+        self.assertSameImage(self.path('serial_hi.png'), self.path('parallel_hi.png'))
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestLayout(RenderTestCase):
+    def testLayoutMatchesRender(self):
+        page = Page(0, 1024, 576)
+        layout = page.layout(sample_texts())
+        bbox = page.generateTextImage(sample_texts(), self.path('texts.png'))
+
+        self.assertEqual(bbox_values(bbox), bbox_values(layout.bbox))
+        self.assertEqual(5, len(layout.texts))
+        for text_layout in layout.texts:
+            self.assertEqual(len(text_layout.lines), len(text_layout.origins))
+            self.assertEqual(len(text_layout.lines), len(text_layout.widths))
+
+        layout_bbox = page.generateTextImage(layout, self.path('layout.png'))
+        self.assertEqual(bbox_values(bbox), bbox_values(layout_bbox))
+        self.assertSameImage(self.path('texts.png'), self.path('layout.png'))
+
+    def testKeywordBoxesAreNotDuplicated(self):
+        text = "The quick brown fox"
+        texts = [Text(i, text, ['fox'], Type.east, xloc=XLocation.left, yloc=YLocation.top) for i in range(3)]
+        layout = Page(0, 1024, 576).layout(texts)
+
+        self.assertEqual(3, len(layout.bbox['fox']))
+        self.assertEqual([1, 1, 1], [len(t.keyword_boxes['fox']) for t in layout.texts])
+
+
+class TestFingerprint(TestCase):
+    def testEqualForSameContent(self):
+        first = Text(0, "text", ['te'], points=[[1, 2], [3, 4]], bgcolor="#cccccc")
+        second = Text(0, "text", ['te'], points=[(1, 2), (3, 4)], bgcolor=(204, 204, 204))
+        self.assertEqual(first.fingerprint, second.fingerprint)
+        self.assertEqual(hash(first.fingerprint), hash(second.fingerprint))
+
+    def testDiffersForChangedContent(self):
+        first = Text(0, "text", [])
+        self.assertNotEqual(first.fingerprint, Text(0, "text 2", []).fingerprint)
+        self.assertNotEqual(first.fingerprint, Text(0, "text", [], fgcolor=(0, 0, 0)).fingerprint)
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestRenderSession(RenderTestCase):
+    def testRedrawsOnlyChangedGroups(self):
+        page = Page(0, 1024, 576)
+        session = RenderSession(page)
+
+        session.generateTextImage(sample_texts(), self.path('first.png'))
+        self.assertEqual(4, session.redrawn)
+
+        texts = sample_texts()
+        texts[3] = Text(3, "Changed text", ['text'], Type.west, Style.h1, XLocation.right, YLocation.bottom)
+        bbox = session.generateTextImage(texts, self.path('session.png'))
+        self.assertEqual(1, session.redrawn)
+
+        expected = page.generateTextImage(texts, self.path('page.png'))
+        self.assertEqual(bbox_values(expected), bbox_values(bbox))
+        self.assertSameImage(self.path('page.png'), self.path('session.png'))
+
+    def testRedrawsAfterStyleChange(self):
+        page = Page(0, 1024, 576)
+        session = RenderSession(page)
+        session.render(sample_texts())
+
+        page.set_font_style(Style.normal, 30, 34)
+        session.render(sample_texts())
+        self.assertEqual(4, session.redrawn)
+
+
+class TestMergeBoxes(TestCase):
+    def testMergesOverlapping(self):
+        boxes = merge_boxes([(0, 0, 10, 10), (20, 20, 30, 30), (5, 5, 25, 25), None])
+        self.assertEqual([(0, 0, 30, 30)], boxes)
+
+    def testKeepsSeparate(self):
+        boxes = merge_boxes([(0, 0, 10, 10), (10, 0, 20, 10)])
+        self.assertEqual([(0, 0, 10, 10), (10, 0, 20, 10)], boxes)
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestPatches(RenderTestCase):
+    def testPatchesUpdatePreviousFrame(self):
+        page = Page(0, 1024, 576)
+        session = RenderSession(page)
+
+        patches, _ = session.render_patches(sample_texts())
+        self.assertEqual([(0, 0, 1024, 576)], [p.box for p in patches])
+        frame = apply_patches(Image.new("RGBA", page.size), patches)
+
+        texts = sample_texts()
+        texts[1] = Text(1, "Changed text", ['text'], Type.east, Style.normal, XLocation.left, YLocation.top,
+                        bgcolor=(0, 0, 0))
+        patches, bbox = session.render_patches(texts)
+        self.assertEqual(1, len(patches))
+        self.assertLess(patches[0].image.size[0] * patches[0].image.size[1], 1024 * 576 / 4)
+
+        apply_patches(frame, patches).save(self.path('patched.png'))
+        expected = page.generateTextImage(texts, self.path('page.png'))
+        self.assertEqual(bbox_values(expected), bbox_values(bbox))
+        self.assertSameImage(self.path('page.png'), self.path('patched.png'))
+
+    def testNoPatchesForSameTexts(self):
+        session = RenderSession(Page(0, 1024, 576))
+        session.render_patches(sample_texts())
+        patches, _ = session.render_patches(sample_texts())
+        self.assertEqual([], patches)
+
+
+def cue_text(index, value, type=Type.east):
+    return Text(index, value, [], type, xloc=XLocation.center, yloc=YLocation.bottom, bgcolor=(0, 0, 0))
+
+
+class TestCueStates(TestCase):
+    def testOverlappingCues(self):
+        first = Cue(0, 10, [cue_text(0, "first")])
+        second = Cue(5, 15, [cue_text(1, "second", Type.west)])
+        states = cue_states([first, second])
+
+        self.assertEqual([(0, 5), (5, 10), (10, 15)], [(s[0], s[1]) for s in states])
+        self.assertEqual([["first"], ["first", "second"], ["second"]],
+                         [[t.value for t in s[3]] for s in states])
+
+    def testJoinsAdjacentSameContent(self):
+        states = cue_states([Cue(0, 5, [cue_text(0, "same")]), Cue(5, 10, [cue_text(0, "same")]),
+                             Cue(12, 20, [cue_text(0, "same")])])
+        self.assertEqual([(0, 10), (12, 20)], [(s[0], s[1]) for s in states])
+        self.assertEqual(states[0][2], states[1][2])
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestSequenceRenderer(TestCase):
+    def testRepeatingStatesRenderedOnce(self):
+        cues = [Cue(0, 10, [cue_text(0, "first")]),
+                Cue(5, 15, [cue_text(1, "second", Type.west)]),
+                Cue(20, 30, [cue_text(0, "first")])]
+        renderer = SequenceRenderer(Page(0, 1024, 576))
+        frames = list(renderer.render(cues))
+
+        self.assertEqual([[(0, 5), (20, 30)], [(5, 10)], [(10, 15)]], [f.ranges for f in frames])
+        self.assertEqual(0, renderer.session.redrawn)
+        self.assertEqual([0, 5, 10, 20], [start for start, _, _ in renderer.timeline(cues)])
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestGlyphAtlas(TestCase):
+    line = "The quick brown fox jumps over the lazy dog, AVAWAY 1234"
+
+    def draw(self, xy, atlas=None):
+        font = ImageFont.truetype(StyleInfo(20, 25).font_face, 20)
+        image = Image.new("RGBA", (700, 60), (0, 0, 0, 0))
+        ImageDraw2(image, "RGBA", text_cache=atlas).draw_line(xy, self.line, (255, 0, 0), font)
+        return image
+
+    def testSameAsFreeTypeAtPixelPositions(self):
+        atlas = GlyphAtlas()
+        self.assertIsNone(ImageChops.difference(self.draw((10, 10)), self.draw((10, 10), atlas)).getbbox())
+
+    def testCloseToFreeTypeAtSubpixelPositions(self):
+        atlas = GlyphAtlas()
+        for xy in [(10.3, 20.6), (5.1, 3.9), (7.13, 4.88)]:
+            diff = ImageChops.difference(self.draw(xy), self.draw(xy, atlas))
+            self.assertLess(ImageStat.Stat(diff).mean[3], 8)
+
+    def testSameAsFreeTypeAtSubpixelLinePositions(self):
+        atlas = GlyphAtlas()
+        for y in (20.6, 20.55, 3.25):
+            self.assertIsNone(ImageChops.difference(self.draw((10, y)), self.draw((10, y), atlas)).getbbox())
+
+    def testMemoryBudget(self):
+        atlas = GlyphAtlas(max_bytes=2000)
+        self.draw((10, 10), atlas)
+        self.assertLessEqual(atlas.bytes, 2000)
+        self.assertGreater(len(atlas), 1)
+
+    def testKerningTableInBudget(self):
+        atlas = GlyphAtlas(max_bytes=20000)
+        font = ImageFont.truetype(StyleInfo(20, 25).font_face, 20)
+        for left in "AVWYTLkorf":
+            for right in "AVWYTLkorf.,":
+                kerning = font.getlength(left + right) - font.getlength(left) - font.getlength(right)
+                self.assertEqual(kerning, atlas.kerning(font, left, right))
+        self.assertLessEqual(atlas.bytes, 20000)
+
+    def testCachedGlyphsReused(self):
+        atlas = GlyphAtlas()
+        self.draw((10, 10), atlas)
+        misses = atlas.misses
+        self.draw((10, 30), atlas)
+        self.assertEqual(misses, atlas.misses)
+        self.assertGreater(atlas.hit_rate, 0.5)
+
+    def testPageWithAtlas(self):
+        page = Page(0, 1024, 576)
+        expected = page.render(sample_texts())
+        page.set_text_cache(GlyphAtlas())
+        result = page.render(sample_texts())
+
+        self.assertEqual(bbox_values(expected.bbox), bbox_values(result.bbox))
+        diff = ImageChops.difference(expected.image, result.image)
+        self.assertLess(max(ImageStat.Stat(diff).mean), 1)
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestSpriteCache(TestCase):
+    def testSameAsFreeType(self):
+        page = Page(0, 1024, 576)
+        expected = page.render(sample_texts())
+        page.set_text_cache(SpriteCache())
+        result = page.render(sample_texts())
+
+        self.assertIsNone(ImageChops.difference(expected.image, result.image).getbbox())
+
+    def testSharedBetweenPages(self):
+        cache = SpriteCache()
+        misses = []
+        for idx in range(3):
+            page = Page(idx, 1024, 576)
+            page.set_text_cache(cache)
+            page.render(sample_texts())
+            misses.append(cache.misses)
+
+        self.assertEqual([misses[0]] * 3, misses)
+        self.assertGreater(cache.hit_rate, 0.6)
+        self.assertEqual(cache.misses, cache.stats()["entries"])
+
+    def testEvictsByBytes(self):
+        cache = SpriteCache(max_bytes=5000)
+        page = Page(0, 1024, 576)
+        page.set_text_cache(cache)
+        page.render(sample_texts())
+
+        self.assertLessEqual(cache.bytes, 5000)
+        self.assertGreater(cache.evictions, 0)
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestOutputCache(RenderTestCase):
+    def testHitMaterializesOutput(self):
+        cache = OutputCache(self.path('cache'))
+        page = Page(0, 1024, 576)
+        expected = page.generateTextImage(sample_texts(), self.path('expected.png'))
+
+        page.set_output_cache(cache)
+        page.generateTextImage(sample_texts(), self.path('first.png'))
+        bbox = page.generateTextImage(sample_texts(), self.path('second.png'))
+
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(bbox_values(expected), bbox_values(bbox))
+        self.assertEqual(expected['fox'][0].outline, bbox['fox'][0].outline)
+        self.assertSameImage(self.path('expected.png'), self.path('second.png'))
+        self.assertSameImage(self.path('expected_hi.png'), self.path('second_hi.png'))
+
+    def testKeyChangesWithContent(self):
+        cache = OutputCache(self.path('cache'))
+        page = Page(0, 1024, 576)
+        key = cache.key(page, sample_texts())
+
+        self.assertEqual(key, cache.key(page, list(reversed(sample_texts()))))
+        self.assertNotEqual(key, cache.key(page, sample_texts()[1:]))
+        page.set_font_style(Style.h1, 30, 32)
+        self.assertNotEqual(key, cache.key(page, sample_texts()))
+
+    def testKeyOfTextCacheAndMetrics(self):
+        cache = OutputCache(self.path('cache'))
+        page = Page(0, 1024, 576)
+        key = cache.key(page, sample_texts())
+
+        page.set_text_cache(SpriteCache())
+        self.assertEqual(key, cache.key(page, sample_texts()))
+        page.set_text_cache(GlyphAtlas())
+        self.assertNotEqual(key, cache.key(page, sample_texts()))
+        page.set_text_cache(None)
+
+        with SharedFontMetrics.publish(page_fonts(page)) as metrics:
+            page.set_font_metrics(metrics)
+            self.assertNotEqual(key, cache.key(page, sample_texts()))
+
+    def testLinkedOutputOverwrittenWithoutCache(self):
+        for link in (False, True):
+            cache = OutputCache(self.path('cache-{}'.format(link)), link=link)
+            expected = Page(0, 1024, 576).generateTextImage(sample_texts(), self.path('expected.png'))
+            page = Page(0, 1024, 576)
+            page.set_output_cache(cache)
+            page.generateTextImage(sample_texts(), self.path('out.png'))
+            page.generateTextImage(sample_texts(), self.path('out.png'))
+            self.assertEqual(1, cache.hits)
+
+            # rendered with a budget, which isn't cached, to the same file
+            page.generateTextImage(sample_texts()[1:], self.path('out.png'), budget=10.)
+
+            fresh = Page(0, 1024, 576)
+            fresh.set_output_cache(cache)
+            bbox = fresh.generateTextImage(sample_texts(), self.path('fresh.png'))
+            self.assertEqual(2, cache.hits)
+            self.assertEqual(bbox_values(expected), bbox_values(bbox))
+            self.assertSameImage(self.path('expected.png'), self.path('fresh.png'))
+            self.assertSameImage(self.path('expected_hi.png'), self.path('fresh_hi.png'))
+
+    def testEvictsLeastRecentlyUsed(self):
+        cache = OutputCache(self.path('cache'), max_bytes=1)
+        page = Page(0, 1024, 576)
+        page.set_output_cache(cache)
+        page.generateTextImage(sample_texts(), self.path('first.png'))
+        page.generateTextImage(sample_texts()[1:], self.path('second.png'))
+
+        self.assertEqual(2, cache.evictions)
+        self.assertEqual(0, len(cache))
+        self.assertTrue(os.path.exists(self.path('second.png')))
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestPersistentLayoutCache(RenderTestCase):
+    def testWarmRenderSkipsLayout(self):
+        expected = Page(0, 1024, 576).render(sample_texts())
+
+        cold = PersistentLayoutCache(self.path('layouts.db'))
+        page = Page(0, 1024, 576)
+        page.set_layout_cache(cold)
+        page.render(sample_texts())
+        self.assertEqual(len(cold), cold.misses)
+        lookups = cold.hits + cold.misses
+        cold.close()
+
+        warm = PersistentLayoutCache(self.path('layouts.db'))
+        page = Page(0, 1024, 576)
+        page.set_layout_cache(warm)
+        result = page.render(sample_texts())
+
+        self.assertEqual(0, warm.misses)
+        self.assertEqual(lookups, warm.hits)
+        self.assertEqual(bbox_values(expected.bbox), bbox_values(result.bbox))
+        self.assertIsNone(ImageChops.difference(expected.image, result.image).getbbox())
+        warm.close()
+
+    def testExpiredAndEvicted(self):
+        cache = PersistentLayoutCache(self.path('layouts.db'), max_entries=2, ttl=60)
+        for i in range(4):
+            cache.put(str(i), [i])
+        cache.evict()
+        self.assertEqual(2, len(cache))
+
+        cache = PersistentLayoutCache(self.path('layouts.db'), ttl=-1)
+        self.assertIsNone(cache.get("3"))
+        cache.evict()
+        self.assertEqual(0, len(cache))
+
+    def testKeyOfMeasure(self):
+        cache = PersistentLayoutCache(self.path('layouts.db'))
+        face = StyleInfo(20, 25).font_face
+        key = cache.key("split", "text", face, 20)
+        self.assertEqual(key, cache.key("split", "text", face, 20, measure="freetype"))
+        self.assertNotEqual(key, cache.key("split", "text", face, 20, measure="metrics"))
+        cache.close()
+
+    def testCloseAllThreads(self):
+        cache = PersistentLayoutCache(self.path('layouts.db'))
+        thread = threading.Thread(target=cache.put, args=("key", [1]))
+        thread.start()
+        thread.join()
+        self.assertEqual([1], cache.get("key"))
+        self.assertTrue(os.path.exists(self.path('layouts.db-wal')))
+
+        # the write-ahead log is removed when the last connection is closed
+        cache.close()
+        self.assertFalse(os.path.exists(self.path('layouts.db-wal')))
+
+
+def measure_shared(descriptor, font_face, font_size, texts):
+    metrics = SharedFontMetrics.attach(descriptor)
+    try:
+        return [metrics.table(font_face, font_size).size(t) for t in texts]
+    finally:
+        metrics.close()
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestSharedFontMetrics(TestCase):
+    def setUp(self):
+        self.face = StyleInfo(20, 25).font_face
+        self.metrics = SharedFontMetrics.publish([(self.face, 20), (self.face, 26)])
+
+    def tearDown(self):
+        self.metrics.close()
+
+    def testSameSizesAsFreeType(self):
+        font = ImageFont.truetype(self.face, 20)
+        measured = self.metrics.measured(self.face, font)
+        for text in ["The quick brown fox", "AVAWAY", "j", "Tokyo, 1999!", ""]:
+            self.assertEqual(font.getsize(text), measured.getsize(text))
+            self.assertAlmostEqual(font.getlength(text), measured.getlength(text), places=3)
+
+        self.assertEqual(font.getsize("\u00fcber"), measured.getsize("\u00fcber"))
+        other = ImageFont.truetype(self.face, 30)
+        self.assertIs(other, self.metrics.measured(self.face, other))
+
+    def testSameSizesOfKernedTexts(self):
+        words = ["The", "quick", "brown", "fox", "AVAWAY", "Tokyo,", "1999!", "jumps", "lazy", "Type", "WAVE",
+                 "rf.", "LT'", "y."]
+        choice = random.Random(1).choice
+        texts = [" ".join(choice(words) for _ in range(i % 5 + 1)) for i in range(500)]
+        for size in (20, 26):
+            font = ImageFont.truetype(self.face, size)
+            measured = self.metrics.measured(self.face, font)
+            self.assertEqual([font.getsize(t) for t in texts], [measured.getsize(t) for t in texts])
+
+    def testWorkersReadPublishedTables(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        texts = ["The quick brown fox", "jumps over the lazy dog"]
+        font = ImageFont.truetype(self.face, 26)
+        with ProcessPoolExecutor(2) as executor:
+            sizes = executor.submit(measure_shared, self.metrics.descriptor, self.face, 26, texts).result()
+
+        self.assertEqual([font.getsize(t) for t in texts], sizes)
+
+    def testPageWithMetrics(self):
+        page = Page(0, 1024, 576)
+        expected = page.render(sample_texts())
+        with SharedFontMetrics.publish(page_fonts(page)) as metrics:
+            page.set_font_metrics(metrics)
+            result = page.render(sample_texts())
+
+        self.assertEqual(bbox_values(expected.bbox), bbox_values(result.bbox))
+        self.assertIsNone(ImageChops.difference(expected.image, result.image).getbbox())
+
+
+@skipUnless(numpy is not None and font_available(), "numpy or page font is not installed")
+class TestArrays(TestCase):
+    def testArraysShareMemoryWithImages(self):
+        result = Page(0, 1024, 576).render(sample_texts())
+
+        self.assertEqual((576, 1024, 4), result.array.shape)
+        self.assertTrue((numpy.asarray(result.image) == result.array).all())
+        self.assertTrue((numpy.asarray(result.highlighted) == result.highlighted_array).all())
+        result.array[0, 0] = (1, 2, 3, 4)
+        self.assertEqual((1, 2, 3, 4), result.image.getpixel((0, 0)))
+
+    def testRenderIntoPreallocatedArray(self):
+        page = Page(0, 1024, 576)
+        expected = page.render(sample_texts())
+        out = numpy.full((576, 1024, 4), 7, numpy.uint8)
+        result = page.render(sample_texts(), out=out)
+
+        self.assertIs(out, result.array)
+        self.assertTrue((expected.array == out).all())
+        self.assertRaises(ValueError, page.render, sample_texts(), numpy.zeros((576, 1024, 4), numpy.float32))
+        self.assertRaises(ValueError, page.render, sample_texts(), numpy.zeros((100, 100, 4), numpy.uint8))
+
+    def testKeywordMasks(self):
+        result = Page(0, 1024, 576).render(sample_texts())
+        masks = result.keyword_masks()
+
+        self.assertEqual(set(result.bbox.keys()), set(masks.keys()))
+        x0, y0, x1, y1 = [int(v) for v in result.bbox['lazy'][0].box]
+        self.assertTrue(masks['lazy'][y0 + 1, x0 + 1])
+        self.assertFalse(masks['lazy'][0, 0])
+        self.assertFalse(result.keyword_masks(['missing'])['missing'].any())
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestBaseImage(RenderTestCase):
+    @staticmethod
+    def base():
+        return Image.linear_gradient("L").resize((1024, 576)).convert("RGBA")
+
+    def testBlendsLayersOntoBase(self):
+        page = Page(0, 1024, 576)
+        expected = self.base()
+        for layer in page.render(sample_texts()).images:
+            expected = Image.alpha_composite(expected, layer)
+
+        base = self.base()
+        result = page.render(sample_texts(), base=base)
+
+        self.assertIs(base, result.image)
+        self.assertIsNone(ImageChops.difference(expected, result.image).getbbox())
+
+    def testDecodesFileToPageSize(self):
+        Image.linear_gradient("L").resize((2048, 1152)).convert("RGB").save(self.path('base.jpg'))
+        page = Page(0, 1024, 576)
+        page.generateTextImage(sample_texts(), self.path('page.png'), base=self.path('base.jpg'))
+
+        with Image.open(self.path('page.png')) as image:
+            self.assertEqual((1024, 576), image.size)
+            self.assertEqual(255, image.getpixel((0, 0))[3])
+        self.assertTrue(os.path.exists(self.path('page_hi.png')))
+
+    @skipUnless(numpy is not None, "numpy is not installed")
+    def testDrawsOnArrayInPlace(self):
+        page = Page(0, 1024, 576)
+        expected = page.render(sample_texts(), base=self.base())
+        base = numpy.array(self.base())
+        result = page.render(sample_texts(), base=base)
+
+        self.assertTrue((numpy.asarray(expected.image) == base).all())
+        self.assertTrue((result.array == base).all())
+
+    @skipUnless(numpy is not None, "numpy is not installed")
+    def testReadOnlyArrayCopied(self):
+        page = Page(0, 1024, 576)
+        expected = page.render(sample_texts(), base=self.base())
+        base = numpy.asarray(self.base())
+        result = page.render(sample_texts(), base=base)
+
+        self.assertFalse(base.flags.writeable)
+        self.assertTrue((numpy.asarray(self.base()) == base).all())
+        self.assertIsNone(ImageChops.difference(expected.image, result.image).getbbox())
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestOverlayPipeline(RenderTestCase):
+    def bases(self, count):
+        for i in range(count):
+            filename = self.path('%d.png' % i)
+            Image.new("RGB", (1024, 576), (i * 40, 0, 0)).save(filename)
+            yield filename
+
+    def testSameAsRenderingOnEveryBase(self):
+        page = Page(0, 1024, 576)
+        draws = []
+        draw_groups = page.draw_groups
+        page.draw_groups = lambda groups: draws.append(groups) or draw_groups(groups)
+
+        results = list(OverlayPipeline(page, sample_texts(), prefetch=2).run(self.bases(4)))
+
+        self.assertEqual(1, len(draws))
+        self.assertEqual(4, len(results))
+        for filename, (image, bbox) in zip(self.bases(4), results):
+            expected = page.render(sample_texts(), base=filename)
+            self.assertEqual(bbox_values(expected.bbox), bbox_values(bbox))
+            self.assertIsNone(ImageChops.difference(expected.image, image).getbbox())
+
+    def testBoundedPrefetch(self):
+        consumed = []
+
+        def bases():
+            for i in range(100):
+                consumed.append(i)
+                yield Image.new("RGBA", (1024, 576))
+
+        pipeline = OverlayPipeline(Page(0, 1024, 576), sample_texts(), prefetch=3)
+        results = pipeline.results(bases())
+        for _ in range(5):
+            next(results)
+            self.assertLessEqual(len(consumed), pipeline.count + 3)
+        results.close()
+        self.assertEqual(5, pipeline.count)
+
+    def testTextsPerImage(self):
+        texts = sample_texts()
+        pipeline = OverlayPipeline(Page(0, 1024, 576), lambda index, image: texts[:index + 1])
+        results = list(pipeline.results(self.bases(3)))
+
+        self.assertEqual([{'brown'}, {'brown', 'fox'}, {'brown', 'fox'}], [set(r.bbox) for r in results])
+        self.assertEqual(2, len(results[2].bbox['fox']))
+        self.assertIsNone(results[2].highlighted)
+
+
+@skipUnless(numpy is not None and font_available(), "numpy or page font is not installed")
+class TestBatchSink(RenderTestCase):
+    def testWorkersWriteDisjointSlices(self):
+        pages = [sample_texts()[:i + 1] for i in range(5)]
+        filename = self.path('batch.npy')
+        model = CostModel()
+        boxes = render_batch(filename, functools.partial(Page, 0, 1024, 576), pages, workers=2, chunk=2,
+                             cost_model=model)
+
+        images = numpy.load(filename, mmap_mode="r")
+        self.assertEqual((5, 576, 1024, 4), images.shape)
+        expected_boxes = []
+        for index, texts in enumerate(pages):
+            expected = Page(0, 1024, 576).render(texts)
+            self.assertTrue((expected.array == images[index]).all())
+            for kw, kw_boxes in expected.bbox.items():
+                expected_boxes.extend((index, kw, tuple(numpy.float32(b.box))) for b in kw_boxes)
+
+        loaded = load_boxes(filename)
+        actual = [(int(p), str(loaded["keywords"][k]), (x0, y0, x1, y1))
+                  for p, k, x0, y0, x1, y1 in zip(*[loaded[c] for c in ("page", "keyword", "x0", "y0", "x1", "y1")])]
+        self.assertEqual(sorted(expected_boxes), sorted(actual))
+        self.assertEqual(sorted(loaded["page"]), list(loaded["page"]))
+        self.assertEqual(len(expected_boxes), len(boxes["page"]))
+        self.assertEqual([], [f for f in os.listdir(self.tmpdir) if f.endswith('.part.npz')])
+        self.assertEqual(list(range(5)), sorted(page for page, _, _, _ in model.observations))
+
+        with open(self.path('batch.cost.json')) as f:
+            report = json.load(f)
+        self.assertEqual(list(model.weights), report["weights"])
+        self.assertEqual(5, report["errors"]["count"])
+        self.assertEqual(list(range(5)), sorted(record["page"] for record in report["pages"]))
+
+
+@skipUnless(font_available(), "page font is not installed")
+class TestTextBoxes(TestCase):
+    def testLinesAndWordsOfEveryText(self):
+        layout = Page(0, 1024, 576).layout(sample_texts())
+        boxes = text_boxes(layout, page=3)
+
+        lines = list(boxes.rows(LINE))
+        words = list(boxes.rows(WORD))
+        self.assertEqual(sum(len(t.lines) for t in layout.texts), len(lines))
+        self.assertEqual(sum(len(line.split()) for t in layout.texts for line in t.lines), len(words))
+        self.assertEqual(len(lines) + len(words), len(boxes))
+        self.assertEqual({3}, set(boxes.page))
+        self.assertEqual(set(range(len(layout.groups))), set(boxes.group))
+        self.assertEqual(set(t.font_size for t in layout.texts), set(boxes.font_size))
+
+    def testWordsInsideTheirLine(self):
+        layout = Page(0, 1024, 576).layout(sample_texts()[:1])
+        boxes = text_boxes(layout)
+        line = next(boxes.rows(LINE))
+        words = [w for w in boxes.rows(WORD) if w["line"] == 0]
+
+        self.assertEqual(line["text"].split(), [w["text"] for w in words])
+        self.assertAlmostEqual(line["x0"], words[0]["x0"], places=3)
+        self.assertLessEqual(words[-1]["x1"], line["x1"] + 1)
+        for first, second in zip(words, words[1:]):
+            self.assertLess(first["x1"], second["x0"])
+        font = layout.texts[0].font
+        self.assertAlmostEqual(font.getlength("quick"), words[1]["x1"] - words[1]["x0"], places=3)
+
+
+@skipUnless(numpy is not None and font_available(), "numpy or page font is not installed")
+class TestDatasetGenerator(RenderTestCase):
+    def testSampledPagesAreReproducible(self):
+        distribution = LayoutDistribution()
+        first = [[t.fingerprint for t in texts] for texts in sample_pages(distribution, (1024, 576), 20, seed=3)]
+        again = [[t.fingerprint for t in texts] for texts in sample_pages(distribution, (1024, 576), 10, 3, 10)]
+
+        self.assertEqual(first[10:], again)
+        types = set(t[3] for texts in first for t in texts)
+        self.assertIn(Type.callout, types)
+        self.assertIn(Type.polygon, types)
+
+    def testSameDatasetForAnyNumberOfWorkers(self):
+        generator = DatasetGenerator(LayoutDistribution(texts=(1, 3)), seed=2)
+        stats = generator.generate(self.path('serial.npy'), 4, workers=1, chunk=2)
+        generator.generate(self.path('parallel.npy'), 4, workers=2, chunk=1)
+
+        self.assertEqual(4, stats["pages"])
+        self.assertGreater(stats["pages_per_sec"], 0)
+        self.assertTrue((numpy.load(self.path('serial.npy')) == numpy.load(self.path('parallel.npy'))).all())
+        serial = numpy.load(text_labels_filename(self.path('serial.npy')))
+        parallel = numpy.load(text_labels_filename(self.path('parallel.npy')))
+        self.assertEqual(list(serial["text"]), list(parallel["text"]))
+        self.assertEqual({0, 1, 2, 3}, set(serial["page"]))
+        self.assertEqual(len(load_boxes(self.path('serial.npy'))["page"]),
+                         len(load_boxes(self.path('parallel.npy'))["page"]))
+
+
+class TestBoxIndex(TestCase):
+    def setUp(self):
+        self.bbox = {
+            'a': [BoundingBox([10, 10, 50, 30], None), BoundingBox([300, 300, 340, 320], (255, 0, 0))],
+            'b': [BoundingBox([40, 20, 90, 40], None)],
+            'c': [BoundingBox([600, 100, 700, 130], None)],
+        }
+        self.index = BoxIndex(self.bbox, cell=32)
+
+    @staticmethod
+    def keys(found):
+        return [(kw, tuple(b.box)) for kw, b in found]
+
+    def testDictOfBoxes(self):
+        self.assertEqual(self.bbox, dict(self.index))
+        self.assertEqual(4, len(self.index.entries))
+
+    def testPointAndRectangle(self):
+        self.assertEqual([('a', (10, 10, 50, 30)), ('b', (40, 20, 90, 40))], self.keys(self.index.at(45, 25)))
+        self.assertEqual([('b', (40, 20, 90, 40))], self.keys(self.index.at(80, 35)))
+        self.assertEqual([], self.index.at(200, 200))
+        self.assertEqual(['a', 'c'], [kw for kw, _ in self.index.intersecting((320, 0, 650, 310))])
+
+    def testNearestSameAsScan(self):
+        entries = self.index.entries
+        for x in range(-100, 800, 37):
+            for y in range(-50, 400, 29):
+                expected = min(distance_to(b.box, x, y) for _, b in entries)
+                kw, b, d = self.index.nearest(x, y)
+                self.assertAlmostEqual(expected, d)
+                self.assertAlmostEqual(d, distance_to(b.box, x, y))
+
+        self.assertIsNone(self.index.nearest(400, 400, max_distance=10))
+        self.assertIsNone(BoxIndex({}).nearest(0, 0))
+
+    def testSerializedWithIndex(self):
+        restored = BoxIndex.from_json(self.index.to_json())
+
+        self.assertEqual(bbox_values(self.bbox), bbox_values(restored))
+        self.assertEqual((255, 0, 0), restored['a'][1].outline)
+        self.assertEqual(self.keys(self.index.at(45, 25)), self.keys(restored.at(45, 25)))
+        copied = pickle.loads(pickle.dumps(self.index))
+        self.assertEqual(self.keys(self.index.intersecting((0, 0, 1000, 1000))),
+                         self.keys(copied.intersecting((0, 0, 1000, 1000))))
+
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testRenderedPageIndexed(self):
+        bbox = Page(0, 1024, 576).render(sample_texts()).bbox
+        box = bbox['lazy'][0].box
+
+        self.assertIsInstance(bbox, BoxIndex)
+        self.assertIn('lazy', [kw for kw, _ in bbox.at((box[0] + box[2]) / 2, (box[1] + box[3]) / 2)])
+
+
+def distance_to(box, x, y):
+    return math.hypot(max(box[0] - x, 0, x - box[2]), max(box[1] - y, 0, y - box[3]))
+
+
+class TestTextBatch(TestCase):
+    def testTextsRestored(self):
+        batch = TextBatch.from_texts(sample_texts())
+
+        self.assertEqual(5, len(batch))
+        for expected, actual in zip(sample_texts(), batch):
+            self.assertEqual(expected.index, actual.index)
+            self.assertEqual(expected.keywords, actual.keywords)
+            self.assertEqual(expected.bgcolor, actual.bgcolor)
+            self.assertEqual(expected.points, actual.points)
+            self.assertEqual(get_color(expected.fgcolor), get_color(actual.fgcolor))
+            self.assertEqual(expected.fingerprint[3:8], actual.fingerprint[3:8])
+
+    def testColorsRestored(self):
+        texts = [Text(0, "a", [], bgcolor=(10, 20, 30), bgopacity=0),
+                 Text(1, "b", [], fgcolor="red", bgcolor="#00ff00", bocolor="navy", bgopacity=0.5),
+                 Text(2, "c", [], fgcolor=[1, 2, 3], bocolor=(4, 5, 6, 255)),
+                 Text(3, "d", [], fgcolor=(7, 8, 9, 128))]
+        batch = TextBatch.from_texts(texts)
+
+        self.assertEqual((10, 20, 30, 0), batch.text(0).bgcolor)
+        self.assertEqual(0, batch.text(0).bgopacity)
+        for expected, actual in zip(texts, batch):
+            self.assertEqual(expected.fingerprint, actual.fingerprint)
+            self.assertEqual(expected.bgcolor, actual.bgcolor)
+
+    def testGroupedLikeTexts(self):
+        texts = [Text(i * 7 % 11, str(i), [], [Type.east, Type.west, Type.default][i % 3],
+                      xloc=[XLocation.left, XLocation.right][i % 2]) for i in range(30)]
+        expected = [(str(key), [t.value for t in group]) for key, group in Page.group_texts(texts)]
+        actual = [(str(key), [t.value for t in group]) for key, group in Page.group_texts(TextBatch.from_texts(texts))]
+
+        self.assertEqual(expected, actual)
+        self.assertEqual([], TextBatch().groups())
+
+        batch = TextBatch.from_texts(texts)
+        positions = [(str(key), [t.value for t in batch.texts(group)]) for key, group in batch.position_groups()]
+        self.assertEqual(expected, positions)
+
+    def testSlots(self):
+        self.assertFalse(hasattr(sample_texts()[0], '__dict__'))
+        self.assertEqual(hash(TextGroup(Type.east, XLocation.left, YLocation.top)),
+                         hash(TextGroup(Type.east, XLocation.left, YLocation.top)))
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testPageRendersBatch(self):
+        page = Page(0, 1024, 576)
+        expected = page.render(sample_texts())
+        result = page.render(TextBatch.from_texts(sample_texts()))
+
+        self.assertEqual(bbox_values(expected.bbox), bbox_values(result.bbox))
+        self.assertIsNone(ImageChops.difference(expected.image, result.image).getbbox())
+
+        laid_out = page.render(page.layout(TextBatch.from_texts(sample_texts())))
+        self.assertIsNone(ImageChops.difference(expected.image, laid_out.image).getbbox())
+
+    def testBenchmark(self):
+        stats = benchmark_texts(1000)
+        self.assertLess(stats["TextBatch"]["bytes_per_million"], stats["Text"]["bytes_per_million"])
+
+
+class TestJobs(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def job(self, id, **kwargs):
+        job = {"id": id, "width": 640, "height": 360, "styles": {"h1": [30, 32]},
+               "texts": [{"value": "the quick brown fox", "keywords": ["fox"], "type": "east",
+                          "style": "h1", "xloc": "left", "yloc": "top", "fgcolor": [255, 255, 255],
+                          "bgcolor": "#000000"},
+                         {"value": "jumps over the lazy dog", "keywords": ["lazy"], "type": "polygon",
+                          "points": [[100, 100], [300, 100], [300, 300], [100, 300]], "bocolor": "red"}]}
+        job.update(kwargs)
+        return job
+
+    def testReadJobs(self):
+        lines = ['{"texts": []}', '', 'not json', '[1]', '{"id": "a", "texts": []}']
+        jobs = list(read_jobs(lines))
+
+        self.assertEqual([1, None, None, "a"], [job["id"] for job in jobs])
+        self.assertEqual([3, 4], [job["line"] for job in jobs[1:3]])
+        self.assertFalse(jobs[1]["ok"])
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testRendersJob(self):
+        output = os.path.join(self.dir, "page.png")
+        runner = JobRunner()
+        result = runner.render(self.job("a", output=output))
+
+        texts = [Text(0, "the quick brown fox", ["fox"], Type.east, Style.h1, XLocation.left, YLocation.top,
+                      fgcolor=(255, 255, 255), bgcolor="#000000"),
+                 Text(1, "jumps over the lazy dog", ["lazy"], Type.polygon,
+                      points=[(100, 100), (300, 100), (300, 300), (100, 300)], bocolor="red")]
+        page = Page(0, 640, 360)
+        page.set_font_style(Style.h1, 30, 32)
+        expected = page.render(texts)
+
+        self.assertTrue(result["ok"])
+        self.assertEqual(dict((kw, [list(b.box) for b in boxes]) for kw, boxes in expected.bbox.items()),
+                         result["bbox"])
+        self.assertEqual({"parse", "render", "save", "total"}, set(result["seconds"]))
+        self.assertIsNone(ImageChops.difference(expected.image, Image.open(output)).getbbox())
+        self.assertTrue(os.path.exists(os.path.join(self.dir, "page_hi.png")))
+
+        runner.render(self.job("b"))
+        self.assertIs(runner.page(self.job("c")), runner.page(self.job("d")))
+        self.assertEqual(2, runner.stats()["jobs"])
+        self.assertIsNot(runner.page(self.job("c")), runner.page(self.job("e", width=320)))
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testResultsInOrder(self):
+        jobs = [self.job(i) for i in range(5)]
+        jobs[2]["texts"][0]["type"] = "sideways"
+
+        for workers in (1, 2):
+            results = list(run_jobs(iter(jobs), workers, window=2))
+            self.assertEqual(list(range(5)), [r["id"] for r in results])
+            self.assertEqual([True, True, False, True, True], [r["ok"] for r in results])
+            self.assertIn("ValueError", results[2]["error"])
+
+
+class BlockingRunner(object):
+    """
+    Job runner waiting for the event before finishing jobs
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def render(self, job, encode=None):
+        self.event.wait(10)
+        return {"id": job.get("id"), "ok": True, "seconds": {"total": 0.}}
+
+    def stats(self):
+        return {}
+
+
+class TestRenderServer(TestCase):
+    job = {"id": "a", "texts": [{"value": "the quick brown fox", "keywords": ["fox"]}]}
+
+    def testHealthAndMetrics(self):
+        with RenderServer(workers=1) as server:
+            connection = connect(server.address)
+            self.assertEqual((200, {"status": "ok"}), request(connection, "GET", "/health"))
+            status, metrics = request(connection, "GET", "/metrics")
+            connection.close()
+
+        self.assertEqual(200, status)
+        self.assertEqual(2, metrics["requests"])
+        self.assertEqual({"count": 0}, metrics["latency"])
+
+    def testRefusesUntrustedRequests(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+
+        with RenderServer(workers=1) as server:
+            connection = connect(server.address)
+            connection.request("POST", "/render", json.dumps(self.job), {"Content-Type": "text/plain"})
+            response = connection.getresponse()
+            response.read()
+            self.assertEqual(415, response.status)
+
+            for field in ("output", "base"):
+                status, result = request(connection, "POST", "/render", dict(self.job, **{field: "/tmp/page.png"}))
+                self.assertEqual(400, status)
+                self.assertIn(field, result["error"])
+
+            server.root = root
+            status, result = request(connection, "POST", "/render", dict(self.job, output="../page.png"))
+            self.assertEqual(400, status)
+            self.assertIn("outside", result["error"])
+            connection.close()
+
+        self.assertEqual(0, server.metrics.jobs)
+
+    def testResolvePaths(self):
+        root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root)
+        os.symlink("/tmp", os.path.join(root, "link"))
+
+        self.assertIs(self.job, resolve_paths(self.job, None))
+        self.assertEqual(os.path.join(root, "out", "page.png"),
+                         resolve_paths(dict(self.job, output="out/page.png"), root)["output"])
+        self.assertRaises(ValueError, resolve_paths, dict(self.job, output="link/page.png"), root)
+        self.assertRaises(ValueError, resolve_paths, dict(self.job, base=os.path.join(root, "..", "a.png")), root)
+
+    def testQueueBounded(self):
+        runner = BlockingRunner()
+        with RenderServer(workers=1, queue=1, runner=runner) as server:
+            first = server.submit({"id": 1})
+            second = server.submit({"id": 2})
+            self.assertIsNone(server.submit({"id": 3}))
+
+            connection = connect(server.address)
+            status, result = request(connection, "POST", "/render", {"id": 4, "texts": []})
+            runner.event.set()
+            self.assertEqual([1, 2], [first.result()["id"], second.result()["id"]])
+            connection.close()
+
+        self.assertEqual(503, status)
+        self.assertFalse(result["ok"])
+        self.assertEqual(2, server.metrics.rejected)
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testRender(self):
+        expected = Page(0, 1024, 576).render([Text(0, "the quick brown fox", ["fox"])])
+        path = os.path.join(tempfile.mkdtemp(), "render.sock")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+
+        for address in (("127.0.0.1", 0), path):
+            with RenderServer(address, workers=2) as server:
+                connection = connect(server.address)
+                status, result = request(connection, "POST", "/render", self.job)
+                self.assertEqual(200, status)
+                self.assertEqual([list(expected.bbox["fox"][0].box)], result["bbox"]["fox"])
+
+                connection.request("POST", "/render?return=image", json.dumps(self.job),
+                                   {"Content-Type": "application/json"})
+                response = connection.getresponse()
+                image = Image.open(io.BytesIO(response.read()))
+                self.assertEqual("a", json.loads(response.getheader("X-Render-Result"))["id"])
+                self.assertIsNone(ImageChops.difference(expected.image, image).getbbox())
+                connection.close()
+            self.assertEqual(1, server.report()["runner"]["fonts"])
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testPipelining(self):
+        body = json.dumps(self.job).encode("utf-8")
+        message = (b"POST /render HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: " +
+                   str(len(body)).encode("ascii") + b"\r\n\r\n" + body)
+
+        with RenderServer(workers=2) as server:
+            sock = socket.create_connection(server.address)
+            sock.sendall(message * 3)
+            responses = []
+            reader = sock.makefile("rb")
+            for _ in range(3):
+                status = int(reader.readline().split()[1])
+                headers = dict(line.decode("ascii").strip().lower().split(": ", 1)
+                               for line in iter(reader.readline, b"\r\n"))
+                result = json.loads(reader.read(int(headers["content-length"])).decode("utf-8"))
+                responses.append((status, result["id"]))
+            reader.close()
+            sock.close()
+
+        self.assertEqual([(200, "a")] * 3, responses)
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testJobsStreamed(self):
+        lines = [json.dumps(dict(self.job, id=i)) for i in range(6)] + ["not json"]
+        with RenderServer(workers=2, queue=1) as server:
+            connection = connect(server.address)
+            connection.request("POST", "/jobs", "\n".join(lines), {"Content-Type": "application/x-ndjson"})
+            results = [json.loads(line) for line in connection.getresponse().read().decode("utf-8").splitlines()]
+            connection.close()
+
+            stats = load_test(server.address, [self.job], requests=8, concurrency=2)
+
+        self.assertEqual(list(range(6)) + [None], [r["id"] for r in results])
+        self.assertEqual([True] * 6 + [False], [r["ok"] for r in results])
+        self.assertEqual(0, server.metrics.rejected)
+        self.assertEqual((8, 0), (stats["requests"], stats["errors"]))
+        self.assertEqual(14, server.report()["jobs"])
+
+    def testLatencyStats(self):
+        stats = latency_stats([float(i) for i in range(100, 0, -1)])
+        self.assertEqual((100, 50., 90., 99., 100.), (stats["count"], stats["p50"], stats["p90"], stats["p99"],
+                                                     stats["max"]))
+
+
+class TestRenderScheduler(TestCase):
+    def setUp(self):
+        self.gate = threading.Event()
+        self.order = []
+
+    def block(self):
+        self.gate.wait(10)
+
+    def run_order(self, scheduler):
+        """
+        Holds the only worker while tasks are queued, returns a function
+        submitting a task appending its name to the order
+        """
+        started = threading.Event()
+        scheduler.submit(INTERACTIVE, lambda: (started.set(), self.block()))
+        started.wait(10)
+        return lambda cls, name, deadline=None: scheduler.submit_until(cls, deadline, self.order.append, name)
+
+    def testPriorityAndDeadlines(self):
+        with RenderScheduler(1, [PriorityClass(INTERACTIVE, 0), PriorityClass(BULK, 1)]) as scheduler:
+            submit = self.run_order(scheduler)
+            submit(BULK, "bulk 1")
+            submit(BULK, "bulk 2")
+            submit(INTERACTIVE, "late", 10.)
+            submit(INTERACTIVE, "no deadline")
+            submit(INTERACTIVE, "soon", 1.)
+            self.gate.set()
+
+        self.assertEqual(["soon", "late", "no deadline", "bulk 1", "bulk 2"], self.order)
+
+    def testConcurrencyCap(self):
+        running = []
+        peak = [0]
+        lock = threading.Lock()
+
+        def task():
+            with lock:
+                running.append(1)
+                peak[0] = max(peak[0], len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+
+        with RenderScheduler(3) as scheduler:
+            for future in [scheduler.submit(BULK, task) for _ in range(8)]:
+                future.result()
+
+        self.assertEqual(2, peak[0])
+        self.assertEqual(8, scheduler.report()[BULK]["completed"])
+
+    def testInteractiveNotBlockedByBulk(self):
+        with RenderScheduler(2) as scheduler:
+            bulk = [scheduler.submit(BULK, self.block) for _ in range(5)]
+            interactive = scheduler.submit(INTERACTIVE, lambda: "preview")
+            self.assertEqual("preview", interactive.result(5))
+            self.assertFalse(bulk[-1].done())
+            self.gate.set()
+
+    def testPreempt(self):
+        with RenderScheduler(1) as scheduler:
+            submit = self.run_order(scheduler)
+            bulk = [submit(BULK, i) for i in range(4)]
+            interactive = submit(INTERACTIVE, "preview")
+
+            preempted = scheduler.preempt(BULK)
+            self.assertEqual(4, len(preempted))
+            self.gate.set()
+            interactive.result(5)
+            self.assertTrue(all(future.cancelled() for future in bulk))
+            self.assertEqual(["preview"], self.order)
+
+            for future in [scheduler.resubmit(task) for task in preempted]:
+                future.result(5)
+
+        self.assertEqual(["preview", 0, 1, 2, 3], self.order)
+        self.assertEqual(4, scheduler.report()[BULK]["preempted"])
+
+    def testReport(self):
+        with RenderScheduler(2) as scheduler:
+            scheduler.submit_until(INTERACTIVE, 0., time.sleep, 0.01).result()
+            failed = scheduler.submit(BULK, math.sqrt, -1)
+            self.assertRaises(ValueError, failed.result)
+
+        report = scheduler.report()
+        self.assertEqual(1, report[INTERACTIVE]["missed_deadlines"])
+        self.assertEqual(1, report[INTERACTIVE]["latency"]["count"])
+        self.assertGreaterEqual(report[INTERACTIVE]["latency"]["p50"], 0.01)
+        self.assertEqual(1, report[BULK]["failed"])
+        self.assertRaises(RuntimeError, scheduler.submit, BULK, time.sleep, 0)
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testRender(self):
+        page = Page(0, 1024, 576)
+        with RenderScheduler(2) as scheduler:
+            result = scheduler.render(INTERACTIVE, page, sample_texts(), highlight=False).result()
+
+        self.assertEqual(bbox_values(page.render(sample_texts()).bbox), bbox_values(result.bbox))
+        self.assertIsNone(result.highlighted)
+
+
+class TestCostModel(TestCase):
+    def testFeatures(self):
+        texts = sample_texts()
+        chars, polygon_chars, groups, vertices, megapixels = page_features((1000, 500), texts)
+
+        self.assertEqual(sum(len(t.value) for t in texts), chars)
+        self.assertEqual(sum(len(t.value) for t in texts if t.points), polygon_chars)
+        self.assertEqual(len(Page.group_texts(texts)), groups)
+        self.assertEqual(sum(len(t.points) for t in texts if t.points), vertices)
+        self.assertEqual(0.5, megapixels)
+
+    def testFitAndErrors(self):
+        weights = (0.001, 0.002, 0.01, 0.0005, 0.004, 0.02)
+        truth = CostModel(weights)
+        model = CostModel()
+        for i in range(50):
+            features = (i * 7 % 40, i * 3 % 11, i % 5 + 1, i * 13 % 17, 0.5 + i % 3)
+            model.observe(features, truth.predict(features), i)
+
+        fitted = model.fit()
+        for expected, actual in zip(weights, fitted.weights):
+            self.assertAlmostEqual(expected, actual)
+        self.assertEqual(50, model.errors()["count"])
+        self.assertGreater(model.errors()["mean_absolute_error"], 0)
+
+        log = io.StringIO()
+        model.write_log(log)
+        records = [json.loads(line) for line in log.getvalue().splitlines()]
+        self.assertEqual(50, len(records))
+        self.assertEqual(set(FEATURES) | {"page", "predicted", "actual"}, set(records[1]))
+        self.assertEqual(10, model.errors(10)["count"])
+        self.assertEqual(list(range(40, 50)), [record["page"] for record in model.records(10)])
+
+        self.assertFalse(model.update(min_observations=51))
+        self.assertTrue(model.update(min_observations=50))
+        self.assertEqual(fitted.weights, model.weights)
+        self.assertEqual(50, len(model.observations))
+
+    def testBalance(self):
+        costs = [50., 1., 1., 1., 10., 10., 10., 10., 10.]
+        loads = [sum(costs[i] for i in queue) for queue in balance(costs, 2)]
+        self.assertEqual([51., 52.], sorted(loads))
+
+    def testStealing(self):
+        queues = StealingQueues([8., 4., 3., 2., 1.], 2)
+        first = [queues.take(0) for _ in range(2)]
+
+        # worker 0 ran out of its own tasks and steals the cheapest task of worker 1
+        self.assertEqual([0, 4], first)
+        self.assertEqual(3, queues.take(0))
+        self.assertEqual(1, queues.stolen)
+        self.assertEqual([1, 2], [queues.take(1), queues.take(0)])
+        self.assertEqual(2, queues.stolen)
+        self.assertIsNone(queues.take(1))
+        self.assertEqual(0, len(queues))
+
+
+class TestTimeBudget(RenderTestCase):
+    def testAtRisk(self):
+        self.assertFalse(TimeBudget(60).at_risk())
+        self.assertTrue(TimeBudget(60, predicted=61).at_risk())
+        self.assertTrue(TimeBudget(0).degrade(NO_HIGHLIGHT))
+
+        budget = TimeBudget(60, risk=0)
+        budget.degrade(NO_HIGHLIGHT)
+        budget.degrade(NO_HIGHLIGHT)
+        self.assertEqual([NO_HIGHLIGHT], budget.report()["degradations"])
+
+    def testSmoothSegments(self):
+        points = [(0, 0), (100, 0), (100, 100), (0, 100)]
+        self.assertEqual(4 * 11, len(smooth_points(points, 0.5, 0)))
+        self.assertEqual(4 * 5, len(smooth_points(points, 0.5, 0, segments=4)))
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testWithinBudget(self):
+        page = Page(0, 1024, 576)
+        expected = page.render(sample_texts())
+        bbox = page.generateTextImage(sample_texts(), self.path('budget.png'), budget=60.)
+
+        self.assertEqual([], page.degradations)
+        self.assertEqual(bbox_values(expected.bbox), bbox_values(bbox))
+        self.assertIsNone(ImageChops.difference(expected.image, Image.open(self.path('budget.png'))).getbbox())
+        self.assertTrue(os.path.exists(self.path('budget_hi.png')))
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testDegraded(self):
+        page = Page(0, 1024, 576)
+        bbox = page.generateTextImage(sample_texts(), self.path('budget.png'), budget=0.)
+
+        self.assertEqual([COARSE_BEZIER, NO_HIGHLIGHT, FAST_ENCODE], page.degradations)
+        self.assertEqual(bbox_values(page.render(sample_texts()).bbox), bbox_values(bbox))
+        self.assertFalse(os.path.exists(self.path('budget_hi.png')))
+
+        page.generateTextImage(sample_texts(), self.path('budget.png'))
+        self.assertEqual([], page.degradations)
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testDegradedRemovesHighlightOfEarlierRender(self):
+        page = Page(0, 1024, 576)
+        page.generateTextImage(sample_texts(), self.path('budget.png'))
+        self.assertTrue(os.path.exists(self.path('budget_hi.png')))
+
+        page.generateTextImage(sample_texts()[1:], self.path('budget.png'), budget=0.)
+        self.assertIn(NO_HIGHLIGHT, page.degradations)
+        self.assertFalse(os.path.exists(self.path('budget_hi.png')))
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testPolygonProbes(self):
+        page = Page(0, 1024, 576)
+        cache = PersistentLayoutCache(self.path('layouts.db'))
+        page.set_layout_cache(cache)
+        text = Text(0, "invoice total amount due balance " * 12, ["total"], Type.polygon, bgcolor="white",
+                    points=[(300, 200), (500, 200), (520, 300), (500, 400), (300, 400), (280, 300)])
+
+        result = page.render([text], budget=TimeBudget(0, max_probes=2))
+        self.assertEqual([POLYGON_PROBES, NO_HIGHLIGHT], result.degradations)
+        self.assertEqual(0, len(cache))
+
+        page.render([text])
+        self.assertEqual(1, len(cache))
+        cache.close()
+
+
+class SlowPage(object):
+    def __init__(self, delay):
+        self.delay = delay
+        self.rendered = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def render(self, texts):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+            self.rendered.append(texts)
+        return RenderResult(None, None, {'kw': texts})
+
+
+class TestAsyncRenderer(TestCase):
+    def testConcurrencyLimit(self):
+        page = SlowPage(0.02)
+
+        async def run():
+            renderer = AsyncRenderer(ThreadPoolExecutor(8), max_concurrency=2)
+            return await asyncio.gather(*[renderer.render(page, [i]) for i in range(6)])
+
+        results = asyncio.run(run())
+        self.assertEqual([{'kw': [i]} for i in range(6)], results)
+        self.assertEqual(2, page.max_running)
+
+    def testTimeoutAbandonsQueuedWork(self):
+        page = SlowPage(0.2)
+
+        async def run():
+            renderer = AsyncRenderer(ThreadPoolExecutor(1), max_concurrency=1)
+            first = asyncio.ensure_future(renderer.render(page, [0]))
+            with self.assertRaises(asyncio.TimeoutError):
+                await renderer.render(page, [1], timeout=0.05)
+            await first
+            await asyncio.sleep(0.3)
+            self.assertEqual(0, renderer.pending)
+
+        asyncio.run(run())
+        self.assertEqual([[0]], page.rendered)
+
+    def testTimedOutRendersKeepSlots(self):
+        page = SlowPage(0.3)
+
+        async def run():
+            renderer = AsyncRenderer(ThreadPoolExecutor(4), max_concurrency=1)
+            for i in range(4):
+                with self.assertRaises(asyncio.TimeoutError):
+                    await renderer.render(page, [i], timeout=0.05)
+            await asyncio.sleep(0.4)
+
+        asyncio.run(run())
+        self.assertEqual(1, page.max_running)
+        self.assertEqual([[0]], page.rendered)
+
+    @skipUnless(font_available(), "page font is not installed")
+    def testRenderSavesImage(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            imagefile = os.path.join(tmpdir, 'async.png')
+            bbox = asyncio.run(AsyncRenderer().render(Page(0, 1024, 576), sample_texts(), imagefile))
+            self.assertIn('fox', bbox)
+            self.assertTrue(os.path.exists(imagefile))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
 def __test():
     test_page = Page(0, 1024, 576)
     style = Style.normal
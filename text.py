@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
+from array import array
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import os
 from enum import Enum
@@ -9,6 +11,13 @@ import math
 import sys
 from bezier import smooth_points, convert_to_degree, get_angle
 import textwrap2
+from budget import COARSE_BEZIER, FAST_ENCODE, FAST_ENCODE_PARAMS, NO_HIGHLIGHT, POLYGON_PROBES, TimeBudget
+from spatial import BoxIndex
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class Type(Enum):
@@ -125,6 +134,10 @@ def get_polygon_width(points, y_top, y_bottom):
         next_x = next_point[0]
         next_y = next_point[1]
 
+        # horizontal edges don't bound the width
+        if cur_y == next_y:
+            continue
+
         if cur_y <= y_top <= next_y:
             x_start_top = (((next_x - cur_x) * (y_top - cur_y)) /
                            (next_y - cur_y)) + cur_x
@@ -152,6 +165,72 @@ def get_polygon_width(points, y_top, y_bottom):
     return PolygonText(xstart, y_top, text_width)
 
 
+def array_image(array):
+    """
+    RGBA image sharing memory with the array, drawing on the image changes the array
+
+    :param array: writable C-contiguous numpy.uint8 array of shape (height, width, 4)
+    :rtype: Image
+    """
+    if (array.dtype != numpy.uint8 or array.ndim != 3 or array.shape[2] != 4
+            or not array.flags.c_contiguous or not array.flags.writeable):
+        raise ValueError("array must be writable C-contiguous uint8[height, width, 4]")
+
+    image = Image.frombuffer("RGBA", (array.shape[1], array.shape[0]), array, "raw", "RGBA", 0, 1)
+    # images made by frombuffer are read only and copy the buffer on the first write
+    image.readonly = 0
+    return image
+
+
+def new_canvas(size, out=None):
+    """
+    Transparent RGBA image backed by a numpy array (out if it is given) when numpy is available
+
+    :type size: tuple(int, int)
+    :param out: array of shape (height, width, 4) to draw into, see array_image
+    :return: image and its array, None if numpy isn't available
+    :rtype: tuple(Image, numpy.ndarray)
+    """
+    if out is None:
+        if numpy is None:
+            return Image.new("RGBA", size, (0, 0, 0, 0)), None
+        out = numpy.zeros((size[1], size[0], 4), numpy.uint8)
+    else:
+        if out.shape[:2] != (size[1], size[0]):
+            raise ValueError(str.format("array shape {0} doesn't match image size {1}", out.shape, size))
+        out[...] = 0
+
+    return array_image(out), out
+
+
+def open_base(base, size):
+    """
+    Image texts are drawn on. RGBA images and writeable uint8 arrays of shape
+    (height, width, 4) of the page size are drawn on in place, other images and
+    read-only arrays are converted to a new RGBA image. Files are decoded at
+    reduced scale when the format allows it (draft).
+
+    :param base: image, numpy array or path of image file
+    :type size: tuple(int, int)
+    :rtype: Image
+    """
+    if isinstance(base, str):
+        base = Image.open(base)
+        base.draft("RGB", size)
+    elif numpy is not None and isinstance(base, numpy.ndarray):
+        if (base.ndim == 3 and base.shape[2] == 4 and base.dtype == numpy.uint8 and base.flags.c_contiguous and
+                base.flags.writeable):
+            base = array_image(base)
+        else:
+            base = Image.fromarray(base)
+
+    if base.mode != "RGBA":
+        base = base.convert("RGBA")
+    if base.size != size:
+        base = base.resize(size, Image.BILINEAR)
+    return base
+
+
 def get_color(color):
     if isinstance(color, str):
         return ImageColor.getcolor(color, "RGB")
@@ -160,6 +239,15 @@ def get_color(color):
     return color
 
 
+def freeze(value):
+    """
+    Converts lists (and nested lists) to tuples to make value hashable
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
 def full_group_by(l, key=lambda x: x):
     d = defaultdict(list)
     for item in l:
@@ -169,6 +257,8 @@ def full_group_by(l, key=lambda x: x):
 
 
 class TextGroup(object):
+    __slots__ = ("type", "xloc", "yloc")
+
     # noinspection PyShadowingBuiltins
     def __init__(self, type, xloc, yloc):
         self.type = type
@@ -179,7 +269,7 @@ class TextGroup(object):
         return str.format("{0}{1}{2}", self.type, self.xloc, self.yloc)
 
     def __hash__(self):
-        return hash(str(self))
+        return hash((self.type, self.xloc, self.yloc))
 
     def __eq__(self, other):
         return self.type == other.type and \
@@ -190,6 +280,9 @@ class TextGroup(object):
 class Text(object):
     """Text representation"""
 
+    __slots__ = ("__index", "__value", "__keywords", "__type", "__style", "__xloc", "__yloc",
+                 "__boWidth", "__boColor", "__fgcolor", "__points", "__bgcolor", "__bgOpacity")
+
     # noinspection PyShadowingBuiltins
     def __init__(self, index, value, keywords,
                  type=Type.default,
@@ -305,10 +398,257 @@ class Text(object):
     def points(self):
         return self.__points
 
+    @property
+    def fingerprint(self):
+        """
+        Content of the text item, equal for items that are drawn the same way
+
+        :rtype: tuple
+        """
+        return (self.__index, self.__value, freeze(self.__keywords), self.__type, self.__style,
+                self.__xloc, self.__yloc, self.__boWidth, freeze(self.__boColor), freeze(self.__fgcolor),
+                freeze(self.__bgcolor), freeze(self.__points))
+
     def __str__(self):
         return str.format('Type: {0}, xloc: {1}, yloc: {2}, value: {3}', self.type, self.xloc, self.yloc, self.value)
 
 
+TYPES = list(Type)
+STYLES = list(Style)
+XLOCATIONS = list(XLocation)
+YLOCATIONS = list(YLocation)
+
+# codes of type and location of text groups
+GROUP_CODES = dict(((t, x, y), (i * len(XLOCATIONS) + j) * len(YLOCATIONS) + k)
+                   for i, t in enumerate(TYPES) for j, x in enumerate(XLOCATIONS) for k, y in enumerate(YLOCATIONS))
+STYLE_CODES = dict((style, i) for i, style in enumerate(STYLES))
+
+
+def pack_color(color):
+    """
+    Color as integer 0xRRGGBBAA, -1 for None
+
+    :rtype: int
+    """
+    if color is None:
+        return -1
+    if isinstance(color, str):
+        color = ImageColor.getcolor(color, "RGBA")
+    color = tuple(color) + (255,) * (4 - len(color))
+    return (color[0] << 24) | (color[1] << 16) | (color[2] << 8) | color[3]
+
+
+def restores_color(color):
+    """
+    Whether unpack_color(pack_color(color)) gives color back: None, RGB and
+    translucent RGBA tuples
+
+    :rtype: bool
+    """
+    return color is None or (type(color) is tuple and (len(color) == 3 or (len(color) == 4 and color[3] != 255)))
+
+
+def unpack_color(value):
+    """
+    Color packed by pack_color, RGB tuple if it is opaque
+
+    :rtype: tuple
+    """
+    if value < 0:
+        return None
+    color = (value >> 24, (value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff)
+    return color[:3] if color[3] == 255 else color
+
+
+class TextBatch(object):
+    """
+    Text items stored in columns: arrays of indexes, enum codes, packed
+    colors and point coordinates with offsets of every item, lists of values
+    and keywords. Takes much less memory than Text objects, Page groups
+    batches by positions of items and makes Text objects one group at a
+    time, when the group is laid out.
+
+    Colors that packed integers don't restore as given (names, opaque RGBA
+    tuples) are kept aside, so items come back with the same fingerprint.
+    """
+
+    def __init__(self):
+        self.__index = array("q")
+        self.__values = []
+        self.__keywords = []
+        self.__keyword_offsets = array("q", [0])
+        self.__codes = array("b")
+        self.__styles = array("b")
+        self.__colors = array("q")
+        self.__original_colors = {}
+        self.__bowidths = array("d")
+        self.__bgopacities = array("d")
+        self.__has_points = array("b")
+        self.__coords = array("d")
+        self.__offsets = array("q", [0])
+
+    @classmethod
+    def from_texts(cls, texts):
+        """
+        :type texts: list[Text]
+        :rtype: TextBatch
+        """
+        batch = cls()
+        for t in texts:
+            bgcolor = t.bgcolor[:3] if t.bgcolor is not None else None
+            batch.append(t.index, t.value, t.keywords, t.type, t.style, t.xloc, t.yloc, t.points,
+                         t.fgcolor, bgcolor, t.bocolor, t.bowidth, t.bgopacity)
+        return batch
+
+    # noinspection PyShadowingBuiltins
+    def append(self, index, value, keywords,
+               type=Type.default,
+               style=Style.normal,
+               xloc=XLocation.center,
+               yloc=YLocation.center,
+               points=None,
+               fgcolor=None,
+               bgcolor=None,
+               bocolor=None,
+               bowidth=2,
+               bgopacity=0.3):
+        """
+        Adds text item, arguments are the same as of Text
+        """
+        assert 0 <= bgopacity <= 1
+
+        self.__index.append(index)
+        self.__values.append(value)
+        self.__keywords.extend(keywords)
+        self.__keyword_offsets.append(len(self.__keywords))
+        self.__codes.append(GROUP_CODES[(type, xloc, yloc)])
+        self.__styles.append(STYLE_CODES[style])
+        for color in (fgcolor or (255, 255, 255), get_color(bgcolor) if bgcolor else None, bocolor):
+            if not restores_color(color):
+                self.__original_colors[len(self.__colors)] = color
+            self.__colors.append(pack_color(color))
+        self.__bowidths.append(bowidth)
+        self.__bgopacities.append(bgopacity)
+        self.__has_points.append(points is not None)
+        for point in points or ():
+            self.__coords.extend(point[:2])
+        self.__offsets.append(len(self.__coords))
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __points(self, i):
+        if not self.__has_points[i]:
+            return None
+        coords = [int(c) if c.is_integer() else c for c in self.__coords[self.__offsets[i]:self.__offsets[i + 1]]]
+        return list(zip(coords[::2], coords[1::2]))
+
+    def __color(self, position, unpacked):
+        """
+        :param unpacked: packed colors to unpacked ones, filled by the call
+        """
+        color = self.__original_colors.get(position)
+        if color is not None:
+            return color
+        packed = self.__colors[position]
+        if packed not in unpacked:
+            unpacked[packed] = unpack_color(packed)
+        return unpacked[packed]
+
+    def text(self, i):
+        """
+        Text item at position i
+
+        :rtype: Text
+        """
+        return self.texts([i])[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.text(i)
+
+    def __group_key(self, code):
+        yloc = YLOCATIONS[code % len(YLOCATIONS)]
+        code //= len(YLOCATIONS)
+        return TextGroup(TYPES[code // len(XLOCATIONS)], XLOCATIONS[code % len(XLOCATIONS)], yloc)
+
+    def group_positions(self):
+        """
+        Positions of items grouped like Page.group_texts groups them: sorted by
+        index, groups in order of their first item
+
+        :return: group code and positions of items of every group
+        :rtype: list[tuple(int, list[int])]
+        """
+        if not len(self):
+            return []
+
+        if numpy is None:
+            groups = {}
+            for i in sorted(range(len(self)), key=self.__index.__getitem__):
+                groups.setdefault(self.__codes[i], []).append(i)
+            return list(groups.items())
+
+        order = numpy.argsort(numpy.frombuffer(self.__index, numpy.int64), kind="stable")
+        codes = numpy.frombuffer(self.__codes, numpy.int8)[order]
+        unique, first, inverse, counts = numpy.unique(codes, return_index=True, return_inverse=True,
+                                                      return_counts=True)
+        # groups ordered by their first item
+        rank = numpy.empty(len(unique), numpy.int64)
+        rank[numpy.argsort(first)] = numpy.arange(len(unique))
+        grouped = order[numpy.argsort(rank[inverse], kind="stable")]
+
+        result = []
+        start = 0
+        for u in numpy.argsort(first):
+            end = start + counts[u]
+            result.append((int(unique[u]), grouped[start:end].tolist()))
+            start = end
+        return result
+
+    def position_groups(self):
+        """
+        Groups of Page.group_texts with positions of their items, see TextBatch.texts
+
+        :rtype: list[tuple(TextGroup, list[int])]
+        """
+        return [(self.__group_key(code), positions) for code, positions in self.group_positions()]
+
+    def texts(self, positions):
+        """
+        Text items at positions, groups and colors shared by the items are decoded once
+
+        :rtype: list[Text]
+        """
+        groups = {}
+        unpacked = {}
+        texts = []
+        for i in positions:
+            code = self.__codes[i]
+            group = groups.get(code)
+            if group is None:
+                group = groups[code] = self.__group_key(code)
+
+            bowidth = self.__bowidths[i]
+            keywords = self.__keywords[self.__keyword_offsets[i]:self.__keyword_offsets[i + 1]]
+            texts.append(Text(self.__index[i], self.__values[i], keywords, group.type, STYLES[self.__styles[i]],
+                              group.xloc, group.yloc, self.__points(i),
+                              fgcolor=self.__color(3 * i, unpacked),
+                              bgcolor=self.__color(3 * i + 1, unpacked),
+                              bocolor=self.__color(3 * i + 2, unpacked),
+                              bowidth=int(bowidth) if bowidth.is_integer() else bowidth,
+                              bgopacity=self.__bgopacities[i]))
+        return texts
+
+    def groups(self):
+        """
+        Same as Page.group_texts for the items of the batch
+
+        :rtype: list[tuple(TextGroup, list[Text])]
+        """
+        return [(key, self.texts(positions)) for key, positions in self.position_groups()]
+
+
 class Page(object):
     """Page that splitted for two halves"""
 
@@ -318,12 +658,19 @@ class Page(object):
         self.__width = width
         self.__height = height
 
-        self.__texts = []
         self.__images = []
         self.__filename = ""
         self.__bbox = {}
         self.__callout_pointer_angle = 45
         self.__callout_smooth_factor = 0.5
+        self.__workers = 1
+        self.__text_cache = None
+        self.__output_cache = None
+        self.__layout_cache = None
+        self.__font_metrics = None
+        self.__fonts = None
+        self.__degradations = []
+        self.__text_helper = ImageDraw2(Image.new("RGBA", (1, 1)), mode="RGBA")
 
         self.__styles = {
             Style.normal: StyleInfo(20, 25),
@@ -339,84 +686,345 @@ class Page(object):
         """
         self.__callout_pointer_angle = angle
 
+    def set_parallel(self, workers):
+        """
+        Renders the groups of a page concurrently on a thread pool.
+        Layers are still composited in group order, so the result is the
+        same as serial rendering. 1 (default) disables the thread pool.
+
+        :type workers: int
+        """
+        assert workers >= 1
+        self.__workers = workers
+
     # noinspection PyPep8Naming
-    def generateTextImage(self, texts, imagefile):
+    def generateTextImage(self, texts, imagefile, base=None, budget=None):
         """
         Generates image for text items and saves to imagefile
 
-        :type texts: list[Text]
+        :param texts: text items or their layout made by Page.layout
+        :type texts: list[Text]|PageLayout
         :type imagefile: str
+        :param base: image to draw texts on instead of transparent canvas, see Page.render
+        :param budget: seconds or TimeBudget the page should be generated in,
+            stages degrade when it's at risk, applied degradations are listed in
+            Page.degradations. Output cache isn't used with budget
+        :type budget: float|TimeBudget
         :return:
         """
 
         self.__filename = imagefile
-        self.__texts = texts
-        self.__bbox.clear()
-        self.__images = []
+        self.__degradations = []
 
-        self.__draw_image()
+        if (self.__output_cache is not None and base is None and budget is None and
+                not isinstance(texts, PageLayout)):
+            self.__bbox = self.__output_cache.generate(self, texts, imagefile)
+            return self.__bbox
 
+        if budget is not None and not isinstance(budget, TimeBudget):
+            budget = TimeBudget(budget)
+
+        result = self.render(texts, base=base, budget=budget)
+        if budget is not None and budget.degrade(FAST_ENCODE):
+            result.save(imagefile, **FAST_ENCODE_PARAMS)
+        else:
+            result.save(imagefile)
+
+        self.__images = result.images
+        self.__bbox = result.bbox
+        if budget is not None:
+            self.__degradations = list(budget.applied)
         return self.__bbox
 
-    def __draw_image(self):
+    def layout(self, texts):
+        """
+        Calculates fonts, lines and their positions and keywords bounding boxes
+        of text items without drawing anything. The layout may be rendered
+        later by Page.render or Page.generateTextImage.
+
+        :type texts: list[Text]|TextBatch
+        :rtype: PageLayout
         """
-        Draws the images (with and without keywords highlighted)
+        cache = LayoutCache(self.__font_metrics, self.__fonts)
+        return PageLayout(self.__width, self.__height,
+                          self.__map_texts(lambda key, group: self.__layout_group(key, group, cache), texts))
+
+    def render(self, texts, out=None, base=None, highlight=True, budget=None):
+        """
+        Renders text items without saving them. Doesn't change the page state,
+        so it may be called concurrently for the same page.
+
+        :param texts: text items or their layout made by Page.layout
+        :type texts: list[Text]|PageLayout
+        :param out: preallocated numpy.uint8 array of shape (height, width, 4)
+            the image is rendered into, the result image shares memory with it
+        :param base: image, numpy array or path of image file texts are drawn on
+            instead of transparent canvas, only regions covered by groups are blended.
+            RGBA images and arrays are drawn on in place unless out is given, see open_base
+        :param highlight: makes the image with keywords bounding boxes
+        :param budget: time the page should be rendered in, stages degrade when
+            it's at risk, see TimeBudget. Degradations are listed in RenderResult.degradations
+        :type budget: TimeBudget
+        :rtype: RenderResult
         """
-        result = Image.new("RGBA", (self.__width, self.__height), (0, 0, 0, 0))
-        self.__text_helper = ImageDraw2(result, mode='RGBA')
-        result = Image.new("RGBA", (self.__width, self.__height), (0, 0, 0, 0))
+        if isinstance(texts, PageLayout):
+            assert texts.size == (self.__width, self.__height)
+            rendered = self.draw_groups(texts.groups)
+        else:
+            cache = LayoutCache(self.__font_metrics, self.__fonts, budget)
+            rendered = self.__map_texts(lambda key, group: self.__draw_group(self.__layout_group(key, group, cache)),
+                                        texts)
 
-        texts = list(sorted(self.__texts, key=lambda x: x.index))
+        if budget is None:
+            return self.compose(rendered, out, base, highlight)
 
-        for key, group in full_group_by(texts, lambda x: TextGroup(x.type, x.xloc, x.yloc)):
-            type_ = key.type
-            group = list(group)
+        result = self.compose(rendered, out, base, highlight and not budget.degrade(NO_HIGHLIGHT))
+        result.degradations = list(budget.applied)
+        return result
 
-            if type_ == Type.default:
-                self.__draw_bottom(group)
-            elif type_ == Type.polygon:
-                for p in group:
-                    self.__draw_polygon(p)
-            elif type_ == Type.callout:
-                for c in group:
-                    self.__draw_polygon(c)
-            else:
-                self.__draw_side_group(key, group)
+    def set_text_cache(self, cache):
+        """
+        Draws lines of text with cached rasterized pieces of text instead of
+        rendering them with FreeType on every draw, e.g. glyphcache.GlyphAtlas.
+        None (default) draws with FreeType. The cache must have render_key,
+        see Page.render_key.
+        """
+        self.__text_cache = cache
+
+    def set_output_cache(self, cache):
+        """
+        Takes images of texts rendered before from cache instead of rendering
+        them again, see outputcache.OutputCache. None (default) disables it.
+        """
+        self.__output_cache = cache
+
+    def set_layout_cache(self, cache):
+        """
+        Takes wrapped lines and polygon font sizes of texts laid out before
+        (also by other runs and processes) from cache instead of measuring them,
+        see layoutcache.PersistentLayoutCache. None (default) disables it.
+        """
+        self.__layout_cache = cache
 
-        self.__highimage = Image.new("RGBA", (self.__width, self.__height), (0, 0, 0, 0))
-        self.__high_draw = ImageDraw(self.__highimage, mode="RGBA")
-        self._draw_bbox()
+    def set_font_metrics(self, metrics):
+        """
+        Measures texts with glyph metrics tables instead of FreeType,
+        see metrics.SharedFontMetrics. None (default) measures with FreeType.
+        """
+        self.__font_metrics = metrics
 
-        images_count = len(self.__images)
-        if images_count > 0:
-            result = self.__images[0]
-            for i in range(1, images_count):
-                second = self.__images[i]
-                result = Image.alpha_composite(result, second)
+    def __measure(self):
+        """
+        How texts are measured, part of layout cache keys
 
-        result.save(self.__filename)
+        :rtype: str
+        """
+        return "metrics" if self.__font_metrics is not None else "freetype"
 
-        if len(self.__bbox):
-            highl_filename = os.path.splitext(self.__filename)[0] + "_hi.png"
-            result = Image.alpha_composite(result, self.__highimage)
-            result.save(highl_filename)
+    def set_font_cache(self, fonts):
+        """
+        Takes fonts loaded by earlier layout passes (also of other pages) from
+        fonts dict instead of loading them on every pass. The dict is keyed by
+        (font_face, font_size) and may be shared between pages and threads.
+        None (default) loads fonts once per pass.
 
-    def __draw_side_group(self, key, group):
+        :type fonts: dict
         """
-        Draws east and west sides of the page
+        self.__fonts = fonts
+
+    @property
+    def size(self):
+        return self.__width, self.__height
+
+    @property
+    def degradations(self):
         """
-        if len(group) == 0:
-            return
+        Degradations applied by the last generateTextImage to fit its budget
+
+        :rtype: list[str]
+        """
+        return list(self.__degradations)
+
+    @property
+    def settings_key(self):
+        """
+        Page settings that affect layout, equal for pages laying out texts the same way
+
+        :rtype: tuple
+        """
+        styles = tuple(sorted((style.value, info.font_face, info.font_size, info.line_height)
+                              for style, info in self.__styles.items()))
+        return (self.__width, self.__height, self.__callout_pointer_angle, self.__callout_smooth_factor,
+                styles)
+
+    @property
+    def render_key(self):
+        """
+        How texts are measured and drawn (see set_font_metrics and set_text_cache),
+        pages with equal settings_key and render_key render the same pixels
+
+        :rtype: tuple
+        """
+        cache = self.__text_cache
+        return self.__measure(), cache.render_key if cache is not None else None
+
+    @staticmethod
+    def group_texts(texts):
+        """
+        Sorts text items by index and groups them by type and location
+
+        :type texts: list[Text]|TextBatch
+        :rtype: list[tuple(TextGroup, list[Text])]
+        """
+        if isinstance(texts, TextBatch):
+            return texts.groups()
+
+        texts = list(sorted(texts, key=lambda x: x.index))
+        return [(key, list(group)) for key, group in
+                full_group_by(texts, lambda x: TextGroup(x.type, x.xloc, x.yloc))]
+
+    def __map_groups(self, func, groups):
+        """
+        Applies func to every group, on a thread pool if page is parallel
+        """
+        if self.__workers > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.__workers, len(groups))) as executor:
+                return list(executor.map(func, groups))
+
+        return [func(group) for group in groups]
+
+    def __map_texts(self, func, texts):
+        """
+        Applies func(key, group) to every group of text items. Text objects
+        of a batch are made one group at a time, by the call for the group
+        """
+        if isinstance(texts, TextBatch):
+            return self.__map_groups(lambda g: func(g[0], texts.texts(g[1])), texts.position_groups())
+        return self.__map_groups(lambda g: func(g[0], g[1]), self.group_texts(texts))
+
+    def layout_groups(self, groups):
+        """
+        Lays out groups made by Page.group_texts
+
+        :type groups: list[tuple(TextGroup, list[Text])]
+        :rtype: list[GroupLayout]
+        """
+        cache = LayoutCache(self.__font_metrics, self.__fonts)
+        return self.__map_groups(lambda g: self.__layout_group(g[0], g[1], cache), groups)
+
+    def draw_groups(self, group_layouts):
+        """
+        Draws every group into its own layers
+
+        :type group_layouts: list[GroupLayout]
+        :return: layers and keywords bounding boxes of every group
+        :rtype: list[tuple(list[Image], dict)]
+        """
+        return self.__map_groups(self.__draw_group, group_layouts)
+
+    def compose(self, rendered, out=None, base=None, highlight=True):
+        """
+        Composites the images (with and without keywords highlighted)
+
+        :param rendered: layers and bounding boxes of every group
+        :param out: array the image is composited into, see Page.render
+        :param base: image the layers are composited onto, see Page.render
+        :param highlight: makes the image with keywords bounding boxes
+        :rtype: RenderResult
+        """
+        size = (self.__width, self.__height)
+        if base is None:
+            result, array = new_canvas(size, out)
+        else:
+            base = open_base(base, size)
+            result, array = base, None
+            if out is not None:
+                result, array = new_canvas(size, out)
+                result.paste(base)
+
+        layers = []
+        bbox = {}
+        for images, group_bbox in rendered:
+            layers.extend(images)
+            self.__update_bbox_dict(group_bbox, bbox)
+
+        for layer in layers:
+            self.__composite_region(result, layer)
+
+        highimage = None
+        highlighted_array = None
+        if highlight and len(bbox):
+            overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+            self._draw_bbox(ImageDraw(overlay, mode="RGBA"), bbox)
+            highimage, highlighted_array = new_canvas(size)
+            highimage.paste(result)
+            self.__composite_region(highimage, overlay)
+
+        return RenderResult(result, highimage, BoxIndex(bbox), layers, (array, highlighted_array))
+
+    @staticmethod
+    def __composite_region(image, layer):
+        """
+        Composites layer onto image in place, blending only the region the layer covers
+        """
+        box = layer.getbbox()
+        if box is not None:
+            image.alpha_composite(layer, box[:2], box)
+
+    def __draw_group(self, group_layout):
+        """
+        Draws one text group into its own layers
+
+        :type group_layout: GroupLayout
+        :return: layers of the group and its keywords bounding boxes
+        :rtype: tuple(list[Image], dict)
+        """
+        images = []
+
+        for block in group_layout.blocks:
+            _, bgdraw = self.get_new_image(images)
+            _, draw = self.get_new_image(images)
+
+            if block.background is not None:
+                block.background.draw(bgdraw)
+
+            for text_layout in block.texts:
+                text_layout.draw(draw)
+
+        return images, group_layout.bbox
+
+    def __layout_group(self, key, group, cache):
+        """
+        :type key: TextGroup
+        :type group: list[Text]
+        :type cache: LayoutCache
+        :rtype: GroupLayout
+        """
+        type_ = key.type
+
+        if type_ == Type.default:
+            blocks = [self.__layout_bottom(group, cache)]
+        elif type_ == Type.polygon:
+            blocks = [self.__layout_polygon(p, cache) for p in group]
+        elif type_ == Type.callout:
+            blocks = [self.__layout_polygon(c, cache) for c in group]
+        else:
+            blocks = [self.__layout_side_group(key, group, cache)]
+
+        return GroupLayout(key, blocks)
+
+    def __layout_side_group(self, key, group, cache):
+        """
+        Lays out east and west sides of the page
 
+        :rtype: TextBlock
+        """
         # noinspection PyShadowingBuiltins
         type = key.type
         xloc = key.xloc
         yloc = key.yloc
         width = self.__width
 
-        _, bgdraw = self.get_new_image()
-        _, draw = self.get_new_image()
-
         if xloc == XLocation.left:
             x = width * 0.05 if type == Type.west else width * 0.55
             align = "left"
@@ -428,51 +1036,110 @@ class Page(object):
             align = "right"
 
         box_width = int(width * 0.3)
-        y = self.__calc_y_top(yloc, group)
+        y = self.__calc_y_top(yloc, group, box_width, cache)
         x_min = x
         x_max = 0
         y_min = y
 
+        texts = []
         for t in group:
-            split = self.__split_text(box_width, t)
+            split = self.__split_text(box_width, t, cache)
             spacing = split.spacing
-            font = split.font
 
-            draw.set_keywords(t.keywords)
-            bbox = draw.multiline_text((x, y), split.text, font=font,
-                                       fill=t.fgcolor, align=align, outline=t.fgcolor)
-            self.__update_bbox_dict(draw.bbox)
+            text_layout = self.__layout_multiline(t, split, (x, y), cache, align)
+            bbox = text_layout.box
+            texts.append(text_layout)
 
             x_min = min(x_min, bbox[0])
             x_max = max(x_max, bbox[2])
 
             y += split.size[1] + spacing
 
+        background = None
         bg = group[0].bgcolor
         if bg is not None:
-            bgdraw.rectangle([x_min, y_min, x_max, y], fill=bg)
+            background = Shape("rectangle", [x_min, y_min, x_max, y], fill=bg)
+
+        return TextBlock(background, texts)
+
+    def __layout_multiline(self, t, split, xy, cache, align="left"):
+        """
+        :type t: Text
+        :type split: SplitTextResult
+        :type cache: LayoutCache
+        :rtype: TextLayout
+        """
+        font = split.font
+        lines = split.lines or self.__text_helper._multiline_split(split.text)
+        line_spacing = cache.symbol_height(font) + 4
+        origins, widths, box = self.__text_helper.multiline_layout(xy, lines, font, align=align,
+                                                                   widths=split.widths, line_spacing=line_spacing)
+        return self.__text_layout(t, font, lines, origins, widths, box, cache)
+
+    def __text_layout(self, t, font, lines, origins, widths, box, cache):
+        """
+        Finds keywords bounding boxes of laid out lines
+
+        :type t: Text
+        :type cache: LayoutCache
+        :rtype: TextLayout
+        """
+        helper = self.__text_helper
+        line_spacing = cache.symbol_height(font) + 4
+        keyword_boxes = {}
+
+        for line, (left, top) in zip(lines, origins):
+            found = helper.keyword_boxes(t.keywords, font, left, line, line_spacing, t.fgcolor, top)
+            for kw, boxes in found.items():
+                keyword_boxes.setdefault(kw, []).extend(boxes)
 
-    def __split_text(self, box_width, t):
+        return TextLayout(t, font, lines, origins, widths, box, keyword_boxes)
+
+    def __split_text(self, box_width, t, cache):
         """
         Splits text if text width will be wider than box_width.
         Also, calculates space required, spacings and etc.
 
         :type box_width: int
         :type t: Text
+        :type cache: LayoutCache
+        :rtype: SplitTextResult
         """
+        key = (t, box_width)
+        split = cache.splits.get(key)
+        if split is not None:
+            return split
+
         style = self.__styles[t.style]
         line_height = style.line_height
-        font = ImageFont.truetype(style.font_face, size=style.font_size)
-        symbol_height = self.__text_helper.textsize('A', font=font)[1]
+        font = cache.font(style.font_face, style.font_size)
+        symbol_height = cache.symbol_height(font)
         spacing = line_height - symbol_height
 
-        split = self.__text_helper.split_text_to_multiline(t.value, font, box_width, spacing)
+        store = self.__layout_cache
+        split = None
+        if store is not None:
+            store_key = store.key("split", t.value, style.font_face, style.font_size, spacing, box_width,
+                                  measure=self.__measure())
+            stored = store.get(store_key)
+            if stored is not None:
+                split = SplitTextResult(stored["text"], tuple(stored["size"]), font,
+                                        lines=stored["lines"], widths=stored["widths"])
+
+        if split is None:
+            split = self.__text_helper.split_text_to_multiline(t.value, font, box_width, spacing,
+                                                               cache.widths(font))
+            if store is not None:
+                store.put(store_key, {"text": split.text, "size": split.size,
+                                      "lines": split.lines, "widths": split.widths})
+
         split.symbol_height = symbol_height
         split.spacing = spacing
 
+        cache.splits[key] = split
         return split
 
-    def __split_text_polygon(self, points, t):
+    def __split_text_polygon(self, points, t, cache):
         """
         Splits text if text width will be wider than box_width.
         Also, calculates space required, spacings and etc.
@@ -491,8 +1158,9 @@ class Page(object):
             y_max = max(y_max, point[1])
 
         style = self.__styles[t.style]
+        max_probes = cache.budget.max_probes if cache.budget is not None else sys.maxsize
 
-        def split(f_size, l_height):
+        def split(f_size, l_height, lines=None, widths=None, probes=1):
             polygon_texts = []
             y_traverse = y_min + l_height * 1.5
 
@@ -501,24 +1169,50 @@ class Page(object):
                 polygon_texts.append(pt)
                 y_traverse += l_height
 
-            font = ImageFont.truetype(style.font_face, size=f_size)
-            symbol_height = self.__text_helper.textsize('A', font=font)[1]
+            font = cache.font(style.font_face, f_size)
+            symbol_height = cache.symbol_height(font)
             spacing = l_height - symbol_height
 
-            try:
-                result = self.__text_helper.split_text_in_polygon2(t.value, font, points, spacing, polygon_texts)
-                result.symbol_height = symbol_height
-                result.spacing = spacing
-                result.y_start = y_min
-                result.polygon_texts = polygon_texts
-            except OutOfBoundsException:
-                return split(f_size - 1, l_height - 1)
-
+            if lines is not None:
+                result = PolygonTextSplitResult(lines, (0, 0), font)
+                cache.widths(font).update(zip(lines, widths))
+            else:
+                try:
+                    result = self.__text_helper.split_text_in_polygon2(t.value, font, points, spacing,
+                                                                       polygon_texts, cache.widths(font))
+                except OutOfBoundsException:
+                    step = 1
+                    if probes >= max_probes and cache.budget.degrade(POLYGON_PROBES):
+                        step = max(1, f_size // 4)
+                    return split(f_size - step, l_height - step, probes=probes + 1)
+
+            result.symbol_height = symbol_height
+            result.spacing = spacing
+            result.y_start = y_min
+            result.polygon_texts = polygon_texts
             return result
 
-        return split(style.font_size, style.line_height)
+        store = self.__layout_cache
+        if store is None:
+            return split(style.font_size, style.line_height)
+
+        store_key = store.key("polygon", t.value, style.font_face, style.font_size, style.line_height,
+                              freeze(points), measure=self.__measure())
+        stored = store.get(store_key)
+        if stored is not None:
+            return split(stored["font_size"], stored["line_height"], stored["lines"], stored["widths"])
+
+        result = split(style.font_size, style.line_height)
+        if cache.budget is not None and POLYGON_PROBES in cache.budget.applied:
+            # font size may be smaller than the one fitting the polygon
+            return result
+        widths = [self.__text_helper.text_width(line, result.font, cache.widths(result.font))
+                  for line in result.text]
+        store.put(store_key, {"font_size": result.font.size, "line_height": result.symbol_height + result.spacing,
+                              "lines": result.text, "widths": widths})
+        return result
 
-    def __calc_y_top(self, yloc, group):
+    def __calc_y_top(self, yloc, group, width, cache):
         """
         Calculates minimum Y for group
         """
@@ -527,7 +1221,6 @@ class Page(object):
             return 0
 
         height = self.__height
-        width = self.__width * 0.3
 
         if yloc == YLocation.top:
             return height * 0.05
@@ -537,11 +1230,11 @@ class Page(object):
         else:
             y = height * 0.95
 
-        return self.__calc_y_top_from_start_y(group, width, y, yloc)
+        return self.__calc_y_top_from_start_y(group, width, y, yloc, cache)
 
-    def __calc_y_top_from_start_y(self, group, width, y, yloc):
+    def __calc_y_top_from_start_y(self, group, width, y, yloc, cache):
         for t in group:
-            split = self.__split_text(width, t)
+            split = self.__split_text(width, t, cache)
             size = split.size
 
             if yloc == YLocation.center:
@@ -551,19 +1244,19 @@ class Page(object):
 
         return y
 
-    def __draw_bottom(self, group):
-        """
-        Draws the text at the bottom of page (texts with Type.default)
+    def __layout_bottom(self, group, cache):
         """
+        Lays out the text at the bottom of page (texts with Type.default)
 
-        _, bgdraw = self.get_new_image()
-        _, draw = self.get_new_image()
+        :rtype: TextBlock
+        """
 
+        margin = 3
         y = self.__height
 
         group_count = len(group)
         for idx, t in enumerate(group):
-            splitted = self.__split_text(self.__width, t)
+            splitted = self.__split_text(self.__width - 2 * margin, t, cache)
             symbol_size = splitted.symbol_height
             y -= splitted.size[1]
 
@@ -574,39 +1267,45 @@ class Page(object):
 
         y_min = y
 
+        texts = []
         for t in group:
-            margin = 3
-            splitted = self.__split_text(self.__width - 2 * margin, t)
+            splitted = self.__split_text(self.__width - 2 * margin, t, cache)
             symbol_size = splitted.symbol_height
-            font = splitted.font
 
-            draw.set_keywords(t.keywords)
-            draw.multiline_text((margin, y), splitted.text,
-                                fill=t.fgcolor, font=font, outline=t.fgcolor)
-            self.__update_bbox_dict(draw.bbox)
+            texts.append(self.__layout_multiline(t, splitted, (margin, y), cache))
 
             y += splitted.size[1] + symbol_size
 
+        background = None
         bg = group[0].bgcolor
         if bg is not None:
-            bgdraw.rectangle([0, y_min, self.__width, self.__height], fill=bg)
+            background = Shape("rectangle", [0, y_min, self.__width, self.__height], fill=bg)
+
+        return TextBlock(background, texts)
 
-    def get_new_image(self):
+    def get_new_image(self, images=None):
         """
+        :param images: layers list the new image is added to, page layers by default
         :rtype : tuple(Image, ImageDraw)
         """
+        if images is None:
+            images = self.__images
+
         image = Image.new("RGBA", (self.__width, self.__height), (0, 0, 0, 0))
-        draw = ImageDraw2(image, mode="RGBA")
-        self.__images.append(image)
+        draw = ImageDraw2(image, mode="RGBA", text_cache=self.__text_cache)
+        images.append(image)
         return image, draw
 
-    def __update_bbox_dict(self, bbox_dict):
+    def __update_bbox_dict(self, bbox_dict, target=None):
         """
-        Updates the internal bounding boxes dictionary
+        Updates the internal bounding boxes dictionary (or target one)
         """
+        if target is None:
+            target = self.__bbox
+
         for kw, boxes in bbox_dict.items():
-            arr = self.__bbox.get(kw, [])
-            self.__bbox[kw] = arr
+            arr = target.get(kw, [])
+            target[kw] = arr
 
             for box in boxes:
                 arr.append(box)
@@ -622,34 +1321,38 @@ class Page(object):
 
         self.__styles[style] = StyleInfo(font_size, line_height)
 
-    def __draw_polygon(self, t):
+    def __layout_polygon(self, t, cache):
         """
-        Draws polygon using Text.points
+        Lays out polygon using Text.points
 
         :type t: Text
+        :rtype: TextBlock
         """
         all_points = t.points
 
-        _, bgdraw = self.get_new_image()
-        _, text_draw = self.get_new_image()
-
-        # Draw polygon
+        # Polygon shape
         if t.type == Type.callout:
-            smoothed = smooth_points(all_points, self.__callout_smooth_factor, self.__callout_pointer_angle)
-            bgdraw.polygon(smoothed, fill=t.bgcolor, outline=t.bocolor)
+            budget = cache.budget
+            if budget is not None and budget.degrade(COARSE_BEZIER):
+                smoothed = smooth_points(all_points, self.__callout_smooth_factor, self.__callout_pointer_angle,
+                                         budget.bezier_segments)
+            else:
+                smoothed = smooth_points(all_points, self.__callout_smooth_factor, self.__callout_pointer_angle)
+            background = Shape("polygon", smoothed, fill=t.bgcolor, outline=t.bocolor)
         else:
-            bgdraw.polygon(all_points, fill=t.bgcolor, outline=t.bocolor)
+            background = Shape("polygon", all_points, fill=t.bgcolor, outline=t.bocolor)
 
         # remove pointer angle from polygon to recognize callout center
         points_no_pointer_angle = self.__get_points_without_pointer_angle(all_points)
 
-        split = self.__split_text_polygon(points_no_pointer_angle, t)
+        split = self.__split_text_polygon(points_no_pointer_angle, t, cache)
         font = split.font
 
-        text_draw.set_keywords(t.keywords)
-        text_draw.polygon_text(split.text, split.polygon_texts, font,
-                               fill=t.fgcolor, outline=t.fgcolor)
-        self.__update_bbox_dict(text_draw.bbox)
+        origins, widths = self.__text_helper.polygon_layout(split.text, split.polygon_texts, font,
+                                                            cache.widths(font))
+        text_layout = self.__text_layout(t, font, split.text, origins, widths, None, cache)
+
+        return TextBlock(background, [text_layout])
 
     def __get_points_without_pointer_angle(self, all_points):
         points_count = len(all_points)
@@ -667,24 +1370,304 @@ class Page(object):
 
         return points_no_callout_center
 
-    def _draw_bbox(self):
+    @staticmethod
+    def _draw_bbox(draw, bbox):
         """
         Draws bounding boxes to keywords highlighted image
+
+        :type draw: ImageDraw
+        :type bbox: dict
         """
 
-        for key, bbox_arr in self.__bbox.items():
+        for key, bbox_arr in bbox.items():
             for box in bbox_arr:
-                self.__high_draw.rectangle(box.box, outline=box.outline)
+                draw.rectangle(box.box, outline=box.outline)
+
+
+class LayoutCache(object):
+    """
+    Fonts, measurements and text splits shared by one layout pass
+    """
+
+    def __init__(self, metrics=None, loaded=None, budget=None):
+        """
+        :param metrics: tables fonts measure texts with, see Page.set_font_metrics
+        :param loaded: fonts loaded before, see Page.set_font_cache
+        :param budget: time of the pass, see Page.render
+        :type budget: TimeBudget
+        """
+        self.splits = {}
+        self.budget = budget
+        self.__metrics = metrics
+        self.__loaded = loaded
+        self.__fonts = {}
+        self.__widths = {}
+        self.__symbol_heights = {}
+
+    def font(self, font_face, font_size):
+        """
+        :rtype: ImageFont.FreeTypeFont
+        """
+        key = (font_face, font_size)
+        font = self.__fonts.get(key)
+        if font is None:
+            font = self.__load(key)
+            if self.__metrics is not None:
+                font = self.__metrics.measured(font_face, font)
+            font = self.__fonts.setdefault(key, font)
+        return font
+
+    def __load(self, key):
+        if self.__loaded is None:
+            return ImageFont.truetype(key[0], size=key[1])
+
+        font = self.__loaded.get(key)
+        if font is None:
+            font = self.__loaded.setdefault(key, ImageFont.truetype(key[0], size=key[1]))
+        return font
+
+    def widths(self, font):
+        """
+        Widths of text pieces measured with font
+
+        :rtype: dict
+        """
+        return self.__widths.setdefault(font, {})
+
+    def symbol_height(self, font):
+        height = self.__symbol_heights.get(font)
+        if height is None:
+            height = self.__symbol_heights[font] = font.getsize('A')[1]
+        return height
+
+
+class Shape(object):
+    def __init__(self, kind, xy, fill=None, outline=None):
+        """
+        :param kind: name of ImageDraw method drawing the shape ("rectangle" or "polygon")
+        :type xy: list
+        """
+        self.kind = kind
+        self.xy = xy
+        self.fill = fill
+        self.outline = outline
+
+    def draw(self, draw):
+        """
+        :type draw: ImageDraw
+        """
+        getattr(draw, self.kind)(self.xy, fill=self.fill, outline=self.outline)
+
+
+class TextLayout(object):
+    def __init__(self, text, font, lines, origins, widths, box, keyword_boxes):
+        """
+        :type text: Text
+        :type font: ImageFont.FreeTypeFont
+        :type lines: list[str]
+        :param origins: top left point of every line
+        :param widths: width of every line
+        :param box: bounding box of multiline text, None for polygon text
+        :param keyword_boxes: keywords bounding boxes
+        :type keyword_boxes: dict
+        """
+        self.text = text
+        self.font = font
+        self.lines = lines
+        self.origins = origins
+        self.widths = widths
+        self.box = box
+        self.keyword_boxes = keyword_boxes
+
+    @property
+    def font_size(self):
+        return self.font.size
+
+    def draw(self, draw):
+        """
+        :type draw: ImageDraw
+        """
+        for line, origin in zip(self.lines, self.origins):
+            draw.draw_line(origin, line, self.text.fgcolor, self.font)
+
+    def __str__(self):
+        return str.format("FS={0} Lines={1}", self.font_size, self.lines)
+
+
+class TextBlock(object):
+    def __init__(self, background, texts):
+        """
+        Texts drawn over the same background. Every block is rendered to
+        a background layer and a text layer.
+
+        :type background: Shape
+        :type texts: list[TextLayout]
+        """
+        self.background = background
+        self.texts = texts
+
+
+class GroupLayout(object):
+    def __init__(self, key, blocks):
+        """
+        :type key: TextGroup
+        :type blocks: list[TextBlock]
+        """
+        self.key = key
+        self.blocks = blocks
+
+    @property
+    def texts(self):
+        """
+        :rtype: list[TextLayout]
+        """
+        return [t for block in self.blocks for t in block.texts]
+
+    @property
+    def bbox(self):
+        """
+        Keywords bounding boxes of the group texts
+
+        :rtype: dict
+        """
+        bbox = {}
+        for t in self.texts:
+            for kw, boxes in t.keyword_boxes.items():
+                bbox.setdefault(kw, []).extend(boxes)
+        return bbox
+
+
+class PageLayout(object):
+    def __init__(self, width, height, groups):
+        """
+        :type groups: list[GroupLayout]
+        """
+        self.width = width
+        self.height = height
+        self.groups = groups
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def texts(self):
+        """
+        :rtype: list[TextLayout]
+        """
+        return [t for group in self.groups for t in group.texts]
+
+    @property
+    def bbox(self):
+        """
+        Keywords bounding boxes of the page, same as Page.generateTextImage returns
+
+        :rtype: dict
+        """
+        bbox = {}
+        for group in self.groups:
+            for kw, boxes in group.bbox.items():
+                bbox.setdefault(kw, []).extend(boxes)
+        return bbox
+
+
+class RenderResult(object):
+    def __init__(self, image, highlighted, bbox, images=None, arrays=None):
+        """
+        :type image: Image
+        :param highlighted: image with keywords bounding boxes, None if there are no keywords
+        :type bbox: dict
+        :param images: layers the image was composited from
+        :param arrays: numpy arrays image and highlighted are backed by, see new_canvas
+        """
+        self.image = image
+        self.highlighted = highlighted
+        self.bbox = bbox
+        self.images = images or []
+        self.degradations = []
+        self.__arrays = arrays or (None, None)
+
+    @staticmethod
+    def __as_array(image, array):
+        if image is not None and array is None:
+            if numpy is None:
+                raise ImportError("numpy is required for arrays")
+            # drawn on a base image which isn't backed by an array
+            array = numpy.asarray(image)
+        return array
+
+    @property
+    def array(self):
+        """
+        Image as numpy.uint8 array of shape (height, width, 4) sharing memory with it.
+        Copy of the image if it was drawn on a base image, which isn't an array.
+
+        :rtype: numpy.ndarray
+        """
+        return self.__as_array(self.image, self.__arrays[0])
+
+    @property
+    def highlighted_array(self):
+        """
+        Highlighted image as numpy.uint8 array sharing memory with it, None if there are no keywords
+
+        :rtype: numpy.ndarray
+        """
+        return self.__as_array(self.highlighted, self.__arrays[1])
+
+    def keyword_masks(self, keywords=None):
+        """
+        Masks of keywords bounding boxes
+
+        :param keywords: keywords to make masks for, all keywords if None
+        :type keywords: list[str]
+        :return: keywords to numpy.bool_ arrays of shape (height, width)
+        :rtype: dict
+        """
+        if numpy is None:
+            raise ImportError("numpy is required for arrays")
+
+        width, height = self.image.size
+        masks = {}
+        for kw in (self.bbox.keys() if keywords is None else keywords):
+            mask = masks[kw] = numpy.zeros((height, width), numpy.bool_)
+            for b in self.bbox.get(kw, []):
+                x0, y0, x1, y1 = b.box
+                mask[max(0, int(math.floor(y0))):max(0, int(math.ceil(y1)) + 1),
+                     max(0, int(math.floor(x0))):max(0, int(math.ceil(x1)) + 1)] = True
+        return masks
+
+    def save(self, imagefile, **params):
+        """
+        Saves image to imagefile and highlighted image next to it with "_hi" suffix.
+        Highlighted image of an earlier render is removed when there is none.
+
+        :type imagefile: str
+        :param params: encoder parameters, see Image.save
+        """
+        highl_filename = os.path.splitext(imagefile)[0] + "_hi.png"
+        # files may be hard links to entries of outputcache.OutputCache, which must not change
+        for filename in (imagefile, highl_filename):
+            if os.path.lexists(filename):
+                os.remove(filename)
+
+        self.image.save(imagefile, **params)
+        if self.highlighted is not None:
+            self.highlighted.save(highl_filename, **params)
 
 
 class SplitTextResult(object):
-    def __init__(self, text, size, font, y_start=0):
+    def __init__(self, text, size, font, y_start=0, lines=None, widths=None):
         """
         :type text: str
         :type size: tuple|list
         :type font: font
+        :param lines: lines of text, None if text wasn't split
+        :param widths: widths of lines
         """
         self.text = text
+        self.lines = lines
+        self.widths = widths
         self.size = size
         self.symbol_height = 10 if font is None else font.size
         self.font = font
@@ -750,10 +1733,14 @@ def get_word(line):
 
 
 class ImageDraw2(ImageDraw):
-    def __init__(self, im, mode=None):
+    def __init__(self, im, mode=None, text_cache=None):
+        """
+        :param text_cache: cache drawing lines of text, see Page.set_text_cache
+        """
         super(ImageDraw2, self).__init__(im, mode)
         self.__keywords = []
         self.__bbox = {}
+        self.text_cache = text_cache
 
     def set_keywords(self, keywords):
         """
@@ -765,23 +1752,71 @@ class ImageDraw2(ImageDraw):
     def bbox(self):
         return self.__bbox
 
+    def draw_line(self, xy, line, fill, font):
+        """
+        Draws single line of text, with text cache if it is set
+        """
+        if self.text_cache is None:
+            self.text(xy, line, fill, font, None)
+        else:
+            self.text_cache.draw_text(self, xy, line, fill, font)
+
+    def line_spacing(self, font, spacing=4):
+        """
+        Distance between tops of two lines of text
+        """
+        return self.textsize('A', font=font)[1] + spacing
+
     def polygon_text(self, text_lines, polygon_texts, font,
                      fill=None, outline=None, spacing=4):
         """
         :type polygon_texts: list[PolygonText]
         """
-        line_spacing = self.textsize('A', font=font)[1] + spacing
+        line_spacing = self.line_spacing(font, spacing)
+        origins, _ = self.polygon_layout(text_lines, polygon_texts, font)
+
+        for line, (left, top) in zip(text_lines, origins):
+            self.draw_line((left, top), line, fill, font)
+            self.__find_bounding_boxes(font, left, line, line_spacing, outline, top)
+
+    def text_width(self, text, font, width_cache=None):
+        """
+        :param width_cache: widths of already measured texts
+        :type width_cache: dict
+        """
+        if width_cache is None:
+            return self.textsize(text, font)[0]
+
+        width = width_cache.get(text)
+        if width is None:
+            width = width_cache[text] = self.textsize(text, font)[0]
+        return width
+
+    def polygon_layout(self, text_lines, polygon_texts, font, width_cache=None):
+        """
+        Calculates origins of lines centered in polygon rows
+
+        :type text_lines: list[str]
+        :type polygon_texts: list[PolygonText]
+        :type width_cache: dict
+        :return: origins and widths of lines
+        :rtype: tuple(list, list)
+        """
+        origins = []
+        widths = []
 
         for i, line in enumerate(text_lines):
             pt = polygon_texts[i]
             left = pt.x_start
             top = pt.y_top
-            real_width = self.textsize(line, font=font)[0]
+            real_width = self.text_width(line, font, width_cache)
             available_width = pt.text_width
             left += (max(0, available_width - real_width)) / 2
 
-            self.text((left, top), line, fill, font, None)
-            self.__find_bounding_boxes(font, left, line, line_spacing, outline, top)
+            origins.append((left, top))
+            widths.append(real_width)
+
+        return origins, widths
 
     def multiline_text(self, xy, text, fill=None, font=None, anchor=None, outline=None,
                        spacing=4, align="left"):
@@ -789,15 +1824,38 @@ class ImageDraw2(ImageDraw):
         Draws multiline text on the image
         """
 
-        widths = []
-        max_width = 0
         lines = self._multiline_split(text)
-        line_spacing = self.textsize('A', font=font)[1] + spacing
+        line_spacing = self.line_spacing(font, spacing)
+        origins, _, box = self.multiline_layout(xy, lines, font, spacing, align)
 
-        for line in lines:
-            line_width, line_height = self.textsize(line, font)
-            widths.append(line_width)
-            max_width = max(max_width, line_width)
+        for line, (left, top) in zip(lines, origins):
+            if anchor is None:
+                self.draw_line((left, top), line, fill, font)
+            else:
+                self.text((left, top), line, fill, font, anchor)
+
+            self.__find_bounding_boxes(font, left, line, line_spacing, outline, top)
+
+        return box
+
+    def multiline_layout(self, xy, lines, font, spacing=4, align="left", widths=None, line_spacing=None):
+        """
+        Calculates origins of aligned lines of multiline text
+
+        :type lines: list[str]
+        :param widths: already measured widths of lines
+        :param line_spacing: already measured line spacing
+        :return: origins and widths of lines and bounding box of text
+        :rtype: tuple(list, list, list)
+        """
+
+        if line_spacing is None:
+            line_spacing = self.line_spacing(font, spacing)
+
+        if widths is None:
+            widths = [self.textsize(line, font)[0] for line in lines]
+
+        max_width = max(widths) if widths else 0
 
         if align == "center":
             x = xy[0] - max_width / 2.0
@@ -810,6 +1868,7 @@ class ImageDraw2(ImageDraw):
 
         left, top = xy
         top_initial = top
+        origins = []
 
         lines_count = len(lines)
         for idx, line in enumerate(lines):
@@ -821,18 +1880,31 @@ class ImageDraw2(ImageDraw):
                 left += (max_width - widths[idx])
             else:
                 assert False, 'align must be "left", "center" or "right"'
-            self.text((left, top), line, fill, font, anchor)
-
-            self.__find_bounding_boxes(font, left, line, line_spacing, outline, top)
+            origins.append((left, top))
 
             left = xy[0]
             if idx != lines_count - 1:
                 top += line_spacing
 
-        return [left, top_initial, left + max_width, top]
+        return origins, widths, [left, top_initial, left + max_width, top]
 
     def __find_bounding_boxes(self, font, left, line, line_spacing, outline, top):
-        for kw in self.__keywords:
+        found = self.keyword_boxes(self.__keywords, font, left, line, line_spacing, outline, top)
+        for kw, boxes in found.items():
+            arr = self.__bbox.get(kw, [])
+            arr.extend(boxes)
+            self.__bbox[kw] = arr
+
+    def keyword_boxes(self, keywords, font, left, line, line_spacing, outline, top):
+        """
+        Finds bounding boxes of keywords in the line drawn at (left, top)
+
+        :type keywords: list[str]
+        :rtype: dict
+        """
+        result = {}
+
+        for kw in keywords:
             if kw in line:
                 index = 0
                 while index != -1:
@@ -844,15 +1916,16 @@ class ImageDraw2(ImageDraw):
                         text_start_x = left + skip_area[0] - 2
                         text_end_x = text_start_x + bbox[0] + 3
                         bbox = [text_start_x, top, text_end_x, top + line_spacing]
-                        # self.rectangle(bbox, outline=outline)
 
-                        arr = self.__bbox.get(kw, [])
+                        arr = result.get(kw, [])
                         arr.append(BoundingBox(bbox, outline))
-                        self.__bbox[kw] = arr
+                        result[kw] = arr
 
                         index += 1
 
-    def split_text_to_multiline(self, text, font, width, spacing):
+        return result
+
+    def split_text_to_multiline(self, text, font, width, spacing, width_cache=None):
         """
         Splits long text to multiline text if text don't fit in available width
 
@@ -860,34 +1933,43 @@ class ImageDraw2(ImageDraw):
         :type font: ImageFont
         :type width: int|float
         :type spacing: int
+        :param width_cache: widths of already measured texts
+        :type width_cache: dict
         """
         size = self.textsize(text, font)
         if size[0] < width:
-            return SplitTextResult(text, size, font)
+            if "\n" in text:
+                return SplitTextResult(text, size, font)
+            return SplitTextResult(text, size, font, lines=[text], widths=[size[0]])
 
         total_width = 0
         total_height = 0
+        line_spacing = self.line_spacing(font, spacing)
 
         lines = []
+        widths = []
         for line in text.splitlines():
-            w = textwrap2.TextWrapper(font, width=width)
-            line = w.fill(line)
-            w, h = self.multiline_textsize(line, font, spacing)
-            total_width = max(w, total_width)
-            total_height += h
-            lines.append(line)
+            w = textwrap2.TextWrapper(font, width=width, width_cache=width_cache)
+            wrapped = w.wrap(line) or [""]
+            wrapped_widths = [self.text_width(l, font, width_cache) for l in wrapped]
+            total_width = max(max(wrapped_widths), total_width)
+            total_height += len(wrapped) * line_spacing - spacing
+            lines.extend(wrapped)
+            widths.extend(wrapped_widths)
 
         result_text = "\n".join(lines)
         result_size = (total_width, total_height)
-        return SplitTextResult(result_text, result_size, font)
+        return SplitTextResult(result_text, result_size, font, lines=lines, widths=widths)
 
-    def split_text_in_polygon2(self, text, font, points, spacing, polygon_widths):
+    def split_text_in_polygon2(self, text, font, points, spacing, polygon_widths, width_cache=None):
         """
         :type text: str
         :type font: font
         :type points: list
         :type spacing: int|float
         :type polygon_widths: list[PolygonText]
+        :param width_cache: widths of already measured texts
+        :type width_cache: dict
         :rtype: PolygonTextSplitResult
         """
         result_lines = []
@@ -899,7 +1981,8 @@ class ImageDraw2(ImageDraw):
             if len(cur_text) == 0:
                 break
 
-            lines = textwrap2.wrap(font, poly_width.text_width, cur_text, max_lines=1, keep_excess=True)
+            lines = textwrap2.wrap(font, poly_width.text_width, cur_text, max_lines=1, keep_excess=True,
+                                   width_cache=width_cache)
 
             if len(lines) == 0:
                 cur_text = ""
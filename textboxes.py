@@ -0,0 +1,99 @@
+import re
+from array import array
+
+LINE = 0
+WORD = 1
+
+NUMBER_COLUMNS = (("page", "l"), ("group", "l"), ("index", "l"), ("line", "l"), ("level", "b"),
+                  ("font_size", "l"), ("x0", "f"), ("y0", "f"), ("x1", "f"), ("y1", "f"))
+
+_words = re.compile(r"\S+")
+
+
+class TextBoxes(object):
+    """
+    Boxes of all drawn lines and words in columns: page, group (position of
+    the group in the page layout), index (Text.index), line (number of the
+    line in the text), level (LINE or WORD), font_size, x0, y0, x1, y1 and
+    text. Numeric columns are arrays, see array.array, they may be wrapped
+    by numpy.frombuffer without copying.
+    """
+
+    def __init__(self):
+        for name, typecode in NUMBER_COLUMNS:
+            setattr(self, name, array(typecode))
+        self.text = []
+
+    def __len__(self):
+        return len(self.text)
+
+    @property
+    def columns(self):
+        """
+        :rtype: dict
+        """
+        columns = dict((name, getattr(self, name)) for name, _ in NUMBER_COLUMNS)
+        columns["text"] = self.text
+        return columns
+
+    def rows(self, level=None):
+        """
+        :param level: LINE or WORD, all boxes if None
+        :return: dicts of column values
+        :rtype: generator[dict]
+        """
+        names = [name for name, _ in NUMBER_COLUMNS] + ["text"]
+        for row in zip(*[self.columns[name] for name in names]):
+            if level is None or row[4] == level:
+                yield dict(zip(names, row))
+
+    def add(self, page, group, index, line, level, font_size, box, text):
+        for (name, _), value in zip(NUMBER_COLUMNS, (page, group, index, line, level, font_size) + tuple(box)):
+            getattr(self, name).append(value)
+        self.text.append(text)
+
+    def add_layout(self, layout, page=0):
+        """
+        Adds boxes of lines and words of every text of the page layout. Words
+        are placed by advances of the pieces of the line measured one after
+        another, the line is measured once.
+
+        :type layout: text.PageLayout
+        :param page: index of the page
+        """
+        for group, group_layout in enumerate(layout.groups):
+            for text_layout in group_layout.texts:
+                self.__add_text(page, group, text_layout)
+
+    def __add_text(self, page, group, text_layout):
+        font = text_layout.font
+        ascent, descent = font.getmetrics()
+        index = text_layout.text.index
+
+        for number, (line, (left, top), width) in enumerate(zip(text_layout.lines, text_layout.origins,
+                                                               text_layout.widths)):
+            bottom = top + ascent + descent
+            self.add(page, group, index, number, LINE, font.size, (left, top, left + width, bottom), line)
+
+            offset = 0.
+            end = 0
+            for word in _words.finditer(line):
+                if word.start() > end:
+                    offset += font.getlength(line[end:word.start()])
+                advance = font.getlength(word.group())
+                self.add(page, group, index, number, WORD, font.size,
+                         (left + offset, top, left + offset + advance, bottom), word.group())
+                offset += advance
+                end = word.end()
+
+
+def text_boxes(layout, page=0):
+    """
+    Boxes of lines and words of the page layout, see TextBoxes
+
+    :type layout: text.PageLayout
+    :rtype: TextBoxes
+    """
+    boxes = TextBoxes()
+    boxes.add_layout(layout, page)
+    return boxes
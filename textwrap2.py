@@ -68,6 +68,9 @@ class TextWrapper:
         Truncate wrapped lines.
       placeholder (default: ' [...]')
         Append to the last line of truncated text.
+      width_cache (default: None)
+        Dict of already measured widths shared between wrappers of the
+        same font.
     """
 
     unicode_whitespace_trans = {}
@@ -129,7 +132,8 @@ class TextWrapper:
                  *,
                  max_lines=None,
                  keep_excess=False,
-                 placeholder=' [...]'):
+                 placeholder=' [...]',
+                 width_cache=None):
         self.font = font
         self.width = width
         self.initial_indent = initial_indent
@@ -144,6 +148,7 @@ class TextWrapper:
         self.max_lines = max_lines
         self.placeholder = placeholder
         self.keep_excess= keep_excess
+        self.width_cache = width_cache
 
     # -- Private methods -----------------------------------------------
     # (possibly useful for subclasses to override)
@@ -347,7 +352,14 @@ class TextWrapper:
         return lines
 
     def get_width(self, text):
-        return self.font.getsize(text)[0]
+        cache = self.width_cache
+        if cache is None:
+            return self.font.getsize(text)[0]
+
+        width = cache.get(text)
+        if width is None:
+            width = cache[text] = self.font.getsize(text)[0]
+        return width
 
     def _split_chunks(self, text):
         text = self._munge_whitespace(text)